@@ -0,0 +1,151 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import asyncio
+import json
+import logging
+
+from mal_analytics.scheduler import INGEST
+from mal_analytics.scheduler import INTERACTIVE
+from mal_analytics.scheduler import QueryScheduler
+from mal_analytics.trace_reader import ObjectSplitter
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _load_chunk(dbm, pob, json_strings, final):
+    pob.parse_trace_stream([json.loads(s) for s in json_strings])
+    if final:
+        pob.flush_pending_events()
+    dbm.load_parsed_data(pob)
+
+
+class AsyncDatabaseManager(object):
+    """An :mod:`asyncio` facade for a :class:`mal_analytics.db_manager.DatabaseManager`.
+
+    The blocking MonetDBLite calls run on the worker thread of a
+    :class:`mal_analytics.scheduler.QueryScheduler`, so they do not
+    block the event loop, and queries take priority over ingestion.
+
+    Coroutines can be cancelled or given a timeout. A cancelled
+    request that has not started is dropped. A request that is
+    already running on the worker thread runs to completion, but its
+    result is discarded.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        chunk_objects: The number of JSON objects parsed and loaded in
+            every step of :meth:`ingest`.
+    """
+
+    def __init__(self, dbm, chunk_objects=5000):
+        self._dbm = dbm
+        self._chunk_objects = chunk_objects
+        self._scheduler = QueryScheduler(dbm, chunk_objects)
+
+    def get_scheduler(self):
+        """Get the scheduler running the requests.
+
+        Returns:
+            A :class:`mal_analytics.scheduler.QueryScheduler` object.
+        """
+        return self._scheduler
+
+    async def call(self, fcn, *args, priority=INTERACTIVE, timeout=None):
+        """Run a blocking call on the database worker thread.
+
+        Args:
+            fcn: The callable.
+            priority: The priority of the request (see
+                :mod:`mal_analytics.scheduler`).
+            timeout: The maximum time to wait in seconds, or ``None``.
+
+        Returns:
+            The return value of ``fcn(*args)``.
+
+        Raises:
+            :class:`asyncio.TimeoutError`: if the call does not
+                complete in time.
+        """
+        future = self._scheduler.submit(fcn, *args, priority=priority)
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+    async def query(self, query, params=None, timeout=None):
+        """Execute a query.
+
+        See :meth:`mal_analytics.db_manager.DatabaseManager.execute_query`.
+
+        Args:
+            query: The text of the query.
+            params: The parameters of the query.
+            timeout: The maximum time to wait in seconds, or ``None``.
+
+        Returns:
+            The results.
+        """
+        return await self.call(self._dbm.execute_query, query, params, timeout=timeout)
+
+    async def ingest(self, stream, compact=False, timeout=None):
+        """Ingest a trace from an asynchronous stream.
+
+        The trace is loaded in chunks of ``chunk_objects`` JSON
+        objects, each one in its own transaction. If the ingestion
+        fails, is cancelled, or times out, the chunks loaded up to
+        that point stay in the database. Ingestions do not overlap,
+        with each other or with
+        :meth:`mal_analytics.scheduler.QueryScheduler.parse_trace`, and
+        the constraints are restored once at the end (see
+        :meth:`mal_analytics.scheduler.QueryScheduler.begin_ingest`).
+
+        Args:
+            stream: An asynchronous iterable of bytes or strings, for
+                instance an :class:`asyncio.StreamReader`.
+            compact: Do not store the start events of completed
+                instructions.
+            timeout: The maximum time for the whole ingestion in
+                seconds, or ``None``.
+
+        Returns:
+            The number of JSON objects loaded.
+        """
+        return await asyncio.wait_for(self._ingest(stream, compact), timeout)
+
+    async def _ingest(self, stream, compact):
+        begin = self._scheduler.begin_ingest(compact)
+        try:
+            pob = await asyncio.wrap_future(begin)
+        except asyncio.CancelledError:
+            # A request that already started runs to completion, and
+            # the ingestion it began has to be ended.
+            begin.add_done_callback(self._end_abandoned_ingest)
+            raise
+
+        try:
+            splitter = ObjectSplitter()
+            chunk = list()
+            loaded = 0
+            async for data in stream:
+                chunk.extend(splitter.feed(data))
+                if len(chunk) >= self._chunk_objects:
+                    await self.call(_load_chunk, self._dbm, pob, chunk, False, priority=INGEST)
+                    loaded += len(chunk)
+                    chunk = list()
+
+            chunk.extend(splitter.close())
+            await self.call(_load_chunk, self._dbm, pob, chunk, True, priority=INGEST)
+        finally:
+            await asyncio.shield(asyncio.wrap_future(self._scheduler.end_ingest()))
+
+        return loaded + len(chunk)
+
+    def _end_abandoned_ingest(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self._scheduler.end_ingest()
+
+    async def close(self):
+        """Wait for the pending requests and stop the worker thread."""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, self._scheduler.shutdown)
@@ -0,0 +1,43 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Benchmarks for the ingestion and the query performance of a trace database.
+"""
+
+import os
+import platform
+import subprocess
+
+
+def build_info():
+    """Describe the code being measured, so that results of different
+    releases can be told apart.
+
+    Returns:
+        A dictionary with the ``version`` of the package, the git
+        ``revision`` of the source tree (``None`` if it is not a git
+        checkout), and the ``python`` version and ``platform``.
+    """
+    try:
+        import pkg_resources
+        version = pkg_resources.get_distribution('mal_analytics').version
+    except Exception:
+        version = None
+
+    try:
+        revision = subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+
+    return {
+        'version': version,
+        'revision': revision,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
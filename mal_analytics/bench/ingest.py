@@ -0,0 +1,347 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Time every stage of the ingestion of a trace.
+
+The benchmark generates synthetic traces (see
+:mod:`mal_analytics.synthetic`) for a matrix of sizes and shapes, and
+loads every one of them into a new database, timing the stages
+separately:
+
+* ``read``: opening and decompressing the file.
+* ``framing``: splitting the text into JSON objects.
+* ``decode``: ``json.loads``.
+* ``parse``: ``ProfilerObjectParser.parse_trace_stream``.
+* ``drop_constraints``, ``insert``, ``enforce_constraints``,
+  ``add_constraints`` and ``commit``: the steps of
+  ``DatabaseManager.load_parsed_data``.
+
+It also records the peak resident set size of the process and the peak
+memory allocated by Python while decoding and parsing (measured with
+:mod:`tracemalloc` in a separate pass, since tracing slows everything
+down). Every case runs in a new process, as MonetDBLite can open only
+one database per process.
+
+The results are written as JSON and can be compared with the results
+of an earlier run::
+
+    python -m mal_analytics.bench.ingest /tmp/bench --output new.json --baseline old.json
+
+The command exits with status 1 if any metric of any case is slower
+(or larger) than the baseline by more than the threshold.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import tracemalloc
+from io import StringIO
+
+from mal_analytics import trace_reader
+from mal_analytics.bench import build_info
+from mal_analytics.db_manager import DatabaseManager
+from mal_analytics.profiler_parser import ProfilerObjectParser
+from mal_analytics.synthetic import TraceGenerator
+
+LOGGER = logging.getLogger(__name__)
+
+# Arguments of TraceGenerator for every trace size and shape.
+SIZES = {
+    'small': {'executions': 20},
+    'medium': {'executions': 200},
+    'large': {'executions': 2000},
+}
+
+SHAPES = {
+    'flat': {'sessions': 1, 'instructions': 100},
+    'udf': {'sessions': 2, 'instructions': 40, 'call_depth': 3},
+    'distributed': {'sessions': 2, 'instructions': 40, 'workers': 4},
+    'heartbeats': {'sessions': 4, 'instructions': 40, 'heartbeat_interval': 500},
+}
+
+STAGES = ['read', 'framing', 'decode', 'parse', 'drop_constraints', 'insert',
+          'enforce_constraints', 'add_constraints', 'commit']
+
+# The metrics compared with the baseline. For all of them lower is
+# better.
+COMPARED_METRICS = STAGES + ['total', 'peak_rss_kb', 'python_peak_bytes']
+
+DEFAULT_THRESHOLD = 0.2
+
+
+def _peak_rss_kb():
+    try:
+        import resource
+    except ImportError:  # pragma: no coverage
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _split_objects(text):
+    strings = list()
+    with StringIO(text) as fl:
+        json_string = trace_reader.read_object(fl)
+        while json_string:
+            strings.append(json_string)
+            json_string = trace_reader.read_object(fl)
+    return strings
+
+
+def run_case(dbpath, filename, compact=False, trace_memory=True):
+    """Load a trace into a new database, timing every stage.
+
+    This opens a database, so it should run in a process that has not
+    opened any other.
+
+    Args:
+        dbpath: The directory of the new database.
+        filename: The path of the trace.
+        compact: Do not store the start events of completed
+            instructions.
+        trace_memory: Measure the memory allocated by Python while
+            decoding and parsing.
+
+    Returns:
+        A dictionary with the time in seconds of every stage (see
+        :data:`STAGES`), the ``total`` time, and the number of
+        ``bytes``, ``objects`` and inserted ``rows``, the
+        ``peak_rss_kb`` and the ``python_peak_bytes``.
+    """
+    timings = dict()
+
+    def timed(stage, fcn, *args):
+        start = time.perf_counter()
+        result = fcn(*args)
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - start
+        return result
+
+    def read():
+        with trace_reader.abstract_open(filename) as fl:
+            return fl.read()
+
+    text = timed('read', read)
+    strings = timed('framing', _split_objects, text)
+    objects = timed('decode', lambda: [json.loads(s) for s in strings])
+
+    dbm = DatabaseManager(dbpath)
+    try:
+        pob = dbm.create_parser(compact)
+        timed('parse', pob.parse_trace_stream, objects)
+        pob.flush_pending_events()
+
+        rows = 0
+        dbm.transaction()
+        timed('drop_constraints', dbm.drop_constraints)
+        for table, data in pob.iter_data():
+            timed('insert', dbm.insert_data, table, data)
+            rows += len(next(iter(data.values())))
+        timed('enforce_constraints', dbm._enforce_constraints)
+        timed('add_constraints', dbm.add_constraints)
+        timed('commit', dbm.commit)
+        pob.clear_internal_state()
+    finally:
+        dbm.close_database()
+
+    results = dict(timings)
+    results['total'] = sum(timings.values())
+    results['bytes'] = len(text)
+    results['objects'] = len(objects)
+    results['rows'] = rows
+    results['peak_rss_kb'] = _peak_rss_kb()
+
+    del text, objects
+    results['python_peak_bytes'] = None
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            with trace_reader.abstract_open(filename) as fl:
+                objects = [json.loads(s) for s in _split_objects(fl.read())]
+            pob = ProfilerObjectParser(compact=compact)
+            pob.parse_trace_stream(objects)
+            results['python_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return results
+
+
+def generate_traces(directory, sizes, shapes, compression=None, seed=0):
+    """Write the traces of the benchmark matrix.
+
+    Traces that already exist are not written again, since the
+    generator is deterministic.
+
+    Args:
+        directory: Where to write the traces.
+        sizes: The names of the sizes (see :data:`SIZES`).
+        shapes: The names of the shapes (see :data:`SHAPES`).
+        compression: ``None``, ``gz`` or ``bz2``.
+        seed: The seed of the generator.
+
+    Returns:
+        A list of (case name, filename) tuples.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    traces = list()
+    for shape in shapes:
+        for size in sizes:
+            name = '{}_{}'.format(shape, size)
+            filename = os.path.join(directory, '{}_{}.json'.format(name, seed))
+            if compression is not None:
+                filename += '.' + compression
+            if not os.path.exists(filename):
+                arguments = dict(SHAPES[shape])
+                arguments.update(SIZES[size])
+                TraceGenerator(seed=seed, **arguments).write_trace(filename + '.tmp', compression)
+                os.rename(filename + '.tmp', filename)
+            traces.append((name, filename))
+
+    return traces
+
+
+def run_matrix(directory, sizes=('small', 'medium'), shapes=tuple(sorted(SHAPES)),
+               compression=None, compact=False, repeat=1, trace_memory=True):
+    """Run the benchmark for every combination of trace size and shape.
+
+    Args:
+        directory: A work directory for the traces and the databases.
+        sizes: The names of the sizes (see :data:`SIZES`).
+        shapes: The names of the shapes (see :data:`SHAPES`).
+        compression: Compress the traces with ``gz`` or ``bz2``.
+        compact: Load in compact mode.
+        repeat: The number of runs of every case. The run with the
+            smallest total time is kept.
+        trace_memory: Measure the memory allocated by Python.
+
+    Returns:
+        A dictionary with the ``build`` information (see
+        :func:`mal_analytics.bench.build_info`), the ``parameters`` of
+        the run and the results of every ``case`` (see
+        :func:`run_case`).
+    """
+    context = multiprocessing.get_context('spawn')
+    cases = dict()
+    for name, filename in generate_traces(directory, sizes, shapes, compression):
+        best = None
+        for i in range(repeat):
+            dbpath = os.path.join(directory, 'db_{}_{}'.format(name, i))
+            shutil.rmtree(dbpath, ignore_errors=True)
+            pool = context.Pool(1)
+            try:
+                results = pool.apply(run_case, (dbpath, filename, compact, trace_memory))
+            finally:
+                pool.close()
+                pool.join()
+                shutil.rmtree(dbpath, ignore_errors=True)
+            if best is None or results['total'] < best['total']:
+                best = results
+        LOGGER.info("%s: %.3f s, %d objects", name, best['total'], best['objects'])
+        cases[name] = best
+
+    return {
+        'build': build_info(),
+        'parameters': {
+            'compression': compression,
+            'compact': compact,
+            'repeat': repeat,
+        },
+        'cases': cases,
+    }
+
+
+def compare(results, baseline, thresholds=None, default_threshold=DEFAULT_THRESHOLD):
+    """Find the metrics that regressed compared to a baseline.
+
+    Only the cases and the metrics present in both results are
+    compared.
+
+    Args:
+        results: The results of :func:`run_matrix`.
+        baseline: Earlier results of :func:`run_matrix`.
+        thresholds: A dictionary with keys metric names and values the
+            largest acceptable relative increase (0.2 means 20%).
+        default_threshold: The threshold of the metrics not in
+            ``thresholds``.
+
+    Returns:
+        A list of (case, metric, baseline value, current value)
+        tuples, one for every regression.
+    """
+    thresholds = thresholds or dict()
+    regressions = list()
+    for case, current in sorted(results['cases'].items()):
+        previous = baseline['cases'].get(case)
+        if previous is None:
+            continue
+        for metric in COMPARED_METRICS:
+            old = previous.get(metric)
+            new = current.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + thresholds.get(metric, default_threshold)):
+                regressions.append((case, metric, old, new))
+
+    return regressions
+
+
+def _threshold(value):
+    metric, _, fraction = value.partition('=')
+    if metric not in COMPARED_METRICS:
+        raise argparse.ArgumentTypeError("Unknown metric {}".format(metric))
+    return metric, float(fraction)
+
+
+def main(argv=None):  # pragma: no coverage
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory', help='Work directory for the traces and the databases')
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES), default=['small', 'medium'])
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=sorted(SHAPES))
+    parser.add_argument('--compression', choices=['gz', 'bz2'], default=None)
+    parser.add_argument('--compact', action='store_true', help='Load in compact mode')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs of every case')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='Do not measure the memory allocated by Python')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Acceptable relative increase of every metric')
+    parser.add_argument('--metric-threshold', type=_threshold, action='append', default=[],
+                        metavar='METRIC=FRACTION', help='Threshold for a single metric')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    results = run_matrix(args.directory, args.sizes, args.shapes, args.compression,
+                         args.compact, args.repeat, not args.no_tracemalloc)
+    if args.output:
+        with open(args.output, 'w') as fl:
+            json.dump(results, fl, indent=2, sort_keys=True)
+
+    print("{:<24} {:>9} {:>9} {:>9} {:>9} {:>10} {:>10}".format(
+        'case', 'read', 'decode', 'parse', 'insert', 'total (s)', 'rss (MB)'))
+    for name, res in sorted(results['cases'].items()):
+        print("{:<24} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f} {:>10.3f} {:>10.1f}".format(
+            name, res['read'] + res['framing'], res['decode'], res['parse'], res['insert'],
+            res['total'], (res['peak_rss_kb'] or 0) / 1024))
+
+    if args.baseline:
+        with open(args.baseline) as fl:
+            baseline = json.load(fl)
+        regressions = compare(results, baseline, dict(args.metric_threshold), args.threshold)
+        for case, metric, old, new in regressions:
+            print("REGRESSION {} {}: {:.4g} -> {:.4g}".format(case, metric, old, new))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':  # pragma: no coverage
+    main()
@@ -0,0 +1,446 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Time the queries that follow the hot analytic access paths.
+
+The index benchmark runs every query with and without the secondary
+indexes defined in ``data/add_indexes.sql`` and reports the median
+time of each. It can be run from the command line::
+
+    python -m mal_analytics.bench.queries /path/to/db [trace ...]
+
+Any traces given are loaded into the database before the benchmark
+starts.
+
+The analytic benchmark (``--analytic``) times the queries of
+:data:`ANALYTIC_QUERIES` on a large synthetic database, which is built
+the first time (see :func:`build_benchmark_database`). Every query
+runs in a new process that opens the database: the first run is
+reported as the *cold* time and the median of the following runs as
+the *warm* time. The cold run only starts with a new database engine;
+the pages of the database may still be in the page cache of the
+operating system::
+
+    python -m mal_analytics.bench.queries /path/to/db --analytic --scale 2000
+"""
+
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import statistics
+import time
+
+from mal_analytics import trace_reader
+from mal_analytics.db_manager import DatabaseManager
+from mal_analytics.exceptions import QueryError
+from mal_analytics.synthetic import TraceGenerator
+
+LOGGER = logging.getLogger(__name__)
+
+# Each query is described by a name, the SQL text and the name of the
+# sample parameters it needs (see sample_parameters).
+INDEX_QUERIES = [
+    (
+        'events_by_execution_pc',
+        "SELECT count(*) AS cnt FROM profiler_event WHERE mal_execution_id=%s AND pc=%s",
+        ('execution_id', 'pc')
+    ),
+    (
+        'variable_by_name',
+        "SELECT variable_id FROM mal_variable WHERE mal_execution_id=%s AND name=%s",
+        ('execution_id', 'variable_name')
+    ),
+    (
+        'events_by_variable',
+        "SELECT event_id FROM event_variable_list WHERE variable_id=%s",
+        ('variable_id',)
+    ),
+    (
+        'instructions_by_execution',
+        "SELECT sum(duration) AS total FROM instructions WHERE mal_execution_id=%s",
+        ('execution_id',)
+    ),
+    (
+        'heartbeats_by_session',
+        "SELECT count(*) AS cnt FROM heartbeat WHERE server_session=%s AND ctime BETWEEN %s AND %s",
+        ('server_session', 'ctime_low', 'ctime_high')
+    ),
+]
+
+
+def call_graph(dbm, execution_id):
+    """Find all the executions initiated, directly or not, by an execution.
+
+    The ``initiates_executions`` relation is walked one level at a
+    time, since recursive queries are not available.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        execution_id: The execution to start from.
+
+    Returns:
+        A list of (parent, child) execution id tuples.
+    """
+    edges = list()
+    seen = set([execution_id])
+    frontier = [execution_id]
+    while frontier:
+        rslt = dbm.execute_query(
+            "SELECT parent_id, child_id FROM initiates_executions WHERE parent_id IN ({}) AND parent_id <> child_id".format(
+                ", ".join(["%s"] * len(frontier))),
+            frontier)
+        frontier = list()
+        for parent, child in zip(rslt['parent_id'].tolist(), rslt['child_id'].tolist()):
+            edges.append((parent, child))
+            if child not in seen:
+                seen.add(child)
+                frontier.append(child)
+
+    return edges
+
+
+# The queries of the analytic benchmark. A query can also be a
+# function, called with the database manager and the parameters.
+ANALYTIC_QUERIES = [
+    (
+        'instructions_view',
+        "SELECT mal_execution_id, count(*) AS cnt, sum(duration) AS total FROM instructions GROUP BY mal_execution_id",
+        ()
+    ),
+    (
+        'query_totals',
+        "SELECT q.query_id, count(*) AS cnt, sum(i.duration) AS total FROM query AS q JOIN initiates_executions AS ie ON ie.parent_id=q.root_execution_id JOIN instruction_run AS i ON i.mal_execution_id=ie.child_id GROUP BY q.query_id",
+        ()
+    ),
+    (
+        'top_slow_instructions',
+        "SELECT mal_execution_id, pc, short_statement, duration FROM instruction_run ORDER BY duration DESC LIMIT 20",
+        ()
+    ),
+    (
+        'heartbeat_window',
+        "SELECT count(*) AS cnt, avg(h.rss) AS rss, avg(c.val) AS load FROM heartbeat AS h JOIN cpuload AS c ON c.heartbeat_id=h.heartbeat_id WHERE h.server_session=%s AND h.ctime BETWEEN %s AND %s",
+        ('server_session', 'ctime_low', 'ctime_high')
+    ),
+    (
+        'variable_lookup',
+        "SELECT v.variable_id, v.type_id, v.var_size, e.pc, e.execution_state FROM mal_variable AS v JOIN event_variable_list AS l ON l.variable_id=v.variable_id JOIN profiler_event AS e ON e.event_id=l.event_id WHERE v.mal_execution_id=%s AND v.name=%s",
+        ('execution_id', 'variable_name')
+    ),
+    (
+        'call_graph',
+        call_graph,
+        ('root_execution_id',)
+    ),
+]
+
+
+def sample_parameters(dbm):
+    """Pick parameter values that exist in the database.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+
+    Returns:
+        A dictionary with the sample values. Values for tables without
+        data are ``None``.
+    """
+    samples = dict()
+
+    middle = "SELECT {columns} FROM {table} ORDER BY {key} LIMIT 1 OFFSET {offset}"
+
+    def middle_row(table, key, columns):
+        count = dbm.execute_query("SELECT count(*) AS cnt FROM {}".format(table))
+        return dbm.execute_query(middle.format(
+            columns=columns, table=table, key=key, offset=int(count['cnt'][0]) // 2))
+
+    rslt = middle_row('profiler_event', 'event_id', 'mal_execution_id, pc')
+    if rslt is not None and len(rslt['pc']) > 0:
+        # numpy integers are not accepted as query parameters
+        samples['execution_id'] = int(rslt['mal_execution_id'][0])
+        samples['pc'] = int(rslt['pc'][0])
+
+    rslt = middle_row('mal_variable', 'variable_id', 'variable_id, mal_execution_id, name')
+    if rslt is not None and len(rslt['name']) > 0:
+        samples['variable_id'] = int(rslt['variable_id'][0])
+        samples['variable_name'] = str(rslt['name'][0])
+
+    rslt = middle_row('query', 'query_id', 'root_execution_id')
+    if rslt is not None and len(rslt['root_execution_id']) > 0:
+        samples['root_execution_id'] = int(rslt['root_execution_id'][0])
+
+    rslt = dbm.execute_query(
+        "SELECT server_session, min(ctime) AS low, max(ctime) AS high FROM heartbeat GROUP BY server_session LIMIT 1")
+    if rslt is not None and len(rslt['server_session']) > 0:
+        low = int(rslt['low'][0])
+        high = int(rslt['high'][0])
+        samples['server_session'] = str(rslt['server_session'][0])
+        samples['ctime_low'] = low + (high - low) // 4
+        samples['ctime_high'] = high - (high - low) // 4
+
+    return samples
+
+
+def _run_query(dbm, query, params):
+    # execute_query logs failures and returns None, which would be
+    # timed as a fast query.
+    if callable(query):
+        return query(dbm, *params)
+    results = dbm.execute_query(query, params)
+    if results is None:
+        raise QueryError("Query failed: {}".format(query))
+    return results
+
+
+def time_queries(dbm, queries, samples, repeat=5):
+    """Run each query a number of times and record the median time.
+
+    Queries whose parameters are not available in ``samples`` are
+    skipped.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        queries: A list of (name, SQL text, parameter names) tuples.
+        samples: The parameter values (see :func:`sample_parameters`).
+        repeat: How many times each query is executed.
+
+    Returns:
+        A dictionary with keys the query names and values the median
+        time in seconds.
+
+    Raises:
+        :class:`mal_analytics.exceptions.QueryError`: if a query fails.
+    """
+    timings = dict()
+    for name, query, param_names in queries:
+        if any([samples.get(p) is None for p in param_names]):
+            LOGGER.warning("No data for query %s, skipping", name)
+            continue
+        params = [samples[p] for p in param_names]
+        runs = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            _run_query(dbm, query, params)
+            runs.append(time.perf_counter() - start)
+        timings[name] = statistics.median(runs)
+
+    return timings
+
+
+def run_index_benchmark(dbm, repeat=5):
+    """Compare the query times with and without the secondary indexes.
+
+    The database is left with the indexes in the same state as it
+    was found.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        repeat: How many times each query is executed.
+
+    Returns:
+        A dictionary with keys the query names and values dictionaries
+        with the keys ``without_indexes`` and ``with_indexes``.
+    """
+    had_indexes = dbm.has_indexes()
+    samples = sample_parameters(dbm)
+
+    if had_indexes:
+        dbm.drop_indexes()
+    without_indexes = time_queries(dbm, INDEX_QUERIES, samples, repeat)
+
+    start = time.perf_counter()
+    dbm.add_indexes()
+    LOGGER.info("Building indexes took %.3f s", time.perf_counter() - start)
+    with_indexes = time_queries(dbm, INDEX_QUERIES, samples, repeat)
+
+    if not had_indexes:
+        dbm.drop_indexes()
+
+    return dict([
+        (name, {
+            'without_indexes': without_indexes[name],
+            'with_indexes': with_indexes[name],
+        }) for name in without_indexes
+    ])
+
+
+# The shape of the synthetic traces of the analytic benchmark. The
+# number of queries per session is given by the scale.
+BENCHMARK_SHAPE = {
+    'sessions': 4,
+    'instructions': 100,
+    'threads': 8,
+    'call_depth': 2,
+    'workers': 2,
+    'heartbeat_interval': 1000,
+}
+
+
+def build_benchmark_database(dbpath, scale=1000, seed=0, indexes=False, chunk_objects=100000):
+    """Build the database of the analytic benchmark from a synthetic trace.
+
+    The trace is generated and loaded in chunks with
+    :meth:`mal_analytics.db_manager.DatabaseManager.bulk_load`, so it
+    is never held in memory as a whole. This function opens a
+    database, so it should run in a process that has not opened any
+    other.
+
+    Args:
+        dbpath: The directory of the new database.
+        scale: The number of queries per session (see
+            :data:`BENCHMARK_SHAPE`).
+        seed: The seed of the trace generator.
+        indexes: Build the secondary indexes after loading.
+        chunk_objects: The number of JSON objects loaded at a time.
+
+    Returns:
+        The number of JSON objects loaded.
+    """
+    objects = iter(TraceGenerator(seed=seed, executions=scale, **BENCHMARK_SHAPE))
+    chunks = iter(lambda: list(itertools.islice(objects, chunk_objects)), [])
+
+    dbm = DatabaseManager(dbpath)
+    try:
+        loaded = dbm.bulk_load(dbm.create_parser(), chunks)
+        if indexes:
+            dbm.add_indexes()
+    finally:
+        dbm.close_database()
+    LOGGER.info("Built benchmark database %s with %d objects", dbpath, loaded)
+
+    return loaded
+
+
+def _sample_database(dbpath):
+    dbm = DatabaseManager(dbpath)
+    try:
+        return sample_parameters(dbm)
+    finally:
+        dbm.close_database()
+
+
+def time_cold_and_warm(dbpath, name, samples, repeat=5):
+    """Open a database and time one of the :data:`ANALYTIC_QUERIES`.
+
+    The first run after opening the database is the cold run. This
+    function opens a database, so it should run in a new process. The
+    cold run does not read the database from the disk if its files are
+    in the page cache of the operating system.
+
+    Args:
+        dbpath: The database directory.
+        name: The name of the query.
+        samples: The parameter values (see :func:`sample_parameters`).
+        repeat: The number of warm runs.
+
+    Returns:
+        A dictionary with the ``cold`` time and the median ``warm``
+        time in seconds.
+
+    Raises:
+        :class:`mal_analytics.exceptions.QueryError`: if the query fails.
+    """
+    query, param_names = [(q, p) for n, q, p in ANALYTIC_QUERIES if n == name][0]
+    params = [samples[p] for p in param_names]
+
+    dbm = DatabaseManager(dbpath)
+    try:
+        runs = list()
+        for _ in range(repeat + 1):
+            start = time.perf_counter()
+            _run_query(dbm, query, params)
+            runs.append(time.perf_counter() - start)
+    finally:
+        dbm.close_database()
+
+    return {'cold': runs[0], 'warm': statistics.median(runs[1:])}
+
+
+def _in_new_process(fcn, *args):
+    # MonetDBLite can open one database per process, and a new process
+    # is the closest we can get to a cold database.
+    pool = multiprocessing.get_context('spawn').Pool(1)
+    try:
+        return pool.apply(fcn, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run_analytic_benchmark(dbpath, repeat=5, names=None):
+    """Time the analytic queries, cold and warm.
+
+    The database should not be open in this process. Every query runs
+    in a new process.
+
+    Args:
+        dbpath: The database directory.
+        repeat: The number of warm runs of every query.
+        names: The names of the queries to run. Defaults to all of
+            :data:`ANALYTIC_QUERIES`.
+
+    Returns:
+        A dictionary with keys the query names and values the results
+        of :func:`time_cold_and_warm`. Queries without data for their
+        parameters are skipped.
+    """
+    samples = _in_new_process(_sample_database, dbpath)
+    results = dict()
+    for name, _, param_names in ANALYTIC_QUERIES:
+        if names is not None and name not in names:
+            continue
+        if any([samples.get(p) is None for p in param_names]):
+            LOGGER.warning("No data for query %s, skipping", name)
+            continue
+        results[name] = _in_new_process(time_cold_and_warm, dbpath, name, samples, repeat)
+
+    return results
+
+
+def main(argv=None):  # pragma: no coverage
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dbpath', help='The database directory')
+    parser.add_argument('traces', nargs='*', help='Traces to load first')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Number of runs for every query')
+    parser.add_argument('--analytic', action='store_true',
+                        help='Run the analytic benchmark instead of the index benchmark')
+    parser.add_argument('--scale', type=int, default=1000,
+                        help='Queries per session of the synthetic database, if it does not exist')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic trace')
+    args = parser.parse_args(argv)
+
+    if args.analytic:
+        logging.basicConfig(level=logging.INFO)
+        if not os.path.exists(args.dbpath):
+            _in_new_process(build_benchmark_database, args.dbpath, args.scale, args.seed)
+        for trace in args.traces:
+            _in_new_process(trace_reader.parse_trace, trace, args.dbpath)
+
+        results = run_analytic_benchmark(args.dbpath, args.repeat)
+        print("{:<28} {:>12} {:>12}".format('query', 'cold (ms)', 'warm (ms)'))
+        for name, res in results.items():
+            print("{:<28} {:>12.3f} {:>12.3f}".format(name, res['cold'] * 1000, res['warm'] * 1000))
+        return
+
+    for trace in args.traces:
+        trace_reader.parse_trace(trace, args.dbpath)
+
+    dbm = DatabaseManager(args.dbpath)
+    results = run_index_benchmark(dbm, args.repeat)
+
+    print("{:<28} {:>14} {:>14} {:>8}".format('query', 'no index (ms)', 'index (ms)', 'speedup'))
+    for name, res in results.items():
+        before = res['without_indexes']
+        after = res['with_indexes']
+        print("{:<28} {:>14.3f} {:>14.3f} {:>7.1f}x".format(
+            name, before * 1000, after * 1000, before / after if after else float('inf')))
+
+
+if __name__ == '__main__':  # pragma: no coverage
+    main()
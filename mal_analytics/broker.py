@@ -0,0 +1,376 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""A local daemon that owns a trace database and ingests traces
+submitted by other processes.
+
+MonetDBLite allows only one process to open a database. The broker
+opens the database and accepts submissions over a Unix domain socket.
+Submissions from all clients are collected into batches, and every
+batch is loaded in one transaction. The broker can be started from the
+command line::
+
+    python -m mal_analytics.broker /path/to/db /path/to/socket
+
+With ``--metrics-file`` or ``--metrics-port`` the broker publishes its
+metrics in the Prometheus text format (see :mod:`mal_analytics.metrics`).
+
+Protocol: a submission is a 4 byte unsigned big endian length followed
+by that many bytes of trace data (one or more JSON objects, see
+:class:`mal_analytics.trace_reader.ObjectSplitter`). The broker answers
+every submission with a JSON object on a single line, with the key
+``status`` being one of:
+
+* ``ok``: the submission has been committed. ``objects`` is the number
+  of JSON objects and ``batch`` the number of the batch it was
+  loaded in.
+* ``busy``: too many submissions are waiting to be loaded. The
+  submission was not accepted and should be retried later.
+* ``error``: the submission was rejected, or the broker is shutting
+  down. ``message`` describes the error.
+
+A client can send any number of submissions over the same connection.
+"""
+
+import argparse
+from concurrent.futures import Future
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+from mal_analytics.exceptions import BrokerError
+from mal_analytics.trace_reader import ObjectSplitter
+
+LOGGER = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('>I')
+
+
+def _read_exactly(fl, size):
+    data = fl.read(size)
+    if len(data) < size:
+        return None
+    return data
+
+
+class _SubmissionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            header = _read_exactly(self.rfile, _HEADER.size)
+            if header is None:
+                return
+            payload = _read_exactly(self.rfile, _HEADER.unpack(header)[0])
+            if payload is None:
+                return
+
+            response = self.server.broker.submit(payload)
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class IngestBroker(object):
+    """Serve trace submissions over a Unix domain socket.
+
+    A single loader thread loads the submissions into the database
+    using one long lived parser, so a client can split a trace into
+    many submissions. A batch is loaded when it holds
+    ``batch_objects`` JSON objects, or ``batch_delay`` seconds after
+    its first submission arrived, whichever comes first. If a batch
+    fails to load, its submissions are loaded one by one, so that only
+    the ones that cause the failure are rejected.
+
+    The broker should be the only user of the database manager while
+    it is running.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        socket_path: The path of the Unix domain socket.
+        batch_objects: The number of JSON objects that triggers loading
+            a batch.
+        batch_delay: The maximum time in seconds a submission waits for
+            other submissions to join its batch.
+        max_pending: The maximum number of submissions waiting to be
+            loaded. Further submissions get a ``busy`` response.
+        metrics: An :class:`mal_analytics.metrics.IngestMetrics` object
+            that records the batches, or ``None``.
+    """
+
+    def __init__(self, dbm, socket_path, batch_objects=20000, batch_delay=0.5,
+                 max_pending=64, metrics=None):
+        self._dbm = dbm
+        self._socket_path = socket_path
+        self._batch_objects = batch_objects
+        self._batch_delay = batch_delay
+        self._queue = queue.Queue(max_pending)
+        self._pob = dbm.create_parser()
+        self._batches = 0
+        self._metrics = metrics
+        # Protects _closed, so that no submission is queued after the
+        # end of the queue is marked.
+        self._lock = threading.Lock()
+        self._closed = False
+        self._server = None
+        self._server_thread = None
+        self._loader_thread = None
+
+    def start(self):
+        """Start serving in background threads."""
+        if os.path.exists(self._socket_path):
+            LOGGER.warning("Removing stale socket %s", self._socket_path)
+            os.unlink(self._socket_path)
+
+        self._server = _UnixServer(self._socket_path, _SubmissionHandler)
+        self._server.broker = self
+        self._loader_thread = threading.Thread(target=self._load_loop, name='mal-analytics-loader')
+        self._loader_thread.start()
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name='mal-analytics-broker')
+        self._server_thread.daemon = True
+        self._server_thread.start()
+        LOGGER.info("Broker listening on %s", self._socket_path)
+
+    def shutdown(self):
+        """Stop accepting submissions, load the pending ones and stop."""
+        self._server.shutdown()
+        self._server.server_close()
+        os.unlink(self._socket_path)
+        with self._lock:
+            self._closed = True
+        self._queue.put(None)
+        self._loader_thread.join()
+
+        # Store the start events still waiting for their done event
+        self._pob.flush_pending_events()
+        self._dbm.load_parsed_data(self._pob)
+
+    def submit(self, payload):
+        """Submit trace data and wait until it is loaded.
+
+        This is called by the connection handlers.
+
+        Args:
+            payload: A bytes object with one or more JSON objects.
+
+        Returns:
+            A dictionary with the response (see :mod:`mal_analytics.broker`).
+        """
+        splitter = ObjectSplitter()
+        try:
+            objects = [json.loads(s) for s in splitter.feed(payload) + splitter.close()]
+        except ValueError as e:
+            return {'status': 'error', 'message': 'Invalid JSON: {}'.format(e)}
+
+        if not objects:
+            return {'status': 'ok', 'objects': 0, 'batch': None}
+
+        future = Future()
+        with self._lock:
+            if self._closed:
+                return {'status': 'error', 'message': 'The broker is shutting down'}
+            try:
+                self._queue.put_nowait((objects, future))
+            except queue.Full:
+                return {'status': 'busy'}
+        if self._metrics is not None:
+            self._metrics.set_queue_depth(self._queue.qsize())
+
+        return future.result()
+
+    def _load_loop(self):
+        stop = False
+        while not stop:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            objects = len(item[0])
+            deadline = time.monotonic() + self._batch_delay
+            while objects < self._batch_objects:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                objects += len(item[0])
+
+            self._load_batch(batch)
+
+    def _load_batch(self, batch):
+        self._batches += 1
+        LOGGER.debug("Loading batch %d with %d submissions", self._batches, len(batch))
+        # Executions span batches, so the parser goes back to its state
+        # before a batch that is not loaded.
+        state = self._pob.save_state()
+        try:
+            self._load(batch)
+        except Exception as e:
+            self._pob.restore_state(state)
+            if len(batch) == 1:
+                self._fail(batch[0], e)
+                return
+            LOGGER.warning("Loading batch %d failed, loading its %d submissions one by one: %s",
+                           self._batches, len(batch), e)
+            for item in batch:
+                state = self._pob.save_state()
+                try:
+                    self._load([item])
+                except Exception as e:
+                    self._pob.restore_state(state)
+                    self._fail(item, e)
+                else:
+                    item[1].set_result({'status': 'ok', 'objects': len(item[0]), 'batch': self._batches})
+            return
+
+        for objects, future in batch:
+            future.set_result({'status': 'ok', 'objects': len(objects), 'batch': self._batches})
+
+    def _load(self, batch):
+        start_time = time.perf_counter()
+        for objects, _ in batch:
+            self._pob.parse_trace_stream(objects)
+        rejected = self._dbm.load_parsed_data(self._pob)
+
+        if self._metrics is not None:
+            self._metrics.record_batch(
+                sum([len(objects) for objects, _ in batch]),
+                sum([sum([1 for o in objects if o.get('source') == 'trace']) for objects, _ in batch]),
+                time.perf_counter() - start_time,
+                self._pob.get_newest_time(),
+                rejected)
+            self._metrics.set_queue_depth(self._queue.qsize())
+
+    def _fail(self, item, error):
+        LOGGER.error("Loading a submission of batch %d failed: %s", self._batches, error)
+        if self._metrics is not None:
+            self._metrics.record_failure()
+        item[1].set_result({'status': 'error', 'message': str(error)})
+
+
+class BrokerClient(object):
+    """A client for :class:`IngestBroker`.
+
+    Args:
+        socket_path: The path of the Unix domain socket of the broker.
+        retries: How many times a submission is retried while the
+            broker is busy.
+        backoff: The initial delay between retries in seconds. It is
+            doubled after every retry.
+    """
+
+    def __init__(self, socket_path, retries=10, backoff=0.05):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._reader = self._socket.makefile('rb')
+        self._retries = retries
+        self._backoff = backoff
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def submit(self, data):
+        """Submit trace data and wait for the acknowledgement.
+
+        Args:
+            data: A bytes or a string object with one or more JSON
+                objects.
+
+        Returns:
+            The response of the broker (see :mod:`mal_analytics.broker`).
+
+        Raises:
+            :class:`mal_analytics.exceptions.BrokerError`: if the
+                broker rejects the submission, or is still busy after
+                all the retries.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        delay = self._backoff
+        for _ in range(self._retries + 1):
+            self._socket.sendall(_HEADER.pack(len(data)) + data)
+            line = self._reader.readline()
+            if not line:
+                raise BrokerError("Broker closed the connection")
+            response = json.loads(line.decode('utf-8'))
+            if response['status'] == 'ok':
+                return response
+            if response['status'] == 'error':
+                raise BrokerError(response['message'])
+            time.sleep(delay)
+            delay *= 2
+
+        raise BrokerError("Broker is busy")
+
+    def close(self):
+        """Close the connection."""
+        self._reader.close()
+        self._socket.close()
+
+
+def main(argv=None):  # pragma: no coverage
+    from mal_analytics.db_manager import DatabaseManager
+    from mal_analytics.metrics import IngestMetrics
+    from mal_analytics.metrics import MetricsExporter
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dbpath', help='The database directory')
+    parser.add_argument('socket', help='The path of the Unix domain socket')
+    parser.add_argument('--batch-objects', type=int, default=20000,
+                        help='Number of JSON objects that triggers a load')
+    parser.add_argument('--batch-delay', type=float, default=0.5,
+                        help='Maximum time in seconds a submission waits for a batch')
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='Maximum number of submissions waiting to be loaded')
+    parser.add_argument('--metrics-file',
+                        help='Write Prometheus metrics to this file periodically')
+    parser.add_argument('--metrics-port', type=int,
+                        help='Serve Prometheus metrics on this local port')
+    parser.add_argument('--metrics-interval', type=float, default=15,
+                        help='Time in seconds between two metrics files')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    metrics = None
+    exporter = None
+    if args.metrics_file is not None or args.metrics_port is not None:
+        metrics = IngestMetrics(args.dbpath)
+        exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_port,
+                                   args.metrics_interval)
+    broker = IngestBroker(DatabaseManager(args.dbpath), args.socket,
+                          args.batch_objects, args.batch_delay, args.max_pending,
+                          metrics)
+    broker.start()
+    if exporter is not None:
+        exporter.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.shutdown()
+        if exporter is not None:
+            exporter.stop()
+
+
+if __name__ == '__main__':  # pragma: no coverage
+    main()
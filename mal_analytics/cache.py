@@ -0,0 +1,129 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+from collections import OrderedDict
+import logging
+import sys
+
+LOGGER = logging.getLogger(__name__)
+
+
+def result_size(results):
+    """Estimate the memory used by the results of a query.
+
+    Args:
+        results: A dictionary of NumPy arrays, as returned by
+            ``fetchnumpy``.
+
+    Returns:
+        The estimated size in bytes.
+    """
+    size = 0
+    for column in results.values():
+        size += column.nbytes
+        # Object arrays (strings) only hold pointers
+        if column.dtype == object:
+            size += sum([sys.getsizeof(v) for v in column.tolist()])
+
+    return size
+
+
+class QueryCache(object):
+    """A least recently used cache for query results.
+
+    Entries are keyed by the text and the parameters of the query and
+    are tagged with the ingest *generation* of the database at the
+    time they were computed. A lookup with a different generation
+    invalidates the whole cache, since the data has changed in the
+    meantime. The cache is bounded by the total estimated size of the
+    results it holds.
+
+    Cached NumPy arrays are made read only, since they are shared by
+    all the callers that get a hit.
+
+    Args:
+        max_bytes: The maximum total size of the cached results.
+    """
+
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._generation = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query, params):
+        return (query, repr(params))
+
+    def get(self, key, generation):
+        """Look up the results for a key.
+
+        Args:
+            key: A key as returned by :meth:`make_key`.
+            generation: The current ingest generation.
+
+        Returns:
+            The cached results or ``None``.
+        """
+        if generation != self._generation:
+            self.clear()
+            self._generation = generation
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, generation, results):
+        """Store the results for a key.
+
+        Results larger than the capacity of the cache are not stored.
+        Least recently used entries are evicted until the new entry
+        fits.
+
+        Args:
+            key: A key as returned by :meth:`make_key`.
+            generation: The ingest generation the results were
+                computed at.
+            results: A dictionary of NumPy arrays.
+        """
+        if generation != self._generation:
+            self.clear()
+            self._generation = generation
+
+        size = result_size(results)
+        if size > self._max_bytes:
+            LOGGER.debug("Result of %d bytes is too large to cache", size)
+            return
+
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        while self._bytes + size > self._max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+        for column in results.values():
+            column.setflags(write=False)
+        self._entries[key] = (results, size)
+        self._bytes += size
+
+    def clear(self):
+        """Remove all the entries."""
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def size(self):
+        """Get the total estimated size of the cached results in bytes."""
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
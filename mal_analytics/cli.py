@@ -0,0 +1,481 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""The mal-analytics command line tool.
+
+Subcommands:
+
+* ``ingest``: load trace files, globs, directories or the standard
+  input (``-``) into a database. The traces are read and decoded by
+  ``--workers`` processes and loaded ``--batch-size`` traces per
+  transaction (see :meth:`mal_analytics.db_manager.DatabaseManager.bulk_load`).
+  With ``--quarantine`` invalid objects are set aside instead of
+  failing the ingest (see :mod:`mal_analytics.quarantine`).
+* ``follow``: load a trace while it is being written (see
+  :func:`mal_analytics.trace_reader.follow_trace`).
+* ``spool``: load the traces dropped in a spool directory (see
+  :mod:`mal_analytics.spool`).
+* ``stats``: print the row counts, the time range and the size of a
+  database.
+* ``bench``: run the ingestion (``bench ingest``) or the query
+  (``bench queries``) benchmarks.
+
+For example::
+
+    mal-analytics ingest /data/db 'traces/**/*.json.gz' --workers 4 --batch-size 50
+    stethoscope -j | mal-analytics follow /data/db -
+"""
+
+import argparse
+import fnmatch
+import glob
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+
+from mal_analytics.exceptions import AnalyticsException
+from mal_analytics.metrics import directory_size
+from mal_analytics.partitions import PARTITIONED_TABLES
+from mal_analytics.profiling import profile_ingest
+from mal_analytics.progress import ProgressTracker
+from mal_analytics.progress import TextProgressBar
+from mal_analytics.quarantine import Quarantine
+from mal_analytics.trace_reader import TRACE_PATTERNS
+from mal_analytics.trace_reader import follow_trace
+from mal_analytics.trace_reader import read_stream
+from mal_analytics.trace_reader import read_trace
+
+LOGGER = logging.getLogger(__name__)
+
+_SIZE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+
+def parse_size(text):
+    """Parse a size in bytes, with an optional K, M or G suffix.
+
+    Args:
+        text: For instance ``'512M'``.
+
+    Returns:
+        The size in bytes.
+
+    Raises:
+        :class:`argparse.ArgumentTypeError`: if the size is invalid.
+    """
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in _SIZE_UNITS else ''
+    try:
+        return int(float(text[:len(text) - len(unit)]) * _SIZE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid size {}".format(text))
+
+
+def expand_inputs(inputs, patterns=TRACE_PATTERNS):
+    """Turn the inputs of the ingest command into a list of files.
+
+    Args:
+        inputs: File names, glob patterns (``**`` matches any number
+            of directories), directories, which are searched
+            recursively for files matching ``patterns``, and ``-`` for
+            the standard input.
+        patterns: The glob patterns of trace files in directories.
+
+    Returns:
+        A list of file names and ``-``, without duplicates, in the
+        order of the inputs. The files of a directory or of a glob are
+        sorted.
+
+    Raises:
+        :class:`ValueError`: if an input matches nothing.
+    """
+    result = list()
+    for inp in inputs:
+        if inp == '-':
+            matches = [inp]
+        elif os.path.isdir(inp):
+            matches = list()
+            for root, _, files in os.walk(inp):
+                for pattern in patterns:
+                    matches.extend([os.path.join(root, fl) for fl in fnmatch.filter(files, pattern)])
+            matches.sort()
+        elif any([c in inp for c in '*?[']):
+            matches = sorted([fl for fl in glob.glob(inp, recursive=True) if os.path.isfile(fl)])
+        elif os.path.isfile(inp):
+            matches = [inp]
+        else:
+            matches = []
+
+        if not matches:
+            raise ValueError("No traces found for {}".format(inp))
+        for fl in matches:
+            if fl not in result:
+                result.append(fl)
+
+    return result
+
+
+def _read_input(args):
+    name, compression, tolerant = args
+    # Worker processes collect the rejected objects in memory, and
+    # they are merged into the quarantine of the ingest.
+    local = Quarantine() if tolerant else None
+    if name == '-':
+        return name, read_stream(sys.stdin.buffer, compression, local), 0, local
+    return name, read_trace(name, quarantine=local), os.path.getsize(name), local
+
+
+def ingest(dbm, inputs, workers=1, batch_size=1, compact=False, memory_budget=None,
+           compression='auto', progress=None, quarantine=None):
+    """Load trace files into a database.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        inputs: A list of file names, or ``-`` for the standard input
+            (see :func:`expand_inputs`).
+        workers: The number of processes reading and decoding traces.
+            With 1 the traces are read by this process.
+        batch_size: The number of traces loaded in one transaction.
+        compact: Do not store the start events of completed
+            instructions.
+        memory_budget: The memory budget of the parser in bytes (see
+            :class:`mal_analytics.profiler_parser.ProfilerObjectParser`).
+        compression: The compression of the standard input (see
+            :func:`mal_analytics.trace_reader.read_stream`). Files are
+            always detected.
+        progress: A function called with a
+            :class:`mal_analytics.progress.ProgressReport`.
+        quarantine: A :class:`mal_analytics.quarantine.Quarantine`. If
+            given, invalid objects are quarantined instead of aborting
+            the ingest.
+
+    Returns:
+        The number of JSON objects loaded.
+
+    Raises:
+        :class:`mal_analytics.exceptions.ErrorBudgetExceeded`: if the
+            error budget of the quarantine is exceeded. The current
+            batch is rolled back.
+    """
+    tracker = None
+    if progress is not None:
+        size = sum([os.path.getsize(fl) for fl in inputs if fl != '-'])
+        tracker = ProgressTracker(progress, size or None)
+        tracker.start_phase('read')
+
+    pool = None
+    tasks = [(fl, compression, quarantine is not None) for fl in inputs]
+    if workers > 1 and '-' not in inputs:
+        # Spawned workers do not inherit the database of this process.
+        pool = multiprocessing.get_context('spawn').Pool(workers)
+        results = pool.imap(_read_input, tasks)
+    else:
+        results = map(_read_input, tasks)
+
+    position = [0]
+
+    def streams(batch):
+        for name, objects, size, local in batch:
+            LOGGER.info("Loading %s (%d objects)", name, len(objects))
+            if quarantine is not None:
+                quarantine.merge(local)
+            yield objects
+            if tracker is not None:
+                position[0] += size
+                tracker.advance(len(objects), position[0])
+
+    loaded = 0
+    try:
+        results = iter(results)
+        while True:
+            first = next(results, None)
+            if first is None:
+                break
+            batch = itertools.chain([first], itertools.islice(results, batch_size - 1))
+            pob = dbm.create_parser(compact, memory_budget, quarantine=quarantine)
+            loaded += dbm.bulk_load(pob, streams(batch))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    if tracker is not None:
+        tracker.finish()
+    return loaded
+
+
+def database_stats(dbm):
+    """Summarize the contents of a database.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+
+    Returns:
+        A dictionary with the ``rows`` of every table, the range of
+        ``absolute_time`` of the events (``first_event`` and
+        ``last_event``, in microseconds since the epoch), the ``size``
+        of the database directory in bytes and the ``partitions`` of a
+        partitioned database.
+    """
+    rows = dict()
+    for table in PARTITIONED_TABLES:
+        rows[table] = int(dbm.execute_query("SELECT count(*) AS cnt FROM {}".format(table))['cnt'][0])
+
+    times = dbm.execute_query(
+        "SELECT min(absolute_time) AS first_event, max(absolute_time) AS last_event FROM profiler_event")
+    result = {
+        'rows': rows,
+        'first_event': None,
+        'last_event': None,
+        'size': directory_size(dbm.get_dbpath()),
+        'partitions': dbm.list_partitions() if dbm.is_partitioned() else None,
+    }
+    if rows['profiler_event'] > 0:
+        result['first_event'] = int(times['first_event'][0])
+        result['last_event'] = int(times['last_event'][0])
+
+    return result
+
+
+def _ingest_command(args):  # pragma: no coverage
+    from mal_analytics.db_manager import DatabaseManager
+
+    try:
+        inputs = expand_inputs(args.inputs or ['-'])
+    except ValueError as e:
+        LOGGER.error(e)
+        return 1
+
+    progress = None
+    if not args.no_progress and sys.stderr.isatty():
+        progress = TextProgressBar()
+    name = inputs[0] if len(inputs) == 1 else '{}-traces'.format(len(inputs))
+    with DatabaseManager(args.dbpath, partitioned=args.partitioned) as dbm, \
+            profile_ingest(args.dbpath, name, args.profile):
+        quarantine = None
+        if args.quarantine is not None:
+            quarantine = Quarantine(args.quarantine, args.max_errors, args.max_error_rate,
+                                    stats=dbm.get_stats_collector())
+        try:
+            loaded = ingest(dbm, inputs, args.workers, args.batch_size, args.compact,
+                            args.memory_budget, args.compression, progress, quarantine)
+        except (AnalyticsException, ValueError) as e:
+            LOGGER.error("Ingest failed, the current batch was rolled back: %s", e)
+            return 1
+        finally:
+            if quarantine is not None:
+                quarantine.close()
+        dbm.get_stats_collector().log_summary('ingest', database=args.dbpath, traces=len(inputs),
+                                              objects=loaded)
+    print("Loaded {} objects from {} traces".format(loaded, len(inputs)))
+    if quarantine is not None and quarantine.get_total():
+        print("Quarantined {} objects in {}: {}".format(
+            quarantine.get_total(), args.quarantine,
+            ', '.join(['{} {}'.format(count, reason)
+                       for reason, count in sorted(quarantine.get_counts().items())])))
+    return 0
+
+
+def _follow_command(args):  # pragma: no coverage
+    from mal_analytics.db_manager import DatabaseManager
+    from mal_analytics.metrics import IngestMetrics
+    from mal_analytics.metrics import MetricsExporter
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    metrics = None
+    exporter = None
+    if args.metrics_file is not None or args.metrics_port is not None:
+        metrics = IngestMetrics(args.dbpath)
+        exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_port)
+        exporter.start()
+
+    if args.trace == '-':
+        fl = sys.stdin.buffer
+    else:
+        fl = open(args.trace, 'rb')
+        if not args.from_start:
+            fl.seek(0, os.SEEK_END)
+
+    try:
+        with DatabaseManager(args.dbpath, partitioned=args.partitioned) as dbm, \
+                profile_ingest(args.dbpath, args.trace, args.profile):
+            try:
+                loaded = follow_trace(dbm, fl, args.batch_size, args.interval,
+                                      stop_at_eof=args.trace == '-',
+                                      should_stop=lambda: bool(stopping),
+                                      compact=args.compact, metrics=metrics,
+                                      resync=args.trace != '-' and not args.from_start)
+            except KeyboardInterrupt:
+                LOGGER.warning("Interrupted, the last batch was not loaded")
+                return 1
+    finally:
+        if fl is not sys.stdin.buffer:
+            fl.close()
+        if exporter is not None:
+            exporter.stop()
+
+    print("Loaded {} objects".format(loaded))
+    return 0
+
+
+def _spool_command(args):  # pragma: no coverage
+    from mal_analytics.db_manager import DatabaseManager
+    from mal_analytics.metrics import IngestMetrics
+    from mal_analytics.metrics import MetricsExporter
+    from mal_analytics.spool import SpoolWatcher
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    metrics = None
+    exporter = None
+    if args.metrics_file is not None or args.metrics_port is not None:
+        metrics = IngestMetrics(args.dbpath)
+        exporter = MetricsExporter(metrics, args.metrics_file, args.metrics_port)
+        exporter.start()
+
+    with DatabaseManager(args.dbpath, partitioned=args.partitioned) as dbm, \
+            profile_ingest(args.dbpath, args.directory, args.profile):
+        watcher = SpoolWatcher(dbm, args.directory, batch_files=args.batch_size,
+                               batch_bytes=args.batch_bytes, settle=args.settle, poll=args.poll,
+                               compact=args.compact, memory_budget=args.memory_budget,
+                               metrics=metrics)
+        try:
+            watcher.run(lambda: bool(stopping), args.recover)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+            if exporter is not None:
+                exporter.stop()
+    return 0
+
+
+def _stats_command(args):  # pragma: no coverage
+    from mal_analytics.db_manager import DatabaseManager
+
+    with DatabaseManager(args.dbpath) as dbm:
+        stats = database_stats(dbm)
+
+    if args.json:
+        print(json.dumps(stats, indent=2, sort_keys=True))
+        return 0
+
+    for table, rows in sorted(stats['rows'].items()):
+        print("{:<24} {:>14}".format(table, rows))
+    print("{:<24} {:>14}".format('size (bytes)', stats['size']))
+    print("{:<24} {:>14}".format('first event', stats['first_event'] or '-'))
+    print("{:<24} {:>14}".format('last event', stats['last_event'] or '-'))
+    if stats['partitions'] is not None:
+        print("{:<24} {:>14}".format('partitions', len(stats['partitions'])))
+    return 0
+
+
+def _bench_command(args):  # pragma: no coverage
+    if args.benchmark == 'ingest':
+        from mal_analytics.bench.ingest import main as bench_main
+    else:
+        from mal_analytics.bench.queries import main as bench_main
+    bench_main(args.arguments)
+    return 0
+
+
+def main(argv=None):  # pragma: no coverage
+    parser = argparse.ArgumentParser(prog='mal-analytics', description=__doc__.splitlines()[0])
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='Log more (-vv for debugging messages)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    def add_load_arguments(sub):
+        sub.add_argument('dbpath', help='The database directory')
+        sub.add_argument('--compact', action='store_true',
+                         help='Do not store the start events of completed instructions')
+        sub.add_argument('--partitioned', action='store_true',
+                         help='Create a partitioned database if it does not exist')
+        sub.add_argument('--profile', nargs='?', const=True, default=None, metavar='DIR',
+                         help='Profile the ingest, writing the profiles in DIR')
+
+    sub = subparsers.add_parser('ingest', help='Load trace files')
+    add_load_arguments(sub)
+    sub.add_argument('inputs', nargs='*',
+                     help='Trace files, globs, directories or - for the standard input (default)')
+    sub.add_argument('--workers', type=int, default=1,
+                     help='Number of processes reading the traces')
+    sub.add_argument('--batch-size', type=int, default=1,
+                     help='Number of traces loaded in one transaction')
+    sub.add_argument('--memory-budget', type=parse_size,
+                     help='Spill parsed data to disk above this size, e.g. 512M')
+    sub.add_argument('--compression', choices=['auto', 'none', 'gz', 'bz2'], default='auto',
+                     help='Compression of the standard input')
+    sub.add_argument('--no-progress', action='store_true', help='Do not draw a progress bar')
+    sub.add_argument('--quarantine', metavar='FILE',
+                     help='Write invalid objects to FILE and go on, instead of failing')
+    sub.add_argument('--max-errors', type=int,
+                     help='Abort when more objects than this are quarantined')
+    sub.add_argument('--max-error-rate', type=float,
+                     help='Abort when this fraction of the objects is quarantined')
+    sub.set_defaults(function=_ingest_command)
+
+    sub = subparsers.add_parser('follow', help='Load a trace while it is being written')
+    add_load_arguments(sub)
+    sub.add_argument('trace', help='The trace file, or - for the standard input')
+    sub.add_argument('--batch-size', type=int, default=20000,
+                     help='Number of JSON objects that triggers a load')
+    sub.add_argument('--interval', type=float, default=1.0,
+                     help='Maximum time in seconds between two loads')
+    sub.add_argument('--from-start', action='store_true',
+                     help='Load the existing contents of the file first')
+    sub.add_argument('--metrics-file', help='Write Prometheus metrics to this file periodically')
+    sub.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this local port')
+    sub.set_defaults(function=_follow_command)
+
+    sub = subparsers.add_parser('spool', help='Load the traces dropped in a spool directory')
+    add_load_arguments(sub)
+    sub.add_argument('directory', help='The spool directory')
+    sub.add_argument('--batch-size', type=int, default=100,
+                     help='Maximum number of traces loaded in one transaction')
+    sub.add_argument('--batch-bytes', type=parse_size, default=256 * 1024 * 1024,
+                     help='Maximum size of the traces loaded in one transaction')
+    sub.add_argument('--memory-budget', type=parse_size,
+                     help='Spill parsed data to disk above this size, e.g. 512M')
+    sub.add_argument('--settle', type=float, default=1.0,
+                     help='Time in seconds a file must be unmodified before it is loaded')
+    sub.add_argument('--poll', type=float, default=5.0,
+                     help='Time in seconds between two scans without inotify')
+    sub.add_argument('--recover', action='store_true',
+                     help='Return the files left in processing by a watcher that was killed. '
+                     'Only use it when no other watcher is running')
+    sub.add_argument('--metrics-file', help='Write Prometheus metrics to this file periodically')
+    sub.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics on this local port')
+    sub.set_defaults(function=_spool_command)
+
+    sub = subparsers.add_parser('stats', help='Summarize a database')
+    sub.add_argument('dbpath', help='The database directory')
+    sub.add_argument('--json', action='store_true', help='Print JSON')
+    sub.set_defaults(function=_stats_command)
+
+    sub = subparsers.add_parser('bench', help='Run a benchmark')
+    sub.add_argument('benchmark', choices=['ingest', 'queries'])
+    sub.add_argument('arguments', nargs=argparse.REMAINDER,
+                     help='The arguments of the benchmark (see --help of each)')
+    sub.set_defaults(function=_bench_command)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'compression', None) == 'none':
+        args.compression = None
+
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+    sys.exit(args.function(args))
+
+
+if __name__ == '__main__':  # pragma: no coverage
+    main()
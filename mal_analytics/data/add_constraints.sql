@@ -2,63 +2,57 @@
 -- License, v. 2.0. If a copy of the MPL was not distributed with this
 -- file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-ALTER TABLE mal_execution ADD
-    CONSTRAINT pk_mal_execution PRIMARY KEY (execution_id);
-ALTER TABLE mal_execution ADD
-    CONSTRAINT unique_me_mal_execution UNIQUE(server_session, tag);
-
-ALTER TABLE profiler_event ADD
-    CONSTRAINT pk_profiler_event PRIMARY KEY (event_id);
-ALTER TABLE profiler_event ADD
-    CONSTRAINT fk_pe_mal_execution_id FOREIGN KEY (mal_execution_id) REFERENCES mal_execution(execution_id);
-ALTER TABLE profiler_event ADD
-    CONSTRAINT unique_pe_profiler_event UNIQUE(mal_execution_id, pc, execution_state);
-
-ALTER TABLE prerequisite_events ADD
-     CONSTRAINT pk_prerequisite_events PRIMARY KEY (prerequisite_relation_id);
-ALTER TABLE prerequisite_events ADD
-    CONSTRAINT fk_pre_prerequisite_event FOREIGN KEY (prerequisite_event) REFERENCES profiler_event(event_id);
-ALTER TABLE prerequisite_events ADD
-    CONSTRAINT fk_pre_consequent_event FOREIGN KEY (consequent_event) REFERENCES profiler_event(event_id);
-
-ALTER TABLE mal_type ADD
-    CONSTRAINT pk_mal_type PRIMARY KEY (type_id);
-ALTER TABLE mal_type ADD
-    CONSTRAINT fk_mt_subtype_id FOREIGN KEY (subtype_id) REFERENCES mal_type(type_id);
-
-ALTER TABLE mal_variable ADD
-     CONSTRAINT pk_mal_variable PRIMARY KEY (variable_id);
-ALTER TABLE mal_variable ADD
-    CONSTRAINT fk_mv_mal_execution_id FOREIGN KEY (mal_execution_id) REFERENCES mal_execution(execution_id);
-ALTER TABLE mal_variable ADD
-    CONSTRAINT fk_mv_type_id FOREIGN KEY (type_id) REFERENCES mal_type(type_id);
-ALTER TABLE mal_variable ADD
-    CONSTRAINT unique_mv_var_name UNIQUE (mal_execution_id, name);
-
-ALTER TABLE event_variable_list ADD
-     CONSTRAINT pk_event_variable_list PRIMARY KEY (event_id, variable_list_index);
-ALTER TABLE event_variable_list ADD
-    CONSTRAINT fk_evl_event_id FOREIGN KEY (event_id) REFERENCES profiler_event(event_id);
-ALTER TABLE event_variable_list ADD
-    CONSTRAINT fk_evl_variable_id FOREIGN KEY (variable_id) REFERENCES mal_variable(variable_id);
-
-ALTER TABLE query ADD
-    CONSTRAINT pk_query PRIMARY KEY (query_id);
-ALTER TABLE query ADD
-    CONSTRAINT fk_root_execution_id FOREIGN KEY (root_execution_id) REFERENCES mal_execution(execution_id);
-
-ALTER TABLE initiates_executions ADD
-    CONSTRAINT pk_initiates_executions PRIMARY KEY (initiates_executions_id);
-ALTER TABLE initiates_executions ADD
-    CONSTRAINT fk_parent_id FOREIGN KEY (parent_id) REFERENCES mal_execution(execution_id);
-ALTER TABLE initiates_executions ADD
-    CONSTRAINT fk_child_id FOREIGN KEY (child_id) REFERENCES mal_execution(execution_id);
-
-ALTER TABLE heartbeat ADD
-    CONSTRAINT pk_heartbeat PRIMARY KEY (heartbeat_id);
-
-ALTER TABLE cpuload ADD
-    CONSTRAINT fk_cl_heartbeat_id FOREIGN KEY (heartbeat_id) REFERENCES heartbeat(heartbeat_id);
+-- {suffix} is replaced by the suffix of the partition the constraints
+-- apply to. It is empty for databases that are not partitioned. The
+-- constraints of mal_type are never dropped, since this table is
+-- shared by all the partitions. The foreign keys that may cross
+-- partitions are in add_cross_partition_keys.sql.
+
+ALTER TABLE mal_execution{suffix} ADD
+    CONSTRAINT pk_mal_execution{suffix} PRIMARY KEY (execution_id);
+ALTER TABLE mal_execution{suffix} ADD
+    CONSTRAINT unique_me_mal_execution{suffix} UNIQUE(server_session, tag);
+
+ALTER TABLE profiler_event{suffix} ADD
+    CONSTRAINT pk_profiler_event{suffix} PRIMARY KEY (event_id);
+ALTER TABLE profiler_event{suffix} ADD
+    CONSTRAINT unique_pe_profiler_event{suffix} UNIQUE(mal_execution_id, pc, execution_state);
+
+ALTER TABLE instruction_run{suffix} ADD
+    CONSTRAINT pk_instruction_run{suffix} PRIMARY KEY (instruction_run_id);
+ALTER TABLE instruction_run{suffix} ADD
+    CONSTRAINT fk_ir_end_event_id{suffix} FOREIGN KEY (end_event_id) REFERENCES profiler_event{suffix}(event_id);
+
+ALTER TABLE prerequisite_events{suffix} ADD
+     CONSTRAINT pk_prerequisite_events{suffix} PRIMARY KEY (prerequisite_relation_id);
+ALTER TABLE prerequisite_events{suffix} ADD
+    CONSTRAINT fk_pre_consequent_event{suffix} FOREIGN KEY (consequent_event) REFERENCES profiler_event{suffix}(event_id);
+
+ALTER TABLE mal_variable{suffix} ADD
+     CONSTRAINT pk_mal_variable{suffix} PRIMARY KEY (variable_id);
+ALTER TABLE mal_variable{suffix} ADD
+    CONSTRAINT fk_mv_type_id{suffix} FOREIGN KEY (type_id) REFERENCES mal_type(type_id);
+ALTER TABLE mal_variable{suffix} ADD
+    CONSTRAINT unique_mv_var_name{suffix} UNIQUE (mal_execution_id, name);
+
+ALTER TABLE event_variable_list{suffix} ADD
+     CONSTRAINT pk_event_variable_list{suffix} PRIMARY KEY (event_id, variable_list_index);
+ALTER TABLE event_variable_list{suffix} ADD
+    CONSTRAINT fk_evl_event_id{suffix} FOREIGN KEY (event_id) REFERENCES profiler_event{suffix}(event_id);
+
+ALTER TABLE query{suffix} ADD
+    CONSTRAINT pk_query{suffix} PRIMARY KEY (query_id);
+
+ALTER TABLE initiates_executions{suffix} ADD
+    CONSTRAINT pk_initiates_executions{suffix} PRIMARY KEY (initiates_executions_id);
+
+ALTER TABLE heartbeat{suffix} ADD
+    CONSTRAINT pk_heartbeat{suffix} PRIMARY KEY (heartbeat_id);
+
+ALTER TABLE cpuload{suffix} ADD
+    CONSTRAINT pk_cpuload{suffix} PRIMARY KEY (cpuload_id);
+ALTER TABLE cpuload{suffix} ADD
+    CONSTRAINT fk_cl_heartbeat_id{suffix} FOREIGN KEY (heartbeat_id) REFERENCES heartbeat{suffix}(heartbeat_id);
 
 -- ALTER TABLE trace ADD
 --     CONSTRAINT trace_id_pk PRIMARY KEY (trace_id);
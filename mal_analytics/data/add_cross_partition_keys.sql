@@ -0,0 +1,35 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- The foreign keys whose rows may be loaded into a later partition
+-- than the rows they reference, for instance the events of an
+-- execution that runs past midnight (UTC). They are only added to
+-- databases that are not partitioned, after add_constraints.sql. In
+-- partitioned databases these references are checked by
+-- PartitionManager.check_references instead.
+
+ALTER TABLE profiler_event ADD
+    CONSTRAINT fk_pe_mal_execution_id FOREIGN KEY (mal_execution_id) REFERENCES mal_execution(execution_id);
+
+ALTER TABLE instruction_run ADD
+    CONSTRAINT fk_ir_mal_execution_id FOREIGN KEY (mal_execution_id) REFERENCES mal_execution(execution_id);
+ALTER TABLE instruction_run ADD
+    CONSTRAINT fk_ir_start_event_id FOREIGN KEY (start_event_id) REFERENCES profiler_event(event_id);
+
+ALTER TABLE prerequisite_events ADD
+    CONSTRAINT fk_pre_prerequisite_event FOREIGN KEY (prerequisite_event) REFERENCES profiler_event(event_id);
+
+ALTER TABLE mal_variable ADD
+    CONSTRAINT fk_mv_mal_execution_id FOREIGN KEY (mal_execution_id) REFERENCES mal_execution(execution_id);
+
+ALTER TABLE event_variable_list ADD
+    CONSTRAINT fk_evl_variable_id FOREIGN KEY (variable_id) REFERENCES mal_variable(variable_id);
+
+ALTER TABLE query ADD
+    CONSTRAINT fk_root_execution_id FOREIGN KEY (root_execution_id) REFERENCES mal_execution(execution_id);
+
+ALTER TABLE initiates_executions ADD
+    CONSTRAINT fk_parent_id FOREIGN KEY (parent_id) REFERENCES mal_execution(execution_id);
+ALTER TABLE initiates_executions ADD
+    CONSTRAINT fk_child_id FOREIGN KEY (child_id) REFERENCES mal_execution(execution_id);
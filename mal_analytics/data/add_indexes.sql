@@ -0,0 +1,19 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- Secondary indexes for the common analytic access paths. The names
+-- of all the indexes start with "idx_" (see
+-- DatabaseManager.has_indexes).
+
+CREATE ORDERED INDEX idx_pe_mal_execution_id ON profiler_event (mal_execution_id);
+CREATE IMPRINTS INDEX idx_pe_pc ON profiler_event (pc);
+
+CREATE INDEX idx_mv_execution_name ON mal_variable (mal_execution_id, name);
+
+CREATE ORDERED INDEX idx_evl_variable_id ON event_variable_list (variable_id);
+
+CREATE ORDERED INDEX idx_ir_mal_execution_id ON instruction_run (mal_execution_id);
+
+CREATE ORDERED INDEX idx_hb_server_session ON heartbeat (server_session);
+CREATE IMPRINTS INDEX idx_hb_ctime ON heartbeat (ctime);
@@ -0,0 +1,19 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- Attach the tables of one partition, created by tables.sql, to the
+-- corresponding merge tables. {suffix} is replaced by the suffix of
+-- the partition. Constraints are added afterwards using
+-- add_constraints.sql.
+
+ALTER TABLE mal_execution ADD TABLE mal_execution{suffix};
+ALTER TABLE profiler_event ADD TABLE profiler_event{suffix};
+ALTER TABLE prerequisite_events ADD TABLE prerequisite_events{suffix};
+ALTER TABLE mal_variable ADD TABLE mal_variable{suffix};
+ALTER TABLE event_variable_list ADD TABLE event_variable_list{suffix};
+ALTER TABLE query ADD TABLE query{suffix};
+ALTER TABLE initiates_executions ADD TABLE initiates_executions{suffix};
+ALTER TABLE heartbeat ADD TABLE heartbeat{suffix};
+ALTER TABLE cpuload ADD TABLE cpuload{suffix};
+ALTER TABLE instruction_run ADD TABLE instruction_run{suffix};
@@ -2,19 +2,26 @@
 -- License, v. 2.0. If a copy of the MPL was not distributed with this
 -- file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-ALTER TABLE prerequisite_events
-    DROP CONSTRAINT pk_prerequisite_events;
-ALTER TABLE prerequisite_events
-    DROP CONSTRAINT fk_pre_prerequisite_event;
-ALTER TABLE prerequisite_events
-    DROP CONSTRAINT fk_pre_consequent_event;
+-- {suffix} is replaced by the suffix of the partition the constraints
+-- apply to. It is empty for databases that are not partitioned. The
+-- constraints of mal_type are never dropped, since this table is
+-- shared by all the partitions. The foreign keys that may cross
+-- partitions are in drop_cross_partition_keys.sql.
 
-ALTER TABLE event_variable_list
-    DROP CONSTRAINT pk_event_variable_list;
-ALTER TABLE event_variable_list
-    DROP CONSTRAINT fk_evl_event_id;
-ALTER TABLE event_variable_list
-    DROP CONSTRAINT fk_evl_variable_id;
+ALTER TABLE instruction_run{suffix}
+    DROP CONSTRAINT pk_instruction_run{suffix};
+ALTER TABLE instruction_run{suffix}
+    DROP CONSTRAINT fk_ir_end_event_id{suffix};
+
+ALTER TABLE prerequisite_events{suffix}
+    DROP CONSTRAINT pk_prerequisite_events{suffix};
+ALTER TABLE prerequisite_events{suffix}
+    DROP CONSTRAINT fk_pre_consequent_event{suffix};
+
+ALTER TABLE event_variable_list{suffix}
+    DROP CONSTRAINT pk_event_variable_list{suffix};
+ALTER TABLE event_variable_list{suffix}
+    DROP CONSTRAINT fk_evl_event_id{suffix};
 
 -- ALTER TABLE argument_variable_list
 --     DROP CONSTRAINT pk_argument_variable_list;
@@ -23,49 +30,35 @@ ALTER TABLE event_variable_list
 -- ALTER TABLE argument_variable_list
 --     DROP CONSTRAINT fk_av_variable_id;
 
-ALTER TABLE mal_variable
-    DROP CONSTRAINT pk_mal_variable;
-ALTER TABLE mal_variable
-    DROP CONSTRAINT fk_mv_mal_execution_id;
-ALTER TABLE mal_variable
-    DROP CONSTRAINT fk_mv_type_id;
-ALTER TABLE mal_variable
-    DROP CONSTRAINT unique_mv_var_name;
-
-ALTER TABLE profiler_event
-    DROP CONSTRAINT pk_profiler_event;
-ALTER TABLE profiler_event
-    DROP CONSTRAINT fk_pe_mal_execution_id;
-ALTER TABLE profiler_event
-    DROP CONSTRAINT unique_pe_profiler_event;
-
-ALTER TABLE query
-    DROP CONSTRAINT pk_query;
-ALTER TABLE query
-    DROP CONSTRAINT fk_root_execution_id;
+ALTER TABLE mal_variable{suffix}
+    DROP CONSTRAINT pk_mal_variable{suffix};
+ALTER TABLE mal_variable{suffix}
+    DROP CONSTRAINT fk_mv_type_id{suffix};
+ALTER TABLE mal_variable{suffix}
+    DROP CONSTRAINT unique_mv_var_name{suffix};
 
-ALTER TABLE initiates_executions
-    DROP CONSTRAINT fk_parent_id;
-ALTER TABLE initiates_executions
-    DROP CONSTRAINT fk_child_id;
-ALTER TABLE initiates_executions
-    DROP CONSTRAINT pk_initiates_executions;
+ALTER TABLE profiler_event{suffix}
+    DROP CONSTRAINT pk_profiler_event{suffix};
+ALTER TABLE profiler_event{suffix}
+    DROP CONSTRAINT unique_pe_profiler_event{suffix};
 
-ALTER TABLE mal_execution
-    DROP CONSTRAINT pk_mal_execution;
-ALTER TABLE mal_execution
-    DROP CONSTRAINT unique_me_mal_execution;
+ALTER TABLE query{suffix}
+    DROP CONSTRAINT pk_query{suffix};
+ALTER TABLE initiates_executions{suffix}
+    DROP CONSTRAINT pk_initiates_executions{suffix};
 
-ALTER TABLE cpuload
-    DROP CONSTRAINT fk_cl_heartbeat_id;
+ALTER TABLE mal_execution{suffix}
+    DROP CONSTRAINT pk_mal_execution{suffix};
+ALTER TABLE mal_execution{suffix}
+    DROP CONSTRAINT unique_me_mal_execution{suffix};
 
-ALTER TABLE mal_type
-    DROP CONSTRAINT fk_mt_subtype_id;
-ALTER TABLE mal_type
-    DROP CONSTRAINT pk_mal_type;
+ALTER TABLE cpuload{suffix}
+    DROP CONSTRAINT fk_cl_heartbeat_id{suffix};
+ALTER TABLE cpuload{suffix}
+    DROP CONSTRAINT pk_cpuload{suffix};
 
-ALTER TABLE heartbeat
-    DROP CONSTRAINT pk_heartbeat;
+ALTER TABLE heartbeat{suffix}
+    DROP CONSTRAINT pk_heartbeat{suffix};
 
 -- ALTER TABLE trace
 --     DROP CONSTRAINT trace_id_pk;
@@ -0,0 +1,32 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- See add_cross_partition_keys.sql. These are dropped before
+-- drop_constraints.sql, since they reference primary keys dropped
+-- there.
+
+ALTER TABLE instruction_run
+    DROP CONSTRAINT fk_ir_mal_execution_id;
+ALTER TABLE instruction_run
+    DROP CONSTRAINT fk_ir_start_event_id;
+
+ALTER TABLE prerequisite_events
+    DROP CONSTRAINT fk_pre_prerequisite_event;
+
+ALTER TABLE event_variable_list
+    DROP CONSTRAINT fk_evl_variable_id;
+
+ALTER TABLE mal_variable
+    DROP CONSTRAINT fk_mv_mal_execution_id;
+
+ALTER TABLE profiler_event
+    DROP CONSTRAINT fk_pe_mal_execution_id;
+
+ALTER TABLE query
+    DROP CONSTRAINT fk_root_execution_id;
+
+ALTER TABLE initiates_executions
+    DROP CONSTRAINT fk_parent_id;
+ALTER TABLE initiates_executions
+    DROP CONSTRAINT fk_child_id;
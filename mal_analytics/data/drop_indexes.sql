@@ -0,0 +1,15 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+DROP INDEX idx_pe_mal_execution_id;
+DROP INDEX idx_pe_pc;
+
+DROP INDEX idx_mv_execution_name;
+
+DROP INDEX idx_evl_variable_id;
+
+DROP INDEX idx_ir_mal_execution_id;
+
+DROP INDEX idx_hb_server_session;
+DROP INDEX idx_hb_ctime;
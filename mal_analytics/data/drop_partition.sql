@@ -0,0 +1,37 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- Detach the tables of one partition from the merge tables and drop
+-- them. Tables referencing other tables of the partition are dropped
+-- first. {suffix} is replaced by the suffix of the partition.
+
+ALTER TABLE instruction_run DROP TABLE instruction_run{suffix};
+DROP TABLE instruction_run{suffix};
+
+ALTER TABLE event_variable_list DROP TABLE event_variable_list{suffix};
+DROP TABLE event_variable_list{suffix};
+
+ALTER TABLE prerequisite_events DROP TABLE prerequisite_events{suffix};
+DROP TABLE prerequisite_events{suffix};
+
+ALTER TABLE cpuload DROP TABLE cpuload{suffix};
+DROP TABLE cpuload{suffix};
+
+ALTER TABLE query DROP TABLE query{suffix};
+DROP TABLE query{suffix};
+
+ALTER TABLE initiates_executions DROP TABLE initiates_executions{suffix};
+DROP TABLE initiates_executions{suffix};
+
+ALTER TABLE mal_variable DROP TABLE mal_variable{suffix};
+DROP TABLE mal_variable{suffix};
+
+ALTER TABLE profiler_event DROP TABLE profiler_event{suffix};
+DROP TABLE profiler_event{suffix};
+
+ALTER TABLE heartbeat DROP TABLE heartbeat{suffix};
+DROP TABLE heartbeat{suffix};
+
+ALTER TABLE mal_execution DROP TABLE mal_execution{suffix};
+DROP TABLE mal_execution{suffix};
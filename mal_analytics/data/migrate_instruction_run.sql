@@ -0,0 +1,74 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- Upgrade a database created before the instruction_run table was
+-- introduced: create the table, pair the start and done events that
+-- are already in the database and redefine the instructions view on
+-- top of the new table.
+
+start transaction;
+
+DROP VIEW instructions;
+
+create table instruction_run (
+       instruction_run_id bigint,
+       mal_execution_id bigint not null,
+       pc int not null,
+       thread int,
+       start_event_id bigint,
+       end_event_id bigint not null,
+       start_time bigint,
+       end_time bigint,
+       astart_time bigint,
+       aend_time bigint,
+       duration bigint,
+       short_statement text,
+       mal_module text,
+       instruction text,
+
+       constraint pk_instruction_run primary key (instruction_run_id),
+       constraint fk_ir_mal_execution_id foreign key (mal_execution_id) references mal_execution(execution_id),
+       constraint fk_ir_start_event_id foreign key (start_event_id) references profiler_event(event_id),
+       constraint fk_ir_end_event_id foreign key (end_event_id) references profiler_event(event_id)
+);
+
+INSERT INTO instruction_run
+       SELECT
+            CAST(ROW_NUMBER() OVER (ORDER BY e.event_id) AS bigint),
+            e.mal_execution_id,
+            e.pc,
+            e.thread,
+            s.event_id,
+            e.event_id,
+            s.relative_time,
+            e.relative_time,
+            s.absolute_time,
+            e.absolute_time,
+            e.relative_time - s.relative_time,
+            e.short_statement,
+            e.mal_module,
+            e.instruction
+       FROM (SELECT * FROM profiler_event WHERE execution_state=1) AS e
+            JOIN
+            (SELECT * FROM profiler_event WHERE execution_state=0) AS s
+            ON e.pc=s.pc AND e.mal_execution_id=s.mal_execution_id;
+
+CREATE VIEW instructions AS
+       SELECT
+            pc,
+            short_statement,
+            start_time,
+            end_time,
+            astart_time,
+            aend_time,
+            duration,
+            thread,
+            mal_execution_id,
+            start_event_id,
+            end_event_id,
+            mal_module,
+            instruction
+       FROM instruction_run;
+
+commit;
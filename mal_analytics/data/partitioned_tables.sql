@@ -0,0 +1,22 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- The bookkeeping of a partitioned database, created after tables.sql
+-- (with merge tables) and shared_tables.sql. The data of the merge
+-- tables lives in one set of tables per ingestion day (see
+-- create_partition.sql), so that old data can be expired by dropping
+-- whole partitions.
+
+-- One row per partition. period is the ingestion day as an integer
+-- (YYYYMMDD). min_time and max_time are the bounds of the absolute
+-- times of the events and the heartbeats in the partition
+-- (microseconds since the epoch).
+create table storage_partition (
+       suffix varchar(16),
+       period int not null,
+       min_time bigint,
+       max_time bigint,
+
+       constraint pk_storage_partition primary key (suffix)
+);
@@ -0,0 +1,87 @@
+-- This Source Code Form is subject to the terms of the Mozilla Public
+-- License, v. 2.0. If a copy of the MPL was not distributed with this
+-- file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+-- The tables shared by all the partitions of a partitioned database,
+-- created after tables.sql.
+
+create table mal_type (
+       type_id int,
+       tname text,
+       base_size int,
+       subtype_id int,
+
+       constraint pk_mal_type primary key (type_id),
+       constraint fk_mt_subtype_id foreign key (subtype_id) references mal_type(type_id)
+);
+
+-- The start and done events of every instruction are paired at
+-- ingestion time (see instruction_run), so this view is a plain
+-- projection.
+CREATE VIEW instructions AS
+       SELECT
+            pc,
+            short_statement,
+            start_time,
+            end_time,
+            astart_time,
+            aend_time,
+            duration,
+            thread,
+            mal_execution_id,
+            start_event_id,
+            end_event_id,
+            mal_module,
+            instruction
+       FROM instruction_run;
+
+-- create table trace (
+--        trace_id bigint,
+--        trace_path varchar(255) not null,
+
+--        constraint trace_id_pk primary key (trace_id)
+-- );
+
+create table rejected_profiler_event (
+       event_id bigint,
+       mal_execution_id bigint,
+       pc int,
+       execution_state tinyint,
+       relative_time bigint,
+       absolute_time bigint,
+       thread int,
+       mal_function text,
+       usec int,
+       rss int,
+       type_size int,
+       long_statement text,
+       short_statement text,
+       instruction text,
+       mal_module text,
+       rejection_reason text
+);
+
+insert into mal_type (type_id, tname, base_size) values ( 1, 'bit', 1);
+insert into mal_type (type_id, tname, base_size) values ( 2, 'bte', 1);
+insert into mal_type (type_id, tname, base_size) values ( 3, 'sht', 2);
+insert into mal_type (type_id, tname, base_size) values ( 4, 'int', 4);
+insert into mal_type (type_id, tname, base_size) values ( 5, 'lng', 8);
+insert into mal_type (type_id, tname, base_size) values ( 6, 'hge', 16);
+insert into mal_type (type_id, tname, base_size) values ( 7, 'oid', 8);
+insert into mal_type (type_id, tname, base_size) values ( 8, 'flt', 8);
+insert into mal_type (type_id, tname, base_size) values ( 9, 'dbl', 16);
+insert into mal_type (type_id, tname, base_size) values (10, 'str', -1);
+insert into mal_type (type_id, tname, base_size) values (11, 'date', -1);
+insert into mal_type (type_id, tname, base_size) values (12, 'void', 0);
+insert into mal_type (type_id, tname, base_size) values (13, 'BAT', 0);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (14, 'bat[:bit]', 1, 1);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (15, 'bat[:bte]', 1, 2);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (16, 'bat[:sht]', 2, 3);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (17, 'bat[:int]', 4, 4);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (18, 'bat[:lng]', 8, 5);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (19, 'bat[:hge]', 16, 6);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (20, 'bat[:oid]', 8, 7);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (21, 'bat[:flt]', 8, 8);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (22, 'bat[:dbl]', 16, 9);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (23, 'bat[:str]', -1, 10);
+insert into mal_type (type_id, tname, base_size, subtype_id) values (24, 'bat[:date]', -1, 11);
@@ -2,21 +2,23 @@
 -- License, v. 2.0. If a copy of the MPL was not distributed with this
 -- file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-start transaction;
-
-create table mal_execution (
+-- The tables that grow with the ingested traces. {table_kind} is
+-- replaced by "table", or by "merge table" for the merge tables of a
+-- partitioned database, and {suffix} by the suffix of a partition (see
+-- create_partition.sql), or by nothing. The constraints are added by
+-- add_constraints.sql and add_cross_partition_keys.sql, and the tables
+-- shared by all the partitions are in shared_tables.sql.
+
+create {table_kind} mal_execution{suffix} (
        execution_id bigint,
        -- the type of the following should be UUID
        server_session char(36) not null,
        tag int not null,
        server_version char(120),
-       user_function char(30),
-
-       constraint pk_mal_execution primary key (execution_id),
-       constraint unique_me_mal_execution unique(server_session, tag)
+       user_function char(30)
 );
 
-create table profiler_event (
+create {table_kind} profiler_event{suffix} (
        event_id bigint,
        mal_execution_id bigint not null,
        pc int not null,
@@ -31,35 +33,16 @@ create table profiler_event (
        long_statement text,
        short_statement text,
        instruction text,
-       mal_module text,
-
-       constraint pk_profiler_event primary key (event_id),
-       constraint fk_pe_mal_execution_id foreign key (mal_execution_id) references mal_execution(execution_id),
-       constraint unique_pe_profiler_event unique(mal_execution_id, pc, execution_state)
+       mal_module text
 );
 
-create table prerequisite_events (
+create {table_kind} prerequisite_events{suffix} (
        prerequisite_relation_id bigint,
        prerequisite_event bigint,
-       consequent_event bigint,
-
-       constraint pk_prerequisite_events primary key (prerequisite_relation_id),
-       constraint fk_pre_prerequisite_event foreign key (prerequisite_event) references profiler_event(event_id),
-       constraint fk_pre_consequent_event foreign key (consequent_event) references profiler_event(event_id)
-);
-
-create table mal_type (
-       type_id int,
-       tname text,
-       base_size int,
-       subtype_id int,
-
-       constraint pk_mal_type primary key (type_id),
-       constraint fk_mt_subtype_id foreign key (subtype_id) references mal_type(type_id)
+       consequent_event bigint
 );
 
-
-create table mal_variable (
+create {table_kind} mal_variable{suffix} (
        variable_id bigint,
        name varchar(20) not null,
        mal_execution_id bigint not null,
@@ -72,139 +55,59 @@ create table mal_variable (
        seqbase int,
        hghbase int,
        mal_value text,
-       parent int,
-
-       constraint pk_mal_variable primary key (variable_id),
-       constraint fk_mv_mal_execution_id foreign key (mal_execution_id) references mal_execution(execution_id),
-       constraint fk_mv_type_id foreign key (type_id) references mal_type(type_id),
-       constraint unique_mv_var_name unique (mal_execution_id, name)
+       parent int
 );
 
-create table event_variable_list (
+create {table_kind} event_variable_list{suffix} (
        event_id bigint,
        variable_list_index int,
        variable_id bigint,
        created bool,
-       eol bool,
-
-       constraint pk_event_variable_list primary key (event_id, variable_list_index),
-       constraint fk_evl_event_id foreign key (event_id) references profiler_event(event_id),
-       constraint fk_evl_variable_id foreign key (variable_id) references mal_variable(variable_id)
+       eol bool
 );
 
-create table query (
+create {table_kind} query{suffix} (
        query_id bigint,
        query_text text,
        query_label text,
-       root_execution_id bigint,
-
-       constraint pk_query primary key (query_id),
-       constraint fk_root_execution_id foreign key (root_execution_id) references mal_execution(execution_id)
+       root_execution_id bigint
 );
 
-create table initiates_executions (
+create {table_kind} initiates_executions{suffix} (
        initiates_executions_id bigint,
        parent_id bigint,
        child_id bigint,
-       "remote" bool not null,
-
-       constraint pk_initiates_executions primary key (initiates_executions_id),
-       constraint fk_parent_id foreign key (parent_id) references mal_execution(execution_id),
-       constraint fk_child_id foreign key (child_id) references mal_execution(execution_id)
+       "remote" bool not null
 );
 
-create table heartbeat (
+create {table_kind} heartbeat{suffix} (
        heartbeat_id bigint,
        server_session char(36) not null,
        clk bigint,
        ctime bigint,
        rss int,
-       nvcsw int,
-
-       constraint pk_heartbeat primary key (heartbeat_id)
+       nvcsw int
 );
 
-create table cpuload (
+create {table_kind} cpuload{suffix} (
        cpuload_id bigint,
        heartbeat_id bigint,
-       val double,
-
-       constraint pk_cpuload primary key (cpuload_id),
-       constraint fk_cl_heartbeat_id foreign key (heartbeat_id) references heartbeat(heartbeat_id)
+       val double
 );
 
-CREATE VIEW instructions AS
-       SELECT
-            e.pc,
-            e.short_statement,
-            s.relative_time as start_time,
-            e.relative_time as end_time,
-            s.absolute_time as astart_time,
-            e.absolute_time as aend_time,
-            e.relative_time - s.relative_time AS duration,
-            e.thread,
-            e.mal_execution_id,
-            s.event_id as start_event_id,
-            e.event_id as end_event_id,
-            e.mal_module,
-            e.instruction
-       FROM (SELECT * FROM profiler_event WHERE execution_state=1) AS e
-            JOIN
-            (SELECT * FROM profiler_event WHERE execution_state=0) AS s
-            ON e.pc=s.pc AND e.mal_execution_id=s.mal_execution_id ORDER BY start_time ASC;
-
--- create table trace (
---        trace_id bigint,
---        trace_path varchar(255) not null,
-
---        constraint trace_id_pk primary key (trace_id)
--- );
-
-create table rejected_profiler_event (
-       event_id bigint,
-       mal_execution_id bigint,
-       pc int,
-       execution_state tinyint,
-       relative_time bigint,
-       absolute_time bigint,
+create {table_kind} instruction_run{suffix} (
+       instruction_run_id bigint,
+       mal_execution_id bigint not null,
+       pc int not null,
        thread int,
-       mal_function text,
-       usec int,
-       rss int,
-       type_size int,
-       long_statement text,
+       start_event_id bigint,
+       end_event_id bigint not null,
+       start_time bigint,
+       end_time bigint,
+       astart_time bigint,
+       aend_time bigint,
+       duration bigint,
        short_statement text,
-       instruction text,
        mal_module text,
-       rejection_reason text
+       instruction text
 );
-
-commit;
-
-
-start transaction;
-insert into mal_type (type_id, tname, base_size) values ( 1, 'bit', 1);
-insert into mal_type (type_id, tname, base_size) values ( 2, 'bte', 1);
-insert into mal_type (type_id, tname, base_size) values ( 3, 'sht', 2);
-insert into mal_type (type_id, tname, base_size) values ( 4, 'int', 4);
-insert into mal_type (type_id, tname, base_size) values ( 5, 'lng', 8);
-insert into mal_type (type_id, tname, base_size) values ( 6, 'hge', 16);
-insert into mal_type (type_id, tname, base_size) values ( 7, 'oid', 8);
-insert into mal_type (type_id, tname, base_size) values ( 8, 'flt', 8);
-insert into mal_type (type_id, tname, base_size) values ( 9, 'dbl', 16);
-insert into mal_type (type_id, tname, base_size) values (10, 'str', -1);
-insert into mal_type (type_id, tname, base_size) values (11, 'date', -1);
-insert into mal_type (type_id, tname, base_size) values (12, 'void', 0);
-insert into mal_type (type_id, tname, base_size) values (13, 'BAT', 0);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (14, 'bat[:bit]', 1, 1);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (15, 'bat[:bte]', 1, 2);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (16, 'bat[:sht]', 2, 3);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (17, 'bat[:int]', 4, 4);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (18, 'bat[:lng]', 8, 5);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (19, 'bat[:hge]', 16, 6);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (20, 'bat[:oid]', 8, 7);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (21, 'bat[:flt]', 8, 8);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (22, 'bat[:dbl]', 16, 9);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (23, 'bat[:str]', -1, 10);
-insert into mal_type (type_id, tname, base_size, subtype_id) values (24, 'bat[:date]', -1, 11);
-commit;
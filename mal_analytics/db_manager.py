@@ -4,64 +4,264 @@
 #
 # Copyright MonetDB Solutions B.V. 2018-2019
 
-from io import StringIO
+from io import BytesIO
+import collections
+import importlib
 import json
 import logging
 import os
+import shutil
+import threading
+import time
+import uuid
 
-import monetdblite
-
+from mal_analytics.cache import QueryCache
 from mal_analytics.exceptions import InitializationError
 from mal_analytics.exceptions import DatabaseManagerError
 from mal_analytics.exceptions import AnalyticsException
+from mal_analytics.exceptions import QueryError
+from mal_analytics.partitions import PartitionManager
 from mal_analytics.profiler_parser import ProfilerObjectParser
+from mal_analytics.profiling import profile_ingest
+from mal_analytics.progress import ProgressTracker
+from mal_analytics.progress import REPORT_EVERY
+from mal_analytics.quarantine import decode_objects
+from mal_analytics.stats import create_stats
 
 LOGGER = logging.getLogger(__name__)
 
+# The version of the schema created by this package. Databases that
+# record this version in the schema_info table are not inspected
+# further when they are opened.
+SCHEMA_VERSION = 2
+
 
-class Singleton(type):
-    """Singleton pattern implementation for Python 3.
+class _LazyModule(object):
+    """Import a module the first time one of its attributes is used.
 
-    See also `this <https://stackoverflow.com/a/6798042>`_
-    stackoverflow post.
+    Importing MonetDBLite starts the embedded engine, which is not
+    needed by tools that only parse traces.
     """
-    # We should consider having one instance per data directory,
-    # although it probably does not make sense with MonetDBLite.
-    _instances = {}
 
-    def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton,
-                                        cls).__call__(*args, **kwargs)
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            LOGGER.debug("Importing %s", self._name)
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+monetdblite = _LazyModule('monetdblite')
+numpy = _LazyModule('numpy')
+
+DictionaryColumn = collections.namedtuple('DictionaryColumn', ['codes', 'dictionary'])
+DictionaryColumn.__doc__ = """A dictionary encoded string column.
+
+``codes`` is an array of 32 bit integers indexing ``dictionary``. NULL
+values have the code -1. The column can be decoded with
+``dictionary[codes]`` if there are no NULLs.
+"""
+
+
+class _DictionaryEncoder(object):
+    """Encode string columns against a dictionary that grows as new
+    values are encountered, so that codes stay valid across chunks.
+    """
+
+    def __init__(self):
+        self._codes = dict()
+        self._values = list()
+
+    def encode(self, column):
+        mask = numpy.ma.getmaskarray(column)
+        data = numpy.ma.getdata(column)
+        codes = numpy.full(len(data), -1, dtype=numpy.int32)
+
+        present = ~mask
+        if present.any():
+            uniques, inverse = numpy.unique(data[present].astype(object), return_inverse=True)
+            unique_codes = numpy.empty(len(uniques), dtype=numpy.int32)
+            for i, value in enumerate(uniques):
+                code = self._codes.get(value)
+                if code is None:
+                    code = len(self._values)
+                    self._codes[value] = code
+                    self._values.append(value)
+                unique_codes[i] = code
+            codes[present] = unique_codes[inverse]
+
+        dictionary = numpy.empty(len(self._values), dtype=object)
+        dictionary[:] = self._values
+        return DictionaryColumn(codes, dictionary)
+
+
+def _is_read_only(query):
+    statement = query.lstrip().split(None, 1)
+    return bool(statement) and statement[0].upper() in ('SELECT', 'WITH')
+
+
+class _DeferredConstraints(object):
+    """The context manager returned by
+    :meth:`DatabaseManager.defer_constraints`.
+    """
 
-        obj = cls._instances[cls]
-        if not obj.is_connected():
-            obj._connect()
+    def __init__(self, dbm):
+        self._dbm = dbm
+        # The partitions whose constraints have been dropped, and if
+        # the secondary indexes should be rebuilt.
+        self.suffixes = list()
+        self.indexes = False
+
+    def __enter__(self):
+        self._dbm._begin_deferred(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._dbm._end_deferred(self)
+
+
+class Registry(type):
+    """Keep one instance per database directory.
+
+    Instances are keyed by the resolved path of their database, so
+    that every call with the same directory returns the same object
+    and the same connection. Every call increments the reference count
+    of the instance, and :meth:`DatabaseManager.release` decrements it.
+
+    MonetDBLite runs at most one database per process. Asking for a
+    second directory while the first one is still open raises a
+    :class:`mal_analytics.exceptions.DatabaseManagerError`. Instances
+    are bound to the process that created them. After a ``fork`` the
+    child process should open the database again.
+    """
+    _instances = {}
+    _lock = threading.RLock()
+
+    def __call__(cls, dbpath, *args, **kwargs):
+        key = os.path.realpath(dbpath)
+        pid = os.getpid()
+        with Registry._lock:
+            for other_key, other in list(cls._instances.items()):
+                if other._pid != pid:
+                    # Inherited from the parent process
+                    del cls._instances[other_key]
+                elif other_key != key:
+                    if other.is_connected():
+                        raise DatabaseManagerError(
+                            "Cannot open database {}: database {} is open in this process"
+                            .format(dbpath, other.get_dbpath()))
+                    other.close_database()
+
+            obj = cls._instances.get(key)
+            if obj is None:
+                obj = super(Registry, cls).__call__(dbpath, *args, **kwargs)
+                cls._instances[key] = obj
+            elif not obj.is_connected():
+                obj._connect()
+
+            obj._refcount += 1
 
         return obj
 
+    def unregister(cls, obj):
+        with Registry._lock:
+            key = os.path.realpath(obj.get_dbpath())
+            if cls._instances.get(key) is obj:
+                del cls._instances[key]
+
+    def open_databases(cls):
+        """Get the databases opened by this process.
+
+        Returns:
+            A list with the resolved paths of the databases.
+        """
+        with Registry._lock:
+            pid = os.getpid()
+            return [key for key, obj in cls._instances.items() if obj._pid == pid]
+
 
-class DatabaseManager(object, metaclass=Singleton):
+class DatabaseManager(object, metaclass=Registry):
     """A connection manager for the database.
 
-    This class is a *singleton*. Singletons are to be avoided in
-    general, but unfortunatelly any component communicating directly
-    with MonetDBLite should be a singleton, because of the way
-    MonetDBLite operates.
+    There is one instance per database directory (see
+    :class:`Registry`). ``DatabaseManager(dbpath)`` opens the database,
+    or returns the instance that already has it open. Every such call
+    should be paired with a call of :meth:`release`, or the manager can
+    be used as a context manager. MonetDBLite can run only one database
+    per process, so different databases should be opened by different
+    processes, or one after the other.
 
     Args:
         dbpath: The directory to initialize MonetDBLite
+        partitioned: If ``True`` and the database is new, create a
+            partitioned database (see
+            :class:`mal_analytics.partitions.PartitionManager`). This
+            has no effect on existing databases.
+        retention_days: If given, partitions older than this number of
+            days are dropped after every data load. Only meaningful for
+            partitioned databases.
+        query_cache_bytes: If given, the results of
+            :meth:`execute_query` are cached, using at most this many
+            bytes (see :meth:`set_query_cache`).
+        collect_stats: Collect ingestion statistics (see
+            :meth:`get_stats`). If ``None`` the environment variable
+            ``MAL_ANALYTICS_STATS`` decides (see :mod:`mal_analytics.stats`).
+        clock: A function returning the wall clock time in seconds. It
+            decides the partition new data is loaded into.
     """
 
-    def __init__(self, dbpath):
+    def __init__(self, dbpath, partitioned=False, retention_days=None,
+                 query_cache_bytes=None, collect_stats=None, clock=time.time):
         self._dbpath = dbpath
         self._connection = None
+        self._pid = os.getpid()
+        self._refcount = 0
+        self._engine_running = False
+        self._partitioned = partitioned
+        self._partitions = None
+        self._retention_days = retention_days
+        self._clock = clock
+        self._deferred = None
+        self._generation = 0
+        self._instance_id = None
+        self._query_cache = None
+        self._stats = create_stats(collect_stats)
+        if query_cache_bytes:
+            self.set_query_cache(query_cache_bytes)
         self._connect()
         self._initialize_tables()
         self._lines = 0
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
     def _connect(self):
+        self._check_process()
         self._connection = monetdblite.make_connection(self._dbpath, True)
+        self._engine_running = True
+        self._instance_id = uuid.uuid4().hex
+
+    def _check_process(self):
+        if os.getpid() != self._pid:
+            raise DatabaseManagerError(
+                "Database {} was opened by process {}".format(self._dbpath, self._pid))
+
+    def release(self):
+        """Release a reference to the database.
+
+        When the last reference is released the database is closed
+        (see :meth:`close_database`).
+        """
+        with Registry._lock:
+            self._refcount -= 1
+            if self._refcount <= 0:
+                self.close_database()
 
     def _initialize_tables(self):
         tables = [
@@ -74,36 +274,71 @@ class DatabaseManager(object, metaclass=Singleton):
             'query',
             'initiates_executions',
             'heartbeat',
-            'cpuload'
+            'cpuload',
+            'instruction_run',
         ]
         cursor = self.get_cursor()
-        rslt = 0
-        for tbl in tables:
-            rslt += cursor.execute("SELECT id FROM _tables WHERE name =%s",
-                                   tbl)
 
-        # All the tables already exist
-        if rslt == len(tables):
+        # Fast path: the database was initialized by this version.
+        try:
+            cursor.execute("SELECT version, partitioned FROM schema_info")
+            info = cursor.fetchall()
+        except monetdblite.Error:
+            info = None
+        if info and info[0][0] == SCHEMA_VERSION:
+            if info[0][1]:
+                self._partitions = PartitionManager(self, self._clock)
+            cursor.close()
             return
 
-        # TODO define an abstract root data directory
-        cpath = os.path.dirname(os.path.abspath(__file__))
-        tables_file = os.path.join(cpath, 'data', 'tables.sql')
-        try:
-            self.execute_sql_script(tables_file)
-        except monetdblite.Error as e:
-            LOGGER.warning("Table initialization script failed:\n  %s", e)
-            self._connection.rollback()
-
-        for tbl in tables:
-            rslt = cursor.execute("SELECT id FROM _tables WHERE name =%s", tbl)
-            # This should never happen
-            if rslt != 1:
-                LOGGER.error("Did not find table %s in database %s", tbl,
-                             self.get_dbpath)
-                raise InitializationError(
-                    "Database {} did not initialize properly (table {} not found)"
-                    .format(self.get_dbpath, tbl))
+        cursor.execute("SELECT name FROM _tables WHERE name IN ({})".format(
+            ", ".join(["%s"] * (len(tables) + 1))), tables + ['storage_partition'])
+        existing = set([row[0] for row in cursor.fetchall()])
+        if 'storage_partition' in existing:
+            self._partitions = PartitionManager(self, self._clock)
+
+        missing = [tbl for tbl in tables if tbl not in existing]
+        if missing:
+            # TODO define an abstract root data directory
+            cpath = os.path.dirname(os.path.abspath(__file__))
+            try:
+                if missing == ['instruction_run'] and self._partitions is None:
+                    # The database was created by an older version of this
+                    # package. Pair the events that are already there.
+                    LOGGER.info("Creating table instruction_run in database %s",
+                                self.get_dbpath())
+                    self.execute_sql_script(os.path.join(
+                        cpath, 'data', 'migrate_instruction_run.sql'))
+                elif self._partitioned and len(missing) == len(tables):
+                    self._partitions = PartitionManager(self, self._clock)
+                    self._partitions.initialize()
+                else:
+                    self.transaction()
+                    self.execute_sql_script(os.path.join(cpath, 'data', 'tables.sql'),
+                                            {'table_kind': 'table', 'suffix': ''})
+                    self.execute_sql_script(os.path.join(cpath, 'data', 'shared_tables.sql'))
+                    self.add_constraints()
+                    self.commit()
+            except monetdblite.Error as e:
+                LOGGER.warning("Table initialization script failed:\n  %s", e)
+                self._connection.rollback()
+
+            for tbl in tables:
+                rslt = cursor.execute("SELECT id FROM _tables WHERE name =%s", tbl)
+                # This should never happen
+                if rslt != 1:
+                    LOGGER.error("Did not find table %s in database %s", tbl,
+                                 self.get_dbpath())
+                    raise InitializationError(
+                        "Database {} did not initialize properly (table {} not found)"
+                        .format(self.get_dbpath(), tbl))
+
+        if info is None:
+            cursor.execute("CREATE TABLE schema_info (version int, partitioned bool)")
+        cursor.execute("DELETE FROM schema_info")
+        cursor.execute("INSERT INTO schema_info (version, partitioned) VALUES (%s, %s)",
+                       [SCHEMA_VERSION, self._partitions is not None])
+        cursor.close()
 
     def _disconnect(self):
         self._connection.close()
@@ -117,16 +352,37 @@ class DatabaseManager(object, metaclass=Singleton):
         """
         return self._dbpath
 
-    def execute_query(self, query, params=None):
+    def execute_query(self, query, params=None, use_cache=True):
         """Execute a single query and return the results.
 
+        If the query cache is enabled (see :meth:`set_query_cache`),
+        the results of read only queries (``SELECT`` and ``WITH``) are
+        served from the cache as long as no data has been committed
+        since they were computed. Cached results are shared and their
+        arrays are read only. Any other statement invalidates the
+        cache.
+
         Args:
             query: The text of the query.
+            params: The parameters of the query.
+            use_cache: If ``False`` always execute the query.
 
         Returns:
             The results
         """
-        cursor = self._connection.cursor()
+        read_only = _is_read_only(query)
+        if not read_only:
+            self._generation += 1
+        cacheable = self._query_cache is not None and use_cache and read_only
+
+        if cacheable:
+            key = QueryCache.make_key(query, params)
+            results = self._query_cache.get(key, self._generation)
+            if results is not None:
+                LOGGER.debug("query cache hit\n %s\n with parameters\n %s", query, params)
+                return results
+
+        cursor = self.get_cursor()
         try:
             LOGGER.debug("executing query\n %s\n with parameters\n %s", query,
                          params)
@@ -141,9 +397,151 @@ class DatabaseManager(object, metaclass=Singleton):
             # TODO: consider raising an exception
             results = None
 
+        if cacheable and results is not None:
+            self._query_cache.put(key, self._generation, results)
+
         return results
 
-    def execute_sql_script(self, script_path):
+    def set_query_cache(self, max_bytes):
+        """Enable or disable caching the results of :meth:`execute_query`.
+
+        The cache is invalidated whenever data is committed to the
+        database, for instance after :meth:`parse_trace`.
+
+        Args:
+            max_bytes: The maximum estimated size of the cached
+                results in bytes, or ``None`` to disable the cache.
+        """
+        if max_bytes:
+            self._query_cache = QueryCache(max_bytes)
+        else:
+            self._query_cache = None
+
+    def get_query_cache(self):
+        """Get the query cache.
+
+        Returns:
+            A :class:`mal_analytics.cache.QueryCache` object or ``None``
+            if caching is disabled.
+        """
+        return self._query_cache
+
+    def get_generation(self):
+        """Get the ingest generation of the database.
+
+        The generation is incremented every time a transaction is
+        committed or rolled back, and after executing a SQL script.
+        Results computed at the same generation are consistent with
+        each other.
+
+        Returns:
+            An integer.
+        """
+        return self._generation
+
+    def get_instance_id(self):
+        """Get a token that identifies the database since it was started.
+
+        A new token is created every time the database is started,
+        including by :meth:`swap_database`. The generation (see
+        :meth:`get_generation`) starts over with every manager, so the
+        token and the generation together identify the contents of the
+        database across restarts.
+
+        Returns:
+            A string.
+        """
+        return self._instance_id
+
+    def stream_query(self, query, params=None, chunk_size=65536, key=None,
+                     dictionary_columns=()):
+        """Execute a query and return the results in chunks.
+
+        The query is executed once per chunk, limited to
+        ``chunk_size`` rows, so that results larger than the available
+        memory can be processed. If ``key`` is given the results are
+        ordered by this column and each chunk continues after the
+        last key of the previous one. Otherwise the chunks are
+        fetched using ``OFFSET``, which gets slower as the offset
+        grows and relies on the query producing its rows in the same
+        order every time it is executed.
+
+        The query must not contain an ``ORDER BY`` clause, since it is
+        used as a subquery. Chunks are not read from the same snapshot
+        of the database.
+
+        Args:
+            query: The text of the query.
+            params: The parameters of the query (see
+                :meth:`execute_query`).
+            chunk_size: The maximum number of rows in every chunk.
+            key: The name of a result column with unique values.
+            dictionary_columns: The names of string result columns
+                that should be returned as
+                :class:`DictionaryColumn` objects. The dictionaries
+                are shared by all the chunks. ``key`` cannot be one
+                of these columns.
+
+        Yields:
+            Dictionaries with keys the column names and values NumPy
+            arrays, as returned by ``fetchnumpy``.
+
+        Raises:
+            :class:`mal_analytics.exceptions.QueryError`: if the
+                query fails.
+        """
+        if chunk_size <= 0:
+            raise ValueError("chunk_size should be positive")
+        if key is not None and key in dictionary_columns:
+            raise ValueError("The key column {} cannot be dictionary encoded".format(key))
+
+        params = list(params or [])
+        encoders = dict([(c, _DictionaryEncoder()) for c in dictionary_columns])
+        offset = 0
+        last_key = None
+        while True:
+            chunk_params = params
+            if key is None:
+                chunk_query = "SELECT * FROM ({}) AS chunk LIMIT {} OFFSET {}".format(
+                    query, chunk_size, offset)
+            elif last_key is None:
+                chunk_query = "SELECT * FROM ({}) AS chunk ORDER BY {} LIMIT {}".format(
+                    query, key, chunk_size)
+            else:
+                chunk_query = "SELECT * FROM ({}) AS chunk WHERE {} > %s ORDER BY {} LIMIT {}".format(
+                    query, key, key, chunk_size)
+                chunk_params = params + [last_key]
+
+            results = self._fetch_numpy(chunk_query, chunk_params or None)
+            rows = len(next(iter(results.values()))) if results else 0
+            if rows == 0:
+                return
+
+            if key is not None:
+                # numpy scalars cannot be used as query parameters
+                last_key = results[key][-1].item()
+            for column, encoder in encoders.items():
+                results[column] = encoder.encode(results[column])
+
+            yield results
+
+            if rows < chunk_size:
+                return
+            offset += rows
+
+    def _fetch_numpy(self, query, params):
+        cursor = self.get_cursor()
+        try:
+            LOGGER.debug("executing query\n %s\n with parameters\n %s", query,
+                         params)
+            cursor.execute(query, params)
+            return cursor.fetchnumpy()
+        except monetdblite.Error as e:
+            raise QueryError("Query failed: {}\n{}".format(e, query)) from e
+        finally:
+            cursor.close()
+
+    def execute_sql_script(self, script_path, parameters=None):
         """Execute a given sql script.
 
         This method does not return results. This is intended for
@@ -152,6 +550,9 @@ class DatabaseManager(object, metaclass=Singleton):
 
         Args:
             script_path: A string with the path to the script.
+            parameters: A dictionary. If given, every statement is
+                formatted (using :meth:`str.format`) with it before
+                execution.
         """
         with open(script_path) as sql_fl:
             sql_in = sql_fl.readlines()
@@ -165,16 +566,21 @@ class DatabaseManager(object, metaclass=Singleton):
             stmt.append(cline)
             if cline.endswith(';'):
                 statement = " ".join(stmt)
+                if parameters is not None:
+                    statement = statement.format(**parameters)
                 # print(statement)
                 self._connection.execute(statement)
                 stmt = list()
 
+        self._generation += 1
+
     def get_cursor(self):
         """Get a cursor to the current database connection.
 
         Returns:
             A MonetDBLite cursor.
         """
+        self._check_process()
         return self._connection.cursor()
 
     def close_connection(self):
@@ -211,6 +617,7 @@ class DatabaseManager(object, metaclass=Singleton):
               #. prerequisite relation ID
               #. query ID
               #. initiates executions ID
+              #. instruction run ID
 
         """
 
@@ -256,6 +663,11 @@ class DatabaseManager(object, metaclass=Singleton):
                 'alias': 'max_initiates_id',
                 'table': 'initiates_executions'
             },
+            {
+                'id_column': 'instruction_run_id',
+                'alias': 'max_instruction_run_id',
+                'table': 'instruction_run'
+            },
         ]
 
         results = dict([
@@ -267,18 +679,41 @@ class DatabaseManager(object, metaclass=Singleton):
 
         return results
 
-    def create_parser(self):
+    def create_parser(self, compact=False, memory_budget=None, spill_dir=None, quarantine=None):
         """Create and initialize a new :class:`mal_analytics.profiler_parser.ProfilerObjectParser` object.
 
+        Args:
+            compact: Create a parser that elides start events (see
+                :class:`mal_analytics.profiler_parser.ProfilerObjectParser`).
+            memory_budget: The approximate number of bytes the parser
+                may hold in memory before spilling to disk.
+            spill_dir: The directory of the spilled segments.
+            quarantine: A :class:`mal_analytics.quarantine.Quarantine`
+                for the invalid objects, or ``None`` to raise on them.
+
         Returns:
             A new parser for MonetDB JSON Profiler objects
         """
 
-        return ProfilerObjectParser(self.get_limits())
+        return ProfilerObjectParser(self.get_limits(), compact, memory_budget, spill_dir, self._stats,
+                                    quarantine)
 
     def insert_data(self, table, data):
+        """Insert columns into a table.
+
+        Errors are logged and counted (``insert_errors``), not raised.
+
+        Args:
+            table: The name of the table.
+            data: A dictionary with keys the column names and values
+                lists.
+
+        Returns:
+            ``True`` if the data was inserted.
+        """
         if not self.is_connected():
             raise DatabaseManagerError("Manager is not connected")
+        self._check_process()
 
         cursor = self._connection.cursor()
         try:
@@ -286,30 +721,78 @@ class DatabaseManager(object, metaclass=Singleton):
             # LOGGER.debug('Inserting data %s to table %s', data, table)
             cursor.insert(table, data)
         except monetdblite.Error as err:
+            self._stats.increment('insert_errors')
             LOGGER.error("Did not insert data to %s\nError: %s", table,
                          str(err))
             # LOGGER.warning(data)
+            return False
+        finally:
+            cursor.close()
 
-        cursor.close()
+        return True
 
-    def drop_constraints(self):
+    def drop_constraints(self, suffix=''):
         cpath = os.path.dirname(os.path.abspath(__file__))
+        if not self.is_partitioned():
+            self.execute_sql_script(os.path.join(cpath, 'data', 'drop_cross_partition_keys.sql'))
         drop_file = os.path.join(cpath, 'data', 'drop_constraints.sql')
-        self.execute_sql_script(drop_file)
+        self.execute_sql_script(drop_file, {'suffix': suffix})
 
-    def add_constraints(self):
+    def add_constraints(self, suffix=''):
         cpath = os.path.dirname(os.path.abspath(__file__))
         add_file = os.path.join(cpath, 'data', 'add_constraints.sql')
+        self.execute_sql_script(add_file, {'suffix': suffix})
+        # In partitioned databases these are checked by
+        # PartitionManager.check_references (see _finish_load).
+        if not self.is_partitioned():
+            self.execute_sql_script(os.path.join(cpath, 'data', 'add_cross_partition_keys.sql'))
+
+    def add_indexes(self):
+        """Build the secondary indexes for the common access paths.
+
+        The indexes are defined in ``data/add_indexes.sql``. Once
+        built, they are dropped before every data load and rebuilt
+        afterwards (see :meth:`load_parsed_data`).
+
+        Raises:
+            :class:`mal_analytics.exceptions.DatabaseManagerError`: if
+                the database is partitioned. Merge tables cannot be
+                indexed.
+        """
+        if self.is_partitioned():
+            raise DatabaseManagerError("Partitioned databases do not support secondary indexes")
+        cpath = os.path.dirname(os.path.abspath(__file__))
+        add_file = os.path.join(cpath, 'data', 'add_indexes.sql')
         self.execute_sql_script(add_file)
 
+    def drop_indexes(self):
+        """Drop the secondary indexes built by :meth:`add_indexes`."""
+        cpath = os.path.dirname(os.path.abspath(__file__))
+        drop_file = os.path.join(cpath, 'data', 'drop_indexes.sql')
+        self.execute_sql_script(drop_file)
+
+    def has_indexes(self):
+        """Inquire if the secondary indexes have been built.
+
+        Returns:
+            `True` if :meth:`add_indexes` has been called on this
+            database and the indexes have not been dropped since.
+        """
+        cursor = self._connection.cursor()
+        rslt = cursor.execute("SELECT id FROM sys.idxs WHERE name LIKE 'idx_%'")
+        cursor.close()
+        return rslt > 0
+
     def transaction(self):  # pragma: no coverage
         self._connection.transaction()
 
     def commit(self):  # pragma: no coverage
         self._connection.commit()
+        self._generation += 1
 
     def rollback(self):  # pragma: no coverage
         self._connection.rollback()
+        self._generation += 1
 
     def _read_object(self, lines):
         buf = []
@@ -321,19 +804,74 @@ class DatabaseManager(object, metaclass=Singleton):
                 return json_string
                 # print(json_string)
 
-    def parse_trace(self, contents):
+    def parse_trace(self, contents, compact=False, memory_budget=None, progress=None,
+                    profile=None, quarantine=None, source=None):
         """Parse a string representing a MonetDB profiler trace.
 
            Args:
                contents:
+               compact: If ``True`` do not store the start events of
+                   completed instructions.
+               memory_budget: The approximate number of bytes of
+                   parsed rows kept in memory (see
+                   :class:`mal_analytics.profiler_parser.ProfilerObjectParser`).
+               progress: A function called with a
+                   :class:`mal_analytics.progress.ProgressReport` while
+                   the trace is loaded.
+               profile: Profile the ingest (see
+                   :func:`mal_analytics.profiling.profile_directory`).
+               quarantine: A :class:`mal_analytics.quarantine.Quarantine`.
+                   If given, invalid objects are quarantined instead of
+                   aborting the ingest.
+               source: The name of the trace, usually the path of its
+                   file. It names the profile, the quarantined objects
+                   and the statistics of the ingest.
         """
-        pob = self.create_parser()
-
-        LOGGER.debug("Ingesting trace: %d", len(contents))
+        if source is None:
+            source = 'parse_trace'
+        with profile_ingest(self._dbpath, source, profile):
+            self._parse_trace(contents, compact, memory_budget, progress, quarantine, source)
+
+    def _parse_trace(self, contents, compact, memory_budget, progress, quarantine, source):
+        start_stats = self._stats.get_stats()
+        pob = self.create_parser(compact, memory_budget, quarantine=quarantine)
+        # The progress is reported in bytes of the encoded trace, like
+        # for trace files.
+        data = contents.encode('utf-8')
+        tracker = None
+        if progress is not None:
+            tracker = ProgressTracker(progress, len(data))
+            tracker.start_phase('read')
+
+        LOGGER.debug("Ingesting trace: %d", len(data))
         self._lines = 0
-        with StringIO(contents) as fl:
+        if quarantine is not None:
+            with BytesIO(data) as fl, self._stats.timer('decode'):
+                json_stream, _ = decode_objects(fl, quarantine, source, tracker)
+        else:
+            json_stream = self._decode_trace(data, tracker)
+        self._stats.increment('bytes_read', len(data))
+        self._stats.increment('objects_decoded', len(json_stream))
+        LOGGER.debug("Ingesting trace done")
+
+        LOGGER.debug("Parsing trace..")
+        pob.parse_trace_stream(json_stream, tracker)
+        pob.flush_pending_events()
+        # LOGGER.debug("Writing tables to CSVs...")
+        # pob.to_csv("/tmp/traces")
+        # LOGGER.debug("Done")
+        self.load_parsed_data(pob, tracker)
+        if tracker is not None:
+            tracker.finish()
+        LOGGER.debug("Parsing trace done")
+        self._stats.log_summary('ingest', start_stats, database=self._dbpath, trace=source,
+                                objects=len(json_stream))
+
+    def _decode_trace(self, data, tracker):
+        with BytesIO(data) as fl, self._stats.timer('decode'):
+            lines = (ln.decode('utf-8') for ln in fl)
             json_stream = list()
-            json_string = self._read_object(fl)
+            json_string = self._read_object(lines)
             while json_string:
                 try:
                     json_stream.append(json.loads(json_string))
@@ -341,46 +879,384 @@ class DatabaseManager(object, metaclass=Singleton):
                     LOGGER.error("JSON parser failed:\n line: %d\n string: %s",
                                  self._lines, json_string)
                     raise
-                json_string = self._read_object(fl)
-        LOGGER.debug("Ingesting trace done")
+                if tracker is not None and len(json_stream) % REPORT_EVERY == 0:
+                    tracker.advance(REPORT_EVERY, fl.tell())
+                json_string = self._read_object(lines)
+        return json_stream
 
-        LOGGER.debug("Parsing trace..")
-        pob.parse_trace_stream(json_stream)
-        # LOGGER.debug("Writing tables to CSVs...")
-        # pob.to_csv("/tmp/traces")
-        # LOGGER.debug("Done")
+    def load_parsed_data(self, pob, progress=None):
+        """Load the data collected by a parser into the database.
+
+        The data is loaded in a single transaction. Constraints (and
+        secondary indexes, if they have been built) are dropped
+        before loading and are restored afterwards. On success the
+        internal state of the parser is cleared.
+
+        In a partitioned database the data is loaded into the
+        partition of the current day. If a retention period has been
+        set, older partitions are dropped afterwards.
+
+        Inside a :meth:`defer_constraints` block the constraints are
+        neither dropped nor restored, and the data is committed as it
+        is.
+
+        Args:
+            pob: A :class:`mal_analytics.profiler_parser.ProfilerObjectParser`
+                object.
+            progress: A :class:`mal_analytics.progress.ProgressTracker`.
+
+        Returns:
+            The number of rows rejected by the constraints. Inside a
+            :meth:`defer_constraints` block this is always 0, since the
+            constraints are enforced when the block exits.
+        """
+        suffix = self._current_suffix()
+        deferred = self._deferred
+        # Past midnight a deferred load goes to a new partition.
+        drop = deferred is None or suffix not in deferred.suffixes
+
+        if progress is not None:
+            progress.start_phase('load')
+        rebuild_indexes = deferred is None and self.has_indexes()
         self.transaction()
         try:
-            self.drop_constraints()
-            for table, data in pob.get_data().items():
-                self.insert_data(table, data)
+            if rebuild_indexes:
+                self.drop_indexes()
+            if drop:
+                with self._stats.timer('drop_constraints'):
+                    self.drop_constraints(suffix)
+            self._insert_parsed_data(pob, suffix, progress)
+            if deferred is not None and self._partitions is not None:
+                self._partitions.update_bounds(suffix)
 
         except AnalyticsException as ae:
             LOGGER.error(ae)
             self.rollback()
             raise
 
+        if deferred is not None:
+            with self._stats.timer('commit'):
+                self.commit()
+            if drop:
+                deferred.suffixes.append(suffix)
+            pob.clear_internal_state()
+            return 0
+
+        if progress is not None:
+            progress.start_phase('constraints')
         try:
-            self._enforce_constraints()
-            self.add_constraints()
+            rejected = self._finish_load(suffix, rebuild_indexes)
         except Exception as e:
             LOGGER.error("Constraint enforcement failed:")
             LOGGER.error(e)
             self.rollback()
             raise
 
-        self.commit()
+        with self._stats.timer('commit'):
+            self.commit()
         pob.clear_internal_state()
-        LOGGER.debug("Parsing trace done")
 
-    def _enforce_constraints(self):
+        if self._partitions is not None and self._retention_days is not None:
+            self.expire_partitions(self._retention_days)
+
+        return rejected
+
+    def defer_constraints(self):
+        """Keep the constraints dropped across many data loads.
+
+        Restoring the constraints checks whole tables, so loading a
+        large trace in many separately committed chunks with
+        :meth:`load_parsed_data` takes quadratic time. In a block like::
+
+            with dbm.defer_constraints():
+                for chunk in chunks:
+                    pob.parse_trace_stream(chunk)
+                    dbm.load_parsed_data(pob)
+
+        the constraints (and the secondary indexes) are dropped once
+        when the block is entered, every load commits its data without
+        them, and they are enforced and restored once when the block
+        exits, even if it exits with an exception. Queries see the data
+        of every committed load, without the rows that will be rejected
+        being removed yet. Blocks cannot be nested.
+
+        Returns:
+            A context manager.
+
+        Raises:
+            :class:`mal_analytics.exceptions.DatabaseManagerError`: on
+                entering the block, if the constraints are already
+                deferred.
+        """
+        return _DeferredConstraints(self)
+
+    def _begin_deferred(self, deferred):
+        if self._deferred is not None:
+            raise DatabaseManagerError("Constraints are already deferred")
+        suffix = self._current_suffix()
+        deferred.indexes = self.has_indexes()
+        self.transaction()
+        try:
+            if deferred.indexes:
+                self.drop_indexes()
+            with self._stats.timer('drop_constraints'):
+                self.drop_constraints(suffix)
+        except Exception:
+            self.rollback()
+            raise
+        self.commit()
+        deferred.suffixes.append(suffix)
+        self._deferred = deferred
+
+    def _end_deferred(self, deferred):
+        self._deferred = None
+        rejected = 0
+        self.transaction()
+        try:
+            for suffix in deferred.suffixes:
+                rejected += self._finish_load(suffix, False)
+            if deferred.indexes:
+                self.add_indexes()
+        except Exception as e:
+            LOGGER.error("Constraint enforcement failed: %s", e)
+            self.rollback()
+            raise
+        with self._stats.timer('commit'):
+            self.commit()
+        LOGGER.debug("Constraints restored, %d rows rejected", rejected)
+
+        if self._partitions is not None and self._retention_days is not None:
+            self.expire_partitions(self._retention_days)
+
+    def _current_suffix(self):
+        if self._partitions is None:
+            return ''
+        return self._partitions.current_partition()
+
+    def bulk_load(self, pob, json_streams):
+        """Load many traces, dropping and restoring the constraints once.
+
+        All the traces are loaded in a single transaction using the
+        same parser. This is much faster than calling
+        :meth:`load_parsed_data` for every trace, but the database
+        stays locked for the whole load. It is intended for building
+        new databases (see :mod:`mal_analytics.swap`).
+
+        Args:
+            pob: A :class:`mal_analytics.profiler_parser.ProfilerObjectParser`
+                object.
+            json_streams: An iterable of lists of JSON objects, one
+                per trace.
+
+        Returns:
+            The number of JSON objects loaded.
+        """
+        start_stats = self._stats.get_stats()
+        suffix = self._current_suffix()
+
+        def insert():
+            self._insert_parsed_data(pob, suffix)
+            pob.clear_internal_state()
+
+        loaded = 0
+        rebuild_indexes = self.has_indexes()
+        self.transaction()
+        try:
+            if rebuild_indexes:
+                self.drop_indexes()
+            with self._stats.timer('drop_constraints'):
+                self.drop_constraints(suffix)
+            for stream in json_streams:
+                pob.parse_trace_stream(stream)
+                insert()
+                loaded += len(stream)
+            pob.flush_pending_events()
+            insert()
+
+            self._finish_load(suffix, rebuild_indexes)
+        except Exception as e:
+            LOGGER.error("Bulk load failed: %s", e)
+            self.rollback()
+            raise
+
+        with self._stats.timer('commit'):
+            self.commit()
+        self._stats.log_summary('bulk_load', start_stats, database=self._dbpath, objects=loaded)
+        return loaded
+
+    def _insert_parsed_data(self, pob, suffix, progress=None):
+        for table, data in pob.iter_data():
+            with self._stats.timer('insert'):
+                inserted = self.insert_data(table + suffix, data)
+            if progress is not None:
+                progress.advance()
+            if inserted and self._stats.enabled:
+                self._stats.increment('rows_inserted.' + table, max([len(v) for v in data.values()] or [0]))
+
+    def _finish_load(self, suffix, rebuild_indexes):
+        with self._stats.timer('enforce_constraints'):
+            rejected = self._enforce_constraints(suffix)
+            if self._partitions is not None:
+                rejected += self._partitions.check_references(suffix)
+        self._stats.increment('rows_rejected', rejected)
+        with self._stats.timer('add_constraints'):
+            self.add_constraints(suffix)
+        if rebuild_indexes:
+            self.add_indexes()
+        if self._partitions is not None:
+            self._partitions.update_bounds(suffix)
+        return rejected
+
+    def get_stats(self):
+        """Get the ingestion statistics collected so far.
+
+        This includes the statistics of the parsers created by
+        :meth:`create_parser`.
+
+        Returns:
+            See :meth:`mal_analytics.stats.IngestStats.get_stats`. The
+            dictionaries are empty if collection is disabled.
+        """
+        return self._stats.get_stats()
+
+    def get_stats_collector(self):
+        """Get the object collecting the ingestion statistics.
+
+        It can be passed to :func:`mal_analytics.trace_reader.read_trace`.
+
+        Returns:
+            An :class:`mal_analytics.stats.IngestStats` object.
+        """
+        return self._stats
+
+    def reset_stats(self):
+        """Set all the ingestion statistics to zero."""
+        self._stats.reset()
+
+    def close_database(self):
+        """Close the connection and shut down the embedded database.
+
+        This flushes the database to disk and removes the manager from
+        the registry, regardless of its reference count. Calling the
+        constructor again opens the database anew.
+        """
+        self._shutdown()
+        DatabaseManager.unregister(self)
+        self._refcount = 0
+
+    def _shutdown(self):
+        if self.is_connected():
+            self.close_connection()
+        if self._engine_running:
+            monetdblite.shutdown()
+            self._engine_running = False
+
+    def swap_database(self, new_path, backup_path=None):
+        """Replace the database with the one in another directory.
+
+        The database is shut down, its directory is renamed to
+        ``backup_path`` (or removed), the directory ``new_path`` is
+        renamed to the path of the database, and the database is
+        started again. Each rename is atomic, and no connection is open
+        in between. Both directories should be on the same file
+        system. If a rename fails the directories that were already
+        moved are moved back, and the current database is started
+        again.
+
+        This should run at a point where no other thread uses the
+        database, for instance as a request of a
+        :class:`mal_analytics.scheduler.QueryScheduler`.
+
+        Args:
+            new_path: The directory of the new database.
+            backup_path: Where to move the current database. If
+                ``None`` it is removed.
+
+        Raises:
+            :class:`mal_analytics.exceptions.DatabaseManagerError`: if
+                the directories cannot be renamed.
+        """
+        LOGGER.info("Swapping database %s with %s", self._dbpath, new_path)
+        old_path = backup_path
+        if old_path is None:
+            # A unique name, so that a backup left over by an
+            # interrupted swap is not in the way.
+            old_path = self._dbpath + '.old'
+            count = 0
+            while os.path.exists(old_path):
+                count += 1
+                old_path = '{}.old.{}'.format(self._dbpath, count)
+
+        self._shutdown()
+        error = None
+        try:
+            os.rename(self._dbpath, old_path)
+            try:
+                os.rename(new_path, self._dbpath)
+            except OSError:
+                os.rename(old_path, self._dbpath)
+                raise
+        except OSError as e:
+            error = e
+        finally:
+            # Whatever happened, start the database that is now in
+            # place.
+            self._connect()
+            self._partitions = None
+            self._initialize_tables()
+
+        if error is not None:
+            raise DatabaseManagerError("Cannot swap database {} with {}: {}".format(
+                self._dbpath, new_path, error))
+
+        self._generation += 1
+        if backup_path is None:
+            shutil.rmtree(old_path)
+
+    def is_partitioned(self):
+        """Inquire if the database is partitioned.
+
+        Returns:
+            `True` if the database was created with ``partitioned=True``.
+        """
+        return self._partitions is not None
+
+    def list_partitions(self):
+        """Get the partitions of a partitioned database.
+
+        See :meth:`mal_analytics.partitions.PartitionManager.list_partitions`.
+        """
+        self._check_partitioned()
+        return self._partitions.list_partitions()
+
+    def expire_partitions(self, retention_days, today=None):
+        """Drop the partitions older than a number of days.
+
+        See :meth:`mal_analytics.partitions.PartitionManager.expire`.
+        """
+        self._check_partitioned()
+        return self._partitions.expire(retention_days, today)
+
+    def partition_union(self, table, start=None, end=None):
+        """Build a table expression for a time range.
+
+        See :meth:`mal_analytics.partitions.PartitionManager.partition_union`.
+        """
+        self._check_partitioned()
+        return self._partitions.partition_union(table, start, end)
+
+    def _check_partitioned(self):
+        if self._partitions is None:
+            raise DatabaseManagerError("Database {} is not partitioned".format(self.get_dbpath()))
+
+    def _enforce_constraints(self, suffix=''):
         cursor = self._connection.cursor()
         violations = 0
 
         # Find all profiler events that violate the
         # unique_pe_profiler_event and move them to the
         # rejected_profiler_event.
-        event_uniqness_query = "SELECT r.event_id FROM profiler_event as l JOIN profiler_event as r ON l.execution_state=r.execution_state AND l.mal_execution_id=r.mal_execution_id AND l.pc=r.pc AND l.event_id<>r.event_id WHERE l.event_id < r.event_id"
+        event_uniqness_query = "SELECT r.event_id FROM profiler_event{suffix} as l JOIN profiler_event{suffix} as r ON l.execution_state=r.execution_state AND l.mal_execution_id=r.mal_execution_id AND l.pc=r.pc AND l.event_id<>r.event_id WHERE l.event_id < r.event_id".format(suffix=suffix)
 
         non_unique_events = cursor.execute(event_uniqness_query)
 
@@ -395,20 +1271,27 @@ class DatabaseManager(object, metaclass=Singleton):
             events = [[int(eid)] for eid_lst in cursor.fetchall()
                       for eid in eid_lst]
             cursor.executemany(
-                "INSERT INTO rejected_profiler_event (SELECT * FROM profiler_event, (SELECT 'Violates unique_pe_profiler_event constraint') as rejection_reason WHERE event_id=%s)",
+                "INSERT INTO rejected_profiler_event (SELECT * FROM profiler_event{suffix}, (SELECT 'Violates unique_pe_profiler_event constraint') as rejection_reason WHERE event_id=%s)".format(suffix=suffix),
                 events)
 
-            cursor.executemany("DELETE FROM profiler_event WHERE event_id=%s",
-                               events)
             cursor.executemany(
-                "DELETE FROM prerequisite_events WHERE prerequisite_event=%s",
+                "DELETE FROM profiler_event{suffix} WHERE event_id=%s".format(suffix=suffix),
                 events)
             cursor.executemany(
-                "DELETE FROM prerequisite_events WHERE consequent_event=%s",
+                "DELETE FROM prerequisite_events{suffix} WHERE prerequisite_event=%s".format(suffix=suffix),
+                events)
+            cursor.executemany(
+                "DELETE FROM prerequisite_events{suffix} WHERE consequent_event=%s".format(suffix=suffix),
+                events)
+
+            cursor.executemany(
+                "DELETE FROM event_variable_list{suffix} WHERE event_id=%s".format(suffix=suffix),
                 events)
 
             cursor.executemany(
-                "DELETE FROM event_variable_list WHERE event_id=%s", events)
+                "DELETE FROM instruction_run{suffix} WHERE start_event_id=%s".format(suffix=suffix), events)
+            cursor.executemany(
+                "DELETE FROM instruction_run{suffix} WHERE end_event_id=%s".format(suffix=suffix), events)
 
         # Other possible violations that might arise in the future
         return violations
@@ -28,3 +28,30 @@ class DatabaseManagerError(AnalyticsException):
 
 class InitializationError(DatabaseManagerError):
     pass
+
+
+class QueryError(DatabaseManagerError):
+    """Gets raised if MonetDBLite fails to execute a query.
+    """
+
+
+class SchedulerError(AnalyticsException):
+    """Gets raised if a request is submitted to a scheduler that has
+    been shut down.
+    """
+
+
+class BrokerError(AnalyticsException):
+    """Gets raised if the ingest broker rejects a submission.
+    """
+
+
+class ShardError(AnalyticsException):
+    """Gets raised if one or more shards fail to execute a request.
+    """
+
+
+class ErrorBudgetExceeded(AnalyticsException):
+    """Gets raised if a tolerant ingest quarantines more objects than
+    its error budget allows (see :class:`mal_analytics.quarantine.Quarantine`).
+    """
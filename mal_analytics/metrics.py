@@ -0,0 +1,327 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Metrics of long running ingest daemons in the Prometheus text format.
+
+:class:`IngestMetrics` collects the metrics of a daemon that loads
+traces in batches (see :class:`mal_analytics.broker.IngestBroker`), and
+:class:`MetricsExporter` publishes them periodically, either as a file
+(for the textfile collector of the node exporter) or over HTTP on a
+local port (``/metrics``), or both. The metrics are:
+
+* ``mal_analytics_ingest_lag_seconds``: the wall clock time minus the
+  newest ``ctime`` ingested.
+* ``mal_analytics_objects_total`` and ``mal_analytics_events_total``:
+  the JSON objects and the profiler events loaded.
+* ``mal_analytics_events_per_second``: the rate of events loaded over
+  the last ``rate_window`` seconds. It does not depend on when or how
+  often the metrics are rendered, so the file and the HTTP server can
+  be used together.
+* ``mal_analytics_queue_depth``: the submissions waiting to be loaded.
+* ``mal_analytics_batch_objects``: a histogram of the batch sizes.
+* ``mal_analytics_batch_load_seconds``: a histogram of the time from the
+  start of a batch load to its commit.
+* ``mal_analytics_rejected_rows_total``: the rows rejected by the
+  constraints, and ``mal_analytics_failed_batches_total``.
+* ``mal_analytics_database_size_bytes``: the size of the database
+  directory.
+"""
+
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import collections
+import logging
+import os
+import threading
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Histogram(object):
+    """A cumulative histogram.
+
+    Args:
+        buckets: The upper bounds of the buckets, in increasing order.
+    """
+
+    def __init__(self, buckets):
+        self._buckets = tuple(buckets) + (float('inf'),)
+        self._counts = [0] * len(self._buckets)
+        self._sum = 0
+        self._count = 0
+
+    def observe(self, value):
+        """Add an observation.
+
+        Args:
+            value: The observed value.
+        """
+        for i, bound in enumerate(self._buckets):
+            if value <= bound:
+                self._counts[i] += 1
+                break
+        self._sum += value
+        self._count += 1
+
+    def render(self, name):
+        """Render the histogram as Prometheus samples.
+
+        Args:
+            name: The name of the metric.
+
+        Returns:
+            A list of lines.
+        """
+        lines = list()
+        cumulative = 0
+        for bound, count in zip(self._buckets, self._counts):
+            cumulative += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, _format_value(bound), cumulative))
+        lines.append('{}_sum {}'.format(name, _format_value(self._sum)))
+        lines.append('{}_count {}'.format(name, self._count))
+        return lines
+
+
+def directory_size(path):
+    """Get the total size of the files in a directory tree.
+
+    Args:
+        path: The directory.
+
+    Returns:
+        The size in bytes.
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for fl in files:
+            try:
+                total += os.path.getsize(os.path.join(root, fl))
+            except OSError:
+                # Removed while walking
+                pass
+    return total
+
+
+class IngestMetrics(object):
+    """The metrics of an ingest daemon.
+
+    All the methods are thread safe.
+
+    Args:
+        dbpath: The database directory, whose size is reported. If
+            ``None`` the size is not reported.
+        clock: A function returning the wall clock time in seconds.
+        rate_window: The time in seconds over which the rate of events
+            is computed.
+    """
+
+    def __init__(self, dbpath=None, clock=time.time, rate_window=60):
+        self._dbpath = dbpath
+        self._clock = clock
+        self._rate_window = rate_window
+        self._lock = threading.Lock()
+        self._objects = 0
+        self._events = 0
+        self._rejected = 0
+        self._failed = 0
+        self._queue_depth = 0
+        self._newest_ctime = None
+        self._batch_objects = Histogram(SIZE_BUCKETS)
+        self._batch_seconds = Histogram(LATENCY_BUCKETS)
+        self._created = clock()
+        # (time, events loaded) after every batch. The first one is the
+        # last sample before the rate window.
+        self._event_samples = collections.deque([(self._created, 0)])
+
+    def record_batch(self, objects, events, seconds, newest_ctime=None, rejected=0):
+        """Record a loaded batch.
+
+        Args:
+            objects: The number of JSON objects in the batch.
+            events: The number of profiler events in the batch.
+            seconds: The time from the start of the load to the commit.
+            newest_ctime: The newest ``ctime`` (in microseconds since
+                the epoch) in the batch.
+            rejected: The number of rows rejected by the constraints.
+        """
+        with self._lock:
+            self._objects += objects
+            self._events += events
+            self._rejected += rejected
+            self._batch_objects.observe(objects)
+            self._batch_seconds.observe(seconds)
+            now = self._clock()
+            self._event_samples.append((now, self._events))
+            self._prune_samples(now)
+            if newest_ctime is not None and (self._newest_ctime is None or newest_ctime > self._newest_ctime):
+                self._newest_ctime = newest_ctime
+
+    def record_failure(self):
+        """Record a batch that failed to load."""
+        with self._lock:
+            self._failed += 1
+
+    def set_queue_depth(self, depth):
+        """Set the number of submissions waiting to be loaded.
+
+        Args:
+            depth: The queue depth.
+        """
+        with self._lock:
+            self._queue_depth = depth
+
+    def render(self):
+        """Take a snapshot of the metrics.
+
+        Returns:
+            A string in the Prometheus text exposition format.
+        """
+        size = directory_size(self._dbpath) if self._dbpath is not None else None
+        now = self._clock()
+        with self._lock:
+            self._prune_samples(now)
+            elapsed = min(self._rate_window, now - self._created)
+            rate = (self._events - self._event_samples[0][1]) / elapsed if elapsed > 0 else 0.0
+
+            metrics = [
+                ('mal_analytics_objects_total', 'counter', 'JSON objects loaded', [self._objects]),
+                ('mal_analytics_events_total', 'counter', 'Profiler events loaded', [self._events]),
+                ('mal_analytics_events_per_second', 'gauge', 'Events loaded per second over the rate window', [rate]),
+                ('mal_analytics_rejected_rows_total', 'counter', 'Rows rejected by the constraints', [self._rejected]),
+                ('mal_analytics_failed_batches_total', 'counter', 'Batches that failed to load', [self._failed]),
+                ('mal_analytics_queue_depth', 'gauge', 'Submissions waiting to be loaded', [self._queue_depth]),
+                ('mal_analytics_batch_objects', 'histogram', 'JSON objects per batch', self._batch_objects),
+                ('mal_analytics_batch_load_seconds', 'histogram', 'Time from the start of a batch load to its commit', self._batch_seconds),
+            ]
+            if self._newest_ctime is not None:
+                metrics.append(('mal_analytics_ingest_lag_seconds', 'gauge',
+                                'Wall clock time minus the newest ingested ctime',
+                                [now - self._newest_ctime / 1000000.0]))
+            if size is not None:
+                metrics.append(('mal_analytics_database_size_bytes', 'gauge', 'Size of the database directory', [size]))
+
+            lines = list()
+            for name, kind, description, value in metrics:
+                lines.append('# HELP {} {}'.format(name, description))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                if kind == 'histogram':
+                    lines.extend(value.render(name))
+                else:
+                    lines.append('{} {}'.format(name, _format_value(value[0])))
+
+        return '\n'.join(lines) + '\n'
+
+    def _prune_samples(self, now):
+        # Keep the last sample before the window as the base of the
+        # rate. No events were loaded between it and the window start.
+        start = now - self._rate_window
+        while len(self._event_samples) > 1 and self._event_samples[1][0] <= start:
+            self._event_samples.popleft()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug("%s - %s", self.address_string(), format % args)
+
+
+class MetricsExporter(object):
+    """Publish :class:`IngestMetrics` snapshots.
+
+    Args:
+        metrics: An :class:`IngestMetrics` object.
+        path: If given, a snapshot is written to this file every
+            ``interval`` seconds. The file is replaced atomically.
+        port: If given, the metrics are served over HTTP at
+            ``http://127.0.0.1:<port>/metrics``. Use 0 for any free port.
+        interval: The time in seconds between two snapshot files.
+        host: The address of the HTTP server.
+    """
+
+    def __init__(self, metrics, path=None, port=None, interval=15, host='127.0.0.1'):
+        self._metrics = metrics
+        self._path = path
+        self._interval = interval
+        self._stop = threading.Event()
+        self._writer = None
+        self._server = None
+        self._server_thread = None
+        if port is not None:
+            self._server = HTTPServer((host, port), _MetricsHandler)
+            self._server.metrics = metrics
+
+    def get_address(self):
+        """Get the address of the HTTP server.
+
+        Returns:
+            A (host, port) tuple, or ``None`` if there is no server.
+        """
+        if self._server is None:
+            return None
+        return self._server.server_address
+
+    def start(self):
+        """Start publishing in background threads."""
+        if self._path is not None:
+            self._writer = threading.Thread(target=self._write_loop, name='mal-analytics-metrics')
+            self._writer.daemon = True
+            self._writer.start()
+        if self._server is not None:
+            self._server_thread = threading.Thread(target=self._server.serve_forever,
+                                                   name='mal-analytics-metrics-http')
+            self._server_thread.daemon = True
+            self._server_thread.start()
+
+    def stop(self):
+        """Stop publishing. A last snapshot file is written."""
+        self._stop.set()
+        if self._writer is not None:
+            self._writer.join()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def write_snapshot(self):
+        """Write a snapshot file now."""
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as fl:
+            fl.write(self._metrics.render())
+        os.replace(tmp_path, self._path)
+
+    def _write_loop(self):
+        while True:
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                LOGGER.error("Cannot write metrics to %s: %s", self._path, e)
+            if self._stop.wait(self._interval):
+                break
+        try:
+            self.write_snapshot()
+        except OSError as e:
+            LOGGER.error("Cannot write metrics to %s: %s", self._path, e)
@@ -0,0 +1,335 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import datetime
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+# The tables that grow with the ingested traces. In a partitioned
+# database these are merge tables.
+PARTITIONED_TABLES = [
+    'mal_execution',
+    'profiler_event',
+    'prerequisite_events',
+    'mal_variable',
+    'event_variable_list',
+    'query',
+    'initiates_executions',
+    'heartbeat',
+    'cpuload',
+    'instruction_run',
+]
+
+# The references between the partitioned tables that may cross
+# partitions, as (table, column, referenced table, referenced column)
+# tuples. The data of a day goes to the partition of that day, but a
+# parser running past midnight (UTC) keeps adding events, variables and
+# instruction runs to executions that were loaded the previous day.
+# These references are not foreign keys in partitioned databases (see
+# data/add_cross_partition_keys.sql), and are checked against the merge
+# tables by PartitionManager.check_references. The references to
+# ``profiler_event{suffix}`` stay within a partition, but are listed so
+# that the rows referencing a rejected event are rejected too. The
+# order matters for the same reason.
+CROSS_PARTITION_REFERENCES = [
+    ('profiler_event', 'mal_execution_id', 'mal_execution', 'execution_id'),
+    ('mal_variable', 'mal_execution_id', 'mal_execution', 'execution_id'),
+    ('query', 'root_execution_id', 'mal_execution', 'execution_id'),
+    ('initiates_executions', 'parent_id', 'mal_execution', 'execution_id'),
+    ('initiates_executions', 'child_id', 'mal_execution', 'execution_id'),
+    ('instruction_run', 'mal_execution_id', 'mal_execution', 'execution_id'),
+    ('instruction_run', 'start_event_id', 'profiler_event', 'event_id'),
+    ('instruction_run', 'end_event_id', 'profiler_event{suffix}', 'event_id'),
+    ('event_variable_list', 'event_id', 'profiler_event{suffix}', 'event_id'),
+    ('event_variable_list', 'variable_id', 'mal_variable', 'variable_id'),
+    ('prerequisite_events', 'consequent_event', 'profiler_event{suffix}', 'event_id'),
+]
+
+
+def partition_suffix(day):
+    """Compute the suffix of the partition tables for a given day.
+
+    Args:
+        day: A :class:`datetime.date` object.
+
+    Returns:
+        A string of the form ``_pYYYYMMDD``.
+    """
+    return day.strftime('_p%Y%m%d')
+
+
+def _period(day):
+    return int(day.strftime('%Y%m%d'))
+
+
+class PartitionManager(object):
+    """Manage the partitions of a partitioned trace database.
+
+    In a partitioned database every table listed in
+    :data:`PARTITIONED_TABLES` is a MonetDB merge table. The data of
+    each ingestion day (UTC) is stored in a separate set of tables,
+    the *partition*, named after the merge tables with the suffix
+    returned by :func:`partition_suffix`. Partitions are recorded in
+    the ``storage_partition`` table, together with the bounds of the
+    absolute times of their events and heartbeats.
+
+    Expiring old data amounts to detaching and dropping the tables of
+    whole partitions, which does not depend on the amount of data
+    they hold.
+
+    The rows of an execution may be spread over consecutive partitions
+    if it is still running at midnight. The references that may cross
+    partitions are checked by :meth:`check_references` instead of
+    foreign keys.
+
+    Args:
+        dbm: The :class:`mal_analytics.db_manager.DatabaseManager` of
+            the database.
+        clock: A function returning the wall clock time in seconds.
+    """
+
+    def __init__(self, dbm, clock=time.time):
+        self._dbm = dbm
+        self._clock = clock
+        cpath = os.path.dirname(os.path.abspath(__file__))
+        self._data_dir = os.path.join(cpath, 'data')
+
+    def _today(self):
+        return datetime.datetime.fromtimestamp(self._clock(), datetime.timezone.utc).date()
+
+    def initialize(self):
+        """Create the schema of a partitioned database.
+
+        The merge tables are created from the same definitions as the
+        tables of a database that is not partitioned
+        (``data/tables.sql``). A partition for the current day is
+        created as well, since MonetDB does not allow queries on merge
+        tables without any partitions.
+        """
+        self._dbm.transaction()
+        self._dbm.execute_sql_script(os.path.join(self._data_dir, 'tables.sql'),
+                                     {'table_kind': 'merge table', 'suffix': ''})
+        self._dbm.execute_sql_script(os.path.join(self._data_dir, 'shared_tables.sql'))
+        self._dbm.execute_sql_script(os.path.join(self._data_dir, 'partitioned_tables.sql'))
+        self._dbm.commit()
+        self.create_partition(self._today())
+
+    def list_partitions(self):
+        """Get the partitions of the database.
+
+        Returns:
+            A list of dictionaries ordered by period with the keys
+            ``suffix``, ``period``, ``min_time`` and ``max_time``.
+        """
+        cursor = self._dbm.get_cursor()
+        cursor.execute("SELECT suffix, period, min_time, max_time FROM storage_partition ORDER BY period")
+        keys = ('suffix', 'period', 'min_time', 'max_time')
+        partitions = [dict(zip(keys, row)) for row in cursor.fetchall()]
+        cursor.close()
+
+        return partitions
+
+    def create_partition(self, day):
+        """Create the partition for a given day.
+
+        The tables are created, attached to the merge tables and
+        their constraints are added, in a single transaction.
+
+        Args:
+            day: A :class:`datetime.date` object.
+
+        Returns:
+            The suffix of the new partition.
+        """
+        suffix = partition_suffix(day)
+        LOGGER.info("Creating partition %s", suffix)
+
+        self._dbm.transaction()
+        try:
+            self._dbm.execute_sql_script(os.path.join(self._data_dir, 'tables.sql'),
+                                         {'table_kind': 'table', 'suffix': suffix})
+            self._dbm.execute_sql_script(os.path.join(self._data_dir, 'create_partition.sql'),
+                                         {'suffix': suffix})
+            self._dbm.add_constraints(suffix)
+            cursor = self._dbm.get_cursor()
+            cursor.execute("INSERT INTO storage_partition (suffix, period) VALUES (%s, %s)",
+                           [suffix, _period(day)])
+            cursor.close()
+        except Exception:
+            self._dbm.rollback()
+            raise
+        self._dbm.commit()
+
+        return suffix
+
+    def current_partition(self, day=None):
+        """Get the partition where new data should be loaded.
+
+        The partition is created if it does not exist.
+
+        Args:
+            day: A :class:`datetime.date` object. Defaults to the
+                current day (UTC).
+
+        Returns:
+            The suffix of the partition.
+        """
+        if day is None:
+            day = self._today()
+        suffix = partition_suffix(day)
+
+        cursor = self._dbm.get_cursor()
+        exists = cursor.execute("SELECT suffix FROM storage_partition WHERE suffix=%s", [suffix])
+        cursor.close()
+        if not exists:
+            self.create_partition(day)
+
+        return suffix
+
+    def update_bounds(self, suffix):
+        """Recompute the time bounds of a partition after loading data.
+
+        This should run inside the transaction that loaded the data.
+
+        Args:
+            suffix: The suffix of the partition.
+        """
+        bound = "(SELECT {fcn}(t) FROM (SELECT {fcn}(absolute_time) AS t FROM profiler_event{suffix} UNION ALL SELECT {fcn}(ctime) AS t FROM heartbeat{suffix}) AS b)"
+        query = "UPDATE storage_partition SET min_time={}, max_time={} WHERE suffix=%s".format(
+            bound.format(fcn='min', suffix=suffix),
+            bound.format(fcn='max', suffix=suffix))
+        cursor = self._dbm.get_cursor()
+        cursor.execute(query, [suffix])
+        cursor.close()
+
+    def check_references(self, suffix):
+        """Reject the rows of a partition with dangling references.
+
+        The references listed in :data:`CROSS_PARTITION_REFERENCES` are
+        looked up in the merge tables, so they may point to an earlier
+        partition. Rows whose reference is missing, because it was
+        never loaded or because its partition has expired, are deleted.
+        This should run inside the transaction that loaded the data,
+        before the constraints of the partition are added.
+
+        Args:
+            suffix: The suffix of the partition.
+
+        Returns:
+            The number of rejected rows.
+        """
+        rejected = 0
+        cursor = self._dbm.get_cursor()
+        for table, column, referenced, referenced_column in CROSS_PARTITION_REFERENCES:
+            condition = "{column} NOT IN (SELECT {referenced_column} FROM {referenced})".format(
+                column=column, referenced_column=referenced_column,
+                referenced=referenced.format(suffix=suffix))
+            cursor.execute("SELECT count(*) FROM {}{} WHERE {}".format(table, suffix, condition))
+            dangling = int(cursor.fetchall()[0][0])
+            if dangling == 0:
+                continue
+            LOGGER.warning("Rejecting %d rows of %s%s: %s not found in %s",
+                           dangling, table, suffix, column, referenced.format(suffix=suffix))
+            cursor.execute("DELETE FROM {}{} WHERE {}".format(table, suffix, condition))
+            rejected += dangling
+        cursor.close()
+
+        return rejected
+
+    def drop_partition(self, suffix):
+        """Detach and drop the tables of a partition.
+
+        Args:
+            suffix: The suffix of the partition.
+        """
+        LOGGER.info("Dropping partition %s", suffix)
+        self._dbm.transaction()
+        try:
+            self._dbm.execute_sql_script(os.path.join(self._data_dir, 'drop_partition.sql'),
+                                         {'suffix': suffix})
+            cursor = self._dbm.get_cursor()
+            cursor.execute("DELETE FROM storage_partition WHERE suffix=%s", [suffix])
+            cursor.close()
+        except Exception:
+            self._dbm.rollback()
+            raise
+        self._dbm.commit()
+
+    def expire(self, retention_days, today=None):
+        """Drop the partitions older than the retention period.
+
+        If all the partitions are dropped, a new one is created for
+        the current day.
+
+        Args:
+            retention_days: The number of days to keep. Partitions of
+                earlier days are dropped.
+            today: A :class:`datetime.date` object. Defaults to the
+                current day (UTC).
+
+        Returns:
+            A list with the suffixes of the dropped partitions.
+        """
+        if today is None:
+            today = self._today()
+        cutoff = _period(today - datetime.timedelta(days=retention_days))
+
+        partitions = self.list_partitions()
+        expired = [p['suffix'] for p in partitions if p['period'] < cutoff]
+        for suffix in expired:
+            self.drop_partition(suffix)
+
+        if len(expired) == len(partitions):
+            self.create_partition(today)
+
+        return expired
+
+    def partition_tables(self, table, start=None, end=None):
+        """Find the partitions of a table that hold data in a time range.
+
+        Partitions without any events or heartbeats are skipped.
+
+        Args:
+            table: The name of one of the :data:`PARTITIONED_TABLES`.
+            start: The start of the range in microseconds since the
+                epoch, or ``None`` for no lower bound.
+            end: The end of the range in microseconds since the epoch,
+                or ``None`` for no upper bound.
+
+        Returns:
+            A list with the names of the partition tables.
+        """
+        tables = list()
+        for p in self.list_partitions():
+            if p['min_time'] is None:
+                continue
+            if start is not None and p['max_time'] < start:
+                continue
+            if end is not None and p['min_time'] > end:
+                continue
+            tables.append(table + p['suffix'])
+
+        return tables
+
+    def partition_union(self, table, start=None, end=None):
+        """Build a table expression covering a time range.
+
+        The result can be used in the ``FROM`` clause of a query in
+        place of the merge table, so that only the partitions that
+        hold data in the given time range are scanned. See
+        :meth:`partition_tables` for the arguments.
+
+        Returns:
+            A string with a parenthesized SQL subquery.
+        """
+        tables = self.partition_tables(table, start, end)
+        if not tables:
+            return "(SELECT * FROM {} WHERE 1=0)".format(table)
+
+        return "(" + " UNION ALL ".join(["SELECT * FROM {}".format(t) for t in tables]) + ")"
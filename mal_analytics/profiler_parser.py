@@ -4,15 +4,29 @@
 #
 # Copyright MonetDB Solutions B.V. 2018-2019
 
+import collections
+import copy
 import logging
+import pickle
 import re
+import sys
+import tempfile
+import time
 from pathlib import Path
 
 import mal_analytics.exceptions as exceptions
+import mal_analytics.quarantine as quarantine
+from mal_analytics.progress import REPORT_EVERY
+from mal_analytics.stats import NULL_STATS
 
 
 LOGGER = logging.getLogger(__name__)
 
+# The exceptions raised while parsing an object with an unexpected
+# structure. In tolerant mode the object is quarantined.
+_PARSE_ERRORS = (exceptions.MalParserError, KeyError, AttributeError, IndexError, TypeError,
+                 ValueError)
+
 
 class ProfilerObjectParser(object):
     """A parser for the MonetDB profiler traces.
@@ -33,9 +47,46 @@ class ProfilerObjectParser(object):
                 * prereq_id
                 * query_id
                 * supervises_executions_id
+                * instruction_run_id
+
+        compact: If ``True`` start events are not stored when the
+            corresponding done event is found. Their start time and
+            their variable list are merged into the ``instruction_run``
+            row and the done event respectively.
+        memory_budget: The approximate number of bytes the parsed rows
+            may occupy in memory. When it is exceeded the rows parsed so
+            far are written to a temporary file (*spilled*) and read
+            back when the data is loaded (see :meth:`iter_data`). If
+            ``None`` nothing is spilled.
+        spill_dir: The directory of the temporary files. Defaults to
+            the system temporary directory.
+        stats: An :class:`mal_analytics.stats.IngestStats` object that
+            records the number of parsed objects and the parsing time.
+        quarantine: A :class:`mal_analytics.quarantine.Quarantine`. If
+            given, objects that would raise a
+            :class:`mal_analytics.exceptions.MalParserError` are
+            quarantined and skipped.
     """
 
-    def __init__(self, limits=dict()):
+    # How often (in JSON objects) the memory budget is checked.
+    MEMORY_CHECK_INTERVAL = 1000
+    # How many finished executions are remembered, in order to skip
+    # their late events. An event that arrives after more executions
+    # have finished starts a new execution with the same session and
+    # tag, which violates the unique constraint of mal_execution.
+    FINISHED_EXECUTIONS = 10000
+    # The attributes carried from one call of parse_trace_stream to
+    # the next (see save_state).
+    _STATE = (
+        '_execution_id', '_event_id', '_variable_id', '_heartbeat_id', '_cpuload_id',
+        '_prerequisite_relation_id', '_query_id', '_initiates_executions_id',
+        '_instruction_run_id', '_initiates_association', '_pending_starts',
+        '_var_name_to_id', '_stored_variables', '_execution_dict', '_execution_sessions',
+        '_finished_executions', '_newest_time',
+    )
+
+    def __init__(self, limits=dict(), compact=False, memory_budget=None, spill_dir=None,
+                 stats=None, quarantine=None):
         logging.basicConfig(level=logging.DEBUG)
         self._execution_id = limits.get('max_execution_id', 0)
         self._event_id = limits.get('max_event_id', 0)
@@ -45,12 +96,38 @@ class ProfilerObjectParser(object):
         self._prerequisite_relation_id = limits.get('max_prerequisite_id', 0)
         self._query_id = limits.get('max_query_id', 0)
         self._initiates_executions_id = limits.get('max_initiates_id', 0)
+        self._instruction_run_id = limits.get('max_instruction_run_id', 0)
+        self._compact = compact
 
         self._initiates_association = dict()
+        # Start events waiting for the corresponding done event, keyed
+        # by (execution id, pc). In compact mode the variable list and
+        # the prerequisites of the event are kept as well.
+        self._pending_starts = dict()
+        # The variable ids of every execution, keyed by name.
         self._var_name_to_id = dict()
+        # The names of the variables of every execution already added
+        # to the mal_variable table. This is kept across calls of
+        # parse_trace_stream, so that a trace can be parsed in chunks.
+        self._stored_variables = dict()
         self._execution_dict = dict()
+        # The server session of every execution, since the rows of the
+        # mal_execution table may already be loaded or spilled.
+        self._execution_sessions = dict()
+        # The "session:tag" keys of the executions whose root function
+        # has finished. The state of these executions is forgotten.
+        self._finished_executions = collections.OrderedDict()
         self._states = {'start': 0, 'done': 1, 'pause': 2}
         self._tables = None
+        self._memory_budget = memory_budget
+        self._spill_dir = spill_dir
+        # Spilled segments as (table name, temporary file) tuples.
+        self._spilled = list()
+        self._spilled_bytes = 0
+        self._stats = stats if stats is not None else NULL_STATS
+        self._quarantine = quarantine
+        # The newest ctime seen, in microseconds since the epoch.
+        self._newest_time = None
 
         self._initialize_tables()
 
@@ -175,6 +252,23 @@ class ProfilerObjectParser(object):
             "val": list(),
         }
 
+        self._tables["instruction_run"] = {
+            "instruction_run_id": list(),
+            "mal_execution_id": list(),
+            "pc": list(),
+            "thread": list(),
+            "start_event_id": list(),
+            "end_event_id": list(),
+            "start_time": list(),
+            "end_time": list(),
+            "astart_time": list(),
+            "aend_time": list(),
+            "duration": list(),
+            "short_statement": list(),
+            "mal_module": list(),
+            "instruction": list(),
+        }
+
     def _parse_variable(self, var_data, current_execution_id):
         """Parse a single MAL variable.
 
@@ -185,10 +279,9 @@ class ProfilerObjectParser(object):
             A dictionary representing a variable. See :ref:`data_structures`.
         """
         # As mentioned elsewhere variables are scoped by
-        # executions. The variable key is the concatenation of the
-        # current execution id and tha variable name.
-        var_key = "{}:{}".format(current_execution_id, var_data.get("name"))
-        var_id = self._var_name_to_id.get(var_key)
+        # executions.
+        execution_variables = self._var_name_to_id.setdefault(current_execution_id, dict())
+        var_id = execution_variables.get(var_data.get("name"))
 
         new_var = False
         if var_id is None:
@@ -221,7 +314,7 @@ class ProfilerObjectParser(object):
         # If this is a new variable, add it to the variable symbol
         # table.
         if new_var:
-            self._var_name_to_id[var_key] = self._variable_id
+            execution_variables[var_data.get("name")] = self._variable_id
 
         return variable
 
@@ -431,6 +524,7 @@ class ProfilerObjectParser(object):
             self._execution_id += 1
             execution_id = self._execution_id
             self._execution_dict[key] = execution_id
+            self._execution_sessions[execution_id] = session
 
             # Add the new execution to the table.
             self._tables["mal_execution"]['execution_id'].append(execution_id)
@@ -444,8 +538,7 @@ class ProfilerObjectParser(object):
             raise exceptions.MalParserError("execution for session {}, tag {} already registered".format(session, tag))
 
     def _handle_local_initiates(self, event_data, current_execution_id, initiates_executions_data):
-        idx = self._tables["mal_execution"]["execution_id"].index(current_execution_id)
-        server_session = self._tables["mal_execution"]["server_session"][idx]
+        server_session = self._execution_sessions[current_execution_id]
 
         # We are concatenating the server_session with the function
         # name. We are assuming that the function calls are local
@@ -606,7 +699,7 @@ class ProfilerObjectParser(object):
 
         return self._execution_dict.get("{}:{}".format(session, tag))
 
-    def parse_trace_stream(self, json_stream):
+    def parse_trace_stream(self, json_stream, progress=None):
         """Parse a list of json trace objects
 
         This will create a representation ready to be inserted into
@@ -619,19 +712,35 @@ class ProfilerObjectParser(object):
 
         Args:
             json_stream: an iterable (usually a list) containing python dictionaries
+            progress: A :class:`mal_analytics.progress.ProgressTracker`.
 
         """
-        # This is a list that we use for deduplication of variables.
-        var_name_list = list()
+        if progress is not None:
+            progress.start_phase('parse', len(json_stream) if hasattr(json_stream, '__len__') else None)
         execution = -1
         cnt = 0
+        events = 0
+        skipped = 0
+        variables = 0
+        heartbeats = 0
+        newest = self._newest_time if self._newest_time is not None else -1
+        start_time = time.perf_counter()
         for json_event in json_stream:
+            cnt += 1
+            if self._quarantine is not None:
+                reason = self._find_invalid(json_event)
+                if reason is not None:
+                    self._quarantine.reject(reason, json_event, index=cnt - 1)
+                    continue
+
             # Stage 1: make sure the json_event we got from the
             # MonetDB server contains session and tag fields. These
             # fields define the MAL execution. Parse the event and
             # keep the data around for further processing.
             src = json_event.get("source")
-            cnt += 1
+            ctime = json_event.get("ctime")
+            if ctime is not None and ctime > newest:
+                newest = ctime
             if src == "trace":
                 if json_event.get('session') is None:
                     LOGGER.error(json_event)
@@ -640,30 +749,36 @@ class ProfilerObjectParser(object):
                     LOGGER.error(json_event)
                     raise exceptions.MalParserError('Missing tag')
 
-                event_data, prereq_list, referenced_vars, event_variables, query_data, initiates_executions_data = self._parse_event(json_event)
+                execution_key = "{}:{}".format(json_event.get('session'), json_event.get('tag'))
+                if execution_key in self._finished_executions:
+                    # Executions with late events are remembered longer.
+                    self._finished_executions.move_to_end(execution_key)
+                    skipped += 1
+                    self._skip_late_event(execution_key, json_event, cnt - 1)
+                    continue
+
+                try:
+                    event_data, prereq_list, referenced_vars, event_variables, query_data, initiates_executions_data = self._parse_event(json_event)
+                except _PARSE_ERRORS as e:
+                    self._reject_unparsable(e, json_event, cnt - 1)
+                    continue
+                events += 1
                 execution = self._get_execution_id(json_event.get('session'), json_event.get('tag'))
                 event_data['mal_execution_id'] = execution
 
-                # So far, so good. Add new event to the collection
-                # that needs to be inserted in the database table.
-                ignored_keys = ['version']
-                for k, v in event_data.items():
-                    if k in ignored_keys:
-                        continue
-                    self._tables["profiler_event"][k].append(v)
-
                 # Stage 2: Handle the referenced variables.
+                stored_variables = self._stored_variables.setdefault(execution, set())
                 for var_name, var in referenced_vars.items():
                     # Ignore variables that we have already seen
                     # Variables and variable names are scoped by
                     # executions (session + tag combinations). Between
                     # different executions variables with the same
                     # name are allowed to exist.
-                    scoped_variable = "{}:{}".format(execution, var_name)
-                    if scoped_variable in var_name_list:
+                    if var_name in stored_variables:
                         continue
 
-                    var_name_list.append(scoped_variable)
+                    stored_variables.add(var_name)
+                    variables += 1
 
                     var['mal_execution_id'] = execution
                     # Add new variable to the table
@@ -673,21 +788,16 @@ class ProfilerObjectParser(object):
                             continue
                         self._tables["mal_variable"][k].append(v)
 
-                for evariable in event_variables:
-                    self._tables["event_variable_list"]['event_id'].append(evariable.get('event_id'))
-                    self._tables["event_variable_list"]['variable_list_index'].append(evariable.get('variable_list_index'))
-                    # NOTE: this violates the foreign key. Why?
-                    self._tables["event_variable_list"]['variable_id'].append(evariable.get('variable_id'))
-                    self._tables["event_variable_list"]['created'].append(evariable.get('created'))
-                    self._tables["event_variable_list"]['eol'].append(evariable.get('eol', False))
-
-                for pev in prereq_list:
-                    self._prerequisite_relation_id += 1
-                    self._tables["prerequisite_events"]['prerequisite_relation_id'].append(self._prerequisite_relation_id)
-                    self._tables["prerequisite_events"]['prerequisite_event'].append(pev)
-                    self._tables["prerequisite_events"]['consequent_event'].append(event_data['event_id'])
+                # Stage 3: Add the event, together with its variable
+                # list and its prerequisites.
+                if self._compact:
+                    self._add_compact_event(event_data, event_variables, prereq_list)
+                else:
+                    self._add_event(event_data, event_variables, prereq_list)
+                    self._pair_instruction_events(event_data)
 
-                    # prerequisite_events.append((pev, event_data['event_id']))
+                if event_data['pc'] == 0 and event_data['execution_state'] == self._states['done']:
+                    self._finish_execution(execution_key, execution)
 
                 if query_data is not None:
                     for k, v in query_data.items():
@@ -699,7 +809,12 @@ class ProfilerObjectParser(object):
                             self._tables["initiates_executions"].get(k).append(v)
 
             elif src == "heartbeat":
-                hb_data, cpu_data = self._parse_heartbeat(json_event)
+                try:
+                    hb_data, cpu_data = self._parse_heartbeat(json_event)
+                except _PARSE_ERRORS as e:
+                    self._reject_unparsable(e, json_event, cnt - 1)
+                    continue
+                heartbeats += 1
 
                 for k, v in hb_data.items():
                     self._tables["heartbeat"][k].append(v)
@@ -710,9 +825,267 @@ class ProfilerObjectParser(object):
             else:
                 # TODO: raise exception
                 pass
+
+            if progress is not None and cnt % REPORT_EVERY == 0:
+                progress.advance(REPORT_EVERY)
+            if self._memory_budget is not None and cnt % self.MEMORY_CHECK_INTERVAL == 0:
+                if self.estimate_memory() > self._memory_budget:
+                    self._spill()
+
+        if newest >= 0:
+            self._newest_time = newest
+        if self._quarantine is not None:
+            self._quarantine.check_rate()
+        self._stats.add_time('parse', time.perf_counter() - start_time)
+        self._stats.increment('objects_parsed', cnt)
+        self._stats.increment('events_parsed', events)
+        self._stats.increment('events_skipped', skipped)
+        self._stats.increment('variables_parsed', variables)
+        self._stats.increment('heartbeats_parsed', heartbeats)
         LOGGER.debug("%d JSON objects parsed", cnt)
         LOGGER.debug("initiates executions = %s", self._tables["initiates_executions"])
 
+    def _finish_execution(self, execution_key, execution):
+        """Forget the state of an execution whose root function is done.
+
+        The done event of the instruction with pc == 0 is the last
+        event of an execution. The variables, the session and the
+        unmatched start events of the execution are not needed any
+        more. In compact mode the unmatched start events are stored,
+        as in :meth:`flush_pending_events`. Later events of the
+        execution are skipped.
+
+        Args:
+            execution_key: The "session:tag" key of the execution.
+            execution: The execution id.
+        """
+        for key in [k for k in self._pending_starts if k[0] == execution]:
+            pending = self._pending_starts.pop(key)
+            if self._compact:
+                self._add_event(*pending)
+
+        self._var_name_to_id.pop(execution, None)
+        self._stored_variables.pop(execution, None)
+        self._execution_sessions.pop(execution, None)
+        del self._execution_dict[execution_key]
+        self._finished_executions[execution_key] = execution
+        while len(self._finished_executions) > self.FINISHED_EXECUTIONS:
+            self._finished_executions.popitem(last=False)
+
+    def _skip_late_event(self, execution_key, json_event, index):
+        """Skip an event that arrives after the end of its execution.
+
+        The state of the execution is gone, so the event cannot be
+        stored. It is quarantined, if there is a quarantine.
+
+        Args:
+            execution_key: The "session:tag" key of the execution.
+            json_event: The object.
+            index: The position of the object in the stream.
+        """
+        if self._quarantine is None:
+            LOGGER.warning("Skipping event pc=%s of finished execution %s",
+                           json_event.get('pc'), execution_key)
+            return
+        self._quarantine.reject(quarantine.LATE_EVENT, json_event, index=index,
+                                message="Event of finished execution {}".format(execution_key))
+
+    def _find_invalid(self, json_event):
+        """Check an object for the problems that make the parser raise.
+
+        The check happens before anything is parsed, so that skipping
+        the object leaves the tables consistent.
+
+        Args:
+            json_event: A decoded JSON object.
+
+        Returns:
+            A reason (see :data:`mal_analytics.quarantine.REASONS`), or
+            ``None`` if the object is valid.
+        """
+        if not isinstance(json_event, dict):
+            return quarantine.NOT_AN_OBJECT
+        if json_event.get("source") != "trace":
+            return None
+        if json_event.get('session') is None:
+            return quarantine.MISSING_SESSION
+        if json_event.get('tag') is None:
+            return quarantine.MISSING_TAG
+        for var_kind in ["ret", "arg"]:
+            if var_kind == "ret" and json_event.get("state") == "start":
+                continue
+            items = json_event.get(var_kind, [])
+            if not isinstance(items, list):
+                return quarantine.INVALID_OBJECT
+            for item in items:
+                if not isinstance(item, dict):
+                    return quarantine.INVALID_OBJECT
+                if item.get('name') is None:
+                    return quarantine.UNNAMED_VARIABLE
+        return None
+
+    def _reject_unparsable(self, error, json_event, index):
+        """Quarantine an object whose parsing raised.
+
+        Objects with an unexpected structure that :meth:`_find_invalid`
+        does not catch make the parser raise part way through. The ids
+        and the rows assigned until then are kept, so the ids of the
+        following rows may have gaps.
+
+        Args:
+            error: The exception.
+            json_event: The object.
+            index: The position of the object in the stream.
+
+        Raises:
+            The exception, if the parser is not tolerant.
+        """
+        if self._quarantine is None:
+            raise error
+        self._quarantine.reject(quarantine.INVALID_OBJECT, json_event, index=index,
+                                message="{}: {}".format(type(error).__name__, error))
+
+    def _add_event(self, event_data, event_variables, prereq_list):
+        """Add an event to the tables.
+
+        Args:
+            event_data: A dictionary containing the event data (see
+                :ref:`data_structures`).
+            event_variables: The variable list of the event.
+            prereq_list: The list of prerequisite events.
+        """
+        ignored_keys = ['version']
+        for k, v in event_data.items():
+            if k in ignored_keys:
+                continue
+            self._tables["profiler_event"][k].append(v)
+
+        for evariable in event_variables:
+            self._tables["event_variable_list"]['event_id'].append(evariable.get('event_id'))
+            self._tables["event_variable_list"]['variable_list_index'].append(evariable.get('variable_list_index'))
+            # NOTE: this violates the foreign key. Why?
+            self._tables["event_variable_list"]['variable_id'].append(evariable.get('variable_id'))
+            self._tables["event_variable_list"]['created'].append(evariable.get('created'))
+            self._tables["event_variable_list"]['eol'].append(evariable.get('eol', False))
+
+        for pev in prereq_list:
+            self._prerequisite_relation_id += 1
+            self._tables["prerequisite_events"]['prerequisite_relation_id'].append(self._prerequisite_relation_id)
+            self._tables["prerequisite_events"]['prerequisite_event'].append(pev)
+            self._tables["prerequisite_events"]['consequent_event'].append(event_data['event_id'])
+
+    def _pair_instruction_events(self, event_data):
+        """Pair the start and done events of a MAL instruction.
+
+        A start event is kept aside until the done event with the same
+        execution id and pc arrives. At that point a new row is added
+        to the ``instruction_run`` table. Only the first start event
+        for an instruction is kept, in agreement with the
+        ``unique_pe_profiler_event`` constraint.
+
+        Args:
+            event_data: A dictionary containing the event data (see
+                :ref:`data_structures`).
+        """
+        key = (event_data['mal_execution_id'], event_data['pc'])
+        state = event_data['execution_state']
+        if state == self._states['start']:
+            if key not in self._pending_starts:
+                self._pending_starts[key] = event_data
+        elif state == self._states['done']:
+            start_data = self._pending_starts.pop(key, None)
+            if start_data is None:
+                return
+            self._add_instruction_run(start_data, event_data)
+
+    def _add_compact_event(self, event_data, event_variables, prereq_list):
+        """Add an event to the tables, eliding start events.
+
+        In compact mode a start event is not stored. It is kept aside
+        until the corresponding done event arrives. The variable list
+        and the prerequisites of the start event are merged into the
+        ones of the done event, and the start time is recorded in the
+        ``instruction_run`` table. Start events that never get matched
+        are stored by :meth:`flush_pending_events`.
+
+        Args:
+            event_data: A dictionary containing the event data (see
+                :ref:`data_structures`).
+            event_variables: The variable list of the event.
+            prereq_list: The list of prerequisite events.
+        """
+        key = (event_data['mal_execution_id'], event_data['pc'])
+        state = event_data['execution_state']
+        if state == self._states['start'] and key not in self._pending_starts:
+            self._pending_starts[key] = (event_data, event_variables, prereq_list)
+            return
+
+        if state == self._states['done'] and key in self._pending_starts:
+            start_data, start_variables, start_prereqs = self._pending_starts.pop(key)
+            # The done event lists the return values and the
+            # arguments of the instruction. Keep only the entries of
+            # the start event that are not already there.
+            listed = set([ev['variable_list_index'] for ev in event_variables])
+            event_variables = event_variables + [
+                dict(ev, event_id=event_data['event_id'])
+                for ev in start_variables
+                if ev['variable_list_index'] not in listed
+            ]
+            prereq_list = prereq_list + [p for p in start_prereqs if p not in prereq_list]
+            self._add_instruction_run(start_data, event_data)
+
+        self._add_event(event_data, event_variables, prereq_list)
+
+    def flush_pending_events(self):
+        """Store the start events that have not been matched yet.
+
+        This is only meaningful in compact mode, where start events
+        are kept aside until the corresponding done event arrives. It
+        should be called once the whole trace has been parsed, so
+        that no information is lost for instructions that did not
+        finish. Start events that get flushed are not paired with any
+        done event that arrives afterwards.
+        """
+        if not self._compact:
+            return
+
+        for event_data, event_variables, prereq_list in self._pending_starts.values():
+            self._add_event(event_data, event_variables, prereq_list)
+        self._pending_starts = dict()
+
+    def _add_instruction_run(self, start_data, end_data):
+        """Add a row to the ``instruction_run`` table.
+
+        Args:
+            start_data: The event data of the start event.
+            end_data: The event data of the done event.
+        """
+        start_time = start_data['relative_time']
+        end_time = end_data['relative_time']
+        duration = None
+        if start_time is not None and end_time is not None:
+            duration = end_time - start_time
+
+        self._instruction_run_id += 1
+        run_data = {
+            "instruction_run_id": self._instruction_run_id,
+            "mal_execution_id": end_data['mal_execution_id'],
+            "pc": end_data['pc'],
+            "thread": end_data['thread'],
+            "start_event_id": None if self._compact else start_data['event_id'],
+            "end_event_id": end_data['event_id'],
+            "start_time": start_time,
+            "end_time": end_time,
+            "astart_time": start_data['absolute_time'],
+            "aend_time": end_data['absolute_time'],
+            "duration": duration,
+            "short_statement": end_data['short_statement'],
+            "mal_module": end_data['mal_module'],
+            "instruction": end_data['instruction'],
+        }
+        for k, v in run_data.items():
+            self._tables["instruction_run"][k].append(v)
+
     def _parse_heartbeat(self, json_object):
         """Parse a heartbeat object and adds it to the database.
         """
@@ -826,17 +1199,157 @@ class ProfilerObjectParser(object):
                   + cpuload_id
                   + heartbeat_id
                   + val
+
+                - A dictionary for completed instructions (pairs of
+                  start and done events) with the following keys:
+
+                  + instruction_run_id
+                  + mal_execution_id
+                  + pc
+                  + thread
+                  + start_event_id
+                  + end_event_id
+                  + start_time
+                  + end_time
+                  + astart_time
+                  + aend_time
+                  + duration
+                  + short_statement
+                  + mal_module
+                  + instruction
         """
         if self._initiates_association:
             LOGGER.warning("supervisor association table not empty: %s", self._initiates_association)
-        return self._tables
+        if not self._spilled:
+            return self._tables
+
+        # Merge the spilled segments back. This needs as much memory
+        # as not spilling at all, so loaders should use iter_data.
+        merged = dict()
+        for table, data in self.iter_data():
+            columns = merged.setdefault(table, dict([(k, list()) for k in data]))
+            for k, v in data.items():
+                columns[k].extend(v)
+        return merged
+
+    def iter_data(self):
+        """Iterate over the data that has been parsed so far, in segments.
+
+        The spilled segments are read back one at a time, followed by
+        the rows still in memory, so at most one segment per table is
+        in memory at any point.
+
+        Yields:
+            Tuples with the name of a table and a dictionary with its
+            columns, as returned by :meth:`get_data`. The same table
+            may appear many times.
+        """
+        for table, fl in self._spilled:
+            fl.seek(0)
+            yield table, pickle.load(fl)
+        for table, data in self._tables.items():
+            yield table, data
+
+    def estimate_memory(self):
+        """Estimate the memory occupied by the rows held in memory.
+
+        The estimate is based on the size of the last rows of every
+        table, so it is cheap but not exact.
+
+        Returns:
+            The estimated number of bytes.
+        """
+        total = 0
+        for data in self._tables.values():
+            rows = max([len(v) for v in data.values()] or [0])
+            if rows == 0:
+                continue
+            sample = 0
+            count = 0
+            for column in data.values():
+                for value in column[-8:]:
+                    sample += sys.getsizeof(value)
+                    count += 1
+            # One pointer per list slot, plus the values themselves.
+            total += rows * len(data) * 8 + rows * len(data) * sample // max(count, 1)
+        return total
+
+    def get_stats(self):
+        """Get the statistics collected by the parser.
+
+        Returns:
+            See :meth:`mal_analytics.stats.IngestStats.get_stats`. The
+            dictionaries are empty if collection is disabled.
+        """
+        return self._stats.get_stats()
+
+    def get_newest_time(self):
+        """Get the newest ``ctime`` parsed so far.
+
+        Returns:
+            The time in microseconds since the epoch, or ``None`` if no
+            object with a ``ctime`` has been parsed.
+        """
+        return self._newest_time
+
+    def get_spill_statistics(self):
+        """Get statistics about the spilled data.
+
+        Returns:
+            A dictionary with the number of spilled ``segments`` and
+            the number of ``bytes`` written to temporary files.
+        """
+        return {'segments': len(self._spilled), 'bytes': self._spilled_bytes}
+
+    def _spill(self):
+        before = self.estimate_memory()
+        segments = len(self._spilled)
+        for table, data in self._tables.items():
+            if not any(data.values()):
+                continue
+            fl = tempfile.TemporaryFile(prefix='mal_analytics_', dir=self._spill_dir)
+            pickle.dump(data, fl, pickle.HIGHEST_PROTOCOL)
+            self._spilled_bytes += fl.tell()
+            self._spilled.append((table, fl))
+        self._initialize_tables()
+        self._stats.increment('segments_spilled', len(self._spilled) - segments)
+        LOGGER.info("Memory budget exceeded (about %d bytes), spilled %d segments to disk",
+                    before, len(self._spilled))
 
     def clear_internal_state(self):
         """Clear the internal dictionaries.
         """
+        for _, fl in self._spilled:
+            fl.close()
+        self._spilled = list()
+        self._spilled_bytes = 0
         self._tables = None
         self._initialize_tables()
 
+    def save_state(self):
+        """Return a copy of the state carried between chunks of a trace.
+
+        This is everything but the parsed data: the next ids, and the
+        executions, variables and start events seen so far. If loading
+        the parsed data fails, :meth:`restore_state` brings the parser
+        back in line with the database.
+
+        Returns:
+            An opaque object for :meth:`restore_state`.
+        """
+        return copy.deepcopy({name: getattr(self, name) for name in self._STATE})
+
+    def restore_state(self, state):
+        """Discard the parsed data and return to a saved state.
+
+        Args:
+            state: The return value of :meth:`save_state`. It can be
+                restored more than once.
+        """
+        self.clear_internal_state()
+        for name, value in copy.deepcopy(state).items():
+            setattr(self, name, value)
+
     def to_csv(self, directory):  # pragma: no coverage
         """Write the tables to CSVs
 
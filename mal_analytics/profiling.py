@@ -0,0 +1,188 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Profile ingest runs on demand.
+
+Profiling is enabled by the ``profile`` argument of
+:func:`mal_analytics.trace_reader.parse_trace` and
+:meth:`mal_analytics.db_manager.DatabaseManager.parse_trace`, or for
+all ingests by the environment variable ``MAL_ANALYTICS_PROFILE``. The
+value can be ``1``, to write the profiles in the directory
+``<database>-profiles`` next to the database, or the path of another
+directory.
+
+Every profiled run writes two files, named after the trace, the version
+of the package and the time of the run:
+
+* ``<name>.prof``: the :mod:`cProfile` statistics, which can be loaded
+  with :class:`pstats.Stats` or any compatible viewer.
+* ``<name>.txt``: a report with the build information (see
+  :func:`mal_analytics.bench.build_info`), the functions with the
+  largest cumulative time and the lines that allocated the most memory
+  (measured with :mod:`tracemalloc`).
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import time
+import tracemalloc
+
+from mal_analytics.bench import build_info
+
+LOGGER = logging.getLogger(__name__)
+
+ENVIRONMENT_VARIABLE = 'MAL_ANALYTICS_PROFILE'
+
+
+class _NullProfiler(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class IngestProfiler(object):
+    """Collect the CPU and memory profile of a block of code.
+
+    The profiler is a context manager. The files are written when the
+    block exits, even if it raises an exception.
+
+    Args:
+        directory: Where to write the profile files.
+        name: The name of the run, usually the name of the trace.
+        top: The number of functions and allocation sites reported.
+        frames: The number of frames stored by :mod:`tracemalloc`
+            for every allocation.
+    """
+
+    def __init__(self, directory, name, top=25, frames=1):
+        self._directory = directory
+        self._name = name
+        self._top = top
+        self._frames = frames
+        self._profile = None
+        self._started_tracing = False
+        self._paths = None
+        self._start = None
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+            self._started_tracing = True
+        self._start = time.time()
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        if self._started_tracing:
+            tracemalloc.stop()
+
+        try:
+            self._write(snapshot, peak, time.time() - self._start)
+        except OSError as e:
+            LOGGER.error("Cannot write the profile of %s: %s", self._name, e)
+
+    def get_paths(self):
+        """Get the files written by the profiler.
+
+        Returns:
+            A tuple with the paths of the statistics and of the report,
+            or ``None`` if nothing has been written yet.
+        """
+        return self._paths
+
+    def _write(self, snapshot, peak, elapsed):
+        info = build_info()
+        label = info['version'] or info['revision'] or 'unknown'
+        base = '{}-{}-{}'.format(
+            re.sub(r'[^A-Za-z0-9_.-]', '_', os.path.basename(self._name)),
+            re.sub(r'[^A-Za-z0-9_.-]', '_', label),
+            time.strftime('%Y%m%dT%H%M%S', time.localtime(self._start)))
+        if not os.path.isdir(self._directory):
+            os.makedirs(self._directory)
+        stats_path = os.path.join(self._directory, base + '.prof')
+        report_path = os.path.join(self._directory, base + '.txt')
+
+        self._profile.dump_stats(stats_path)
+
+        report = io.StringIO()
+        report.write("Profile of {}\n".format(self._name))
+        for key in sorted(info):
+            report.write("{}: {}\n".format(key, info[key]))
+        report.write("elapsed: {:.3f} s\n".format(elapsed))
+        report.write("peak traced memory: {} bytes\n\n".format(peak))
+
+        report.write("Functions by cumulative time\n")
+        report.write("============================\n")
+        stats = pstats.Stats(self._profile, stream=report)
+        stats.sort_stats('cumulative').print_stats(self._top)
+
+        report.write("Top allocations\n")
+        report.write("===============\n")
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        for stat in snapshot.statistics('lineno')[:self._top]:
+            report.write("{}\n".format(stat))
+
+        with open(report_path, 'w') as fl:
+            fl.write(report.getvalue())
+
+        self._paths = (stats_path, report_path)
+        LOGGER.info("Wrote the profile of %s to %s", self._name, report_path)
+
+
+def profile_directory(dbpath, profile=None):
+    """Decide where the profile of an ingest is written.
+
+    Args:
+        dbpath: The database directory.
+        profile: ``True`` or ``False`` to enable or disable profiling,
+            or the directory of the profiles. If ``None`` the
+            environment variable ``MAL_ANALYTICS_PROFILE`` decides.
+
+    Returns:
+        A directory, or ``None`` if profiling is disabled.
+    """
+    if profile is None:
+        profile = os.environ.get(ENVIRONMENT_VARIABLE, '')
+        if profile in ('', '0'):
+            return None
+        if profile == '1':
+            profile = True
+    if profile is True:
+        return os.path.abspath(dbpath).rstrip(os.sep) + '-profiles'
+    if not profile:
+        return None
+    return profile
+
+
+def profile_ingest(dbpath, name, profile=None):
+    """Profile an ingest, if profiling is enabled.
+
+    Args:
+        dbpath: The database directory.
+        name: The name of the run, usually the path of the trace.
+        profile: See :func:`profile_directory`.
+
+    Returns:
+        A context manager: an :class:`IngestProfiler`, or one that does
+        nothing if profiling is disabled.
+    """
+    directory = profile_directory(dbpath, profile)
+    if directory is None:
+        return _NullProfiler()
+    return IngestProfiler(directory, name)
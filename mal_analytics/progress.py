@@ -0,0 +1,190 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Progress reporting for long ingests.
+
+The ingest entry points (:func:`mal_analytics.trace_reader.parse_trace`,
+:meth:`mal_analytics.db_manager.DatabaseManager.parse_trace` and
+:meth:`mal_analytics.db_manager.DatabaseManager.load_parsed_data`)
+accept a ``progress`` callback, which is called with a
+:class:`ProgressReport` at most every ``interval`` seconds and whenever
+the ingest enters a new phase:
+
+* ``read``: reading and decoding the trace. The position is the number
+  of bytes consumed from the file, compressed if the file is
+  compressed.
+* ``parse``: turning the JSON objects into rows.
+* ``load``: inserting the rows.
+* ``constraints``: enforcing and restoring the constraints.
+* ``done``: the ingest has finished.
+
+:class:`TextProgressBar` is a callback that draws a progress bar on a
+terminal.
+"""
+
+import collections
+import sys
+import time
+
+ProgressReport = collections.namedtuple('ProgressReport', [
+    'phase', 'position', 'size', 'objects', 'total_objects',
+    'objects_per_second', 'elapsed', 'eta'])
+ProgressReport.__doc__ = """The state of an ingest.
+
+``position`` and ``size`` are the bytes of the trace consumed so far
+and in total (``None`` if unknown). ``objects`` is the number of JSON
+objects processed in the current phase, out of ``total_objects`` if
+known, at ``objects_per_second``. ``elapsed`` is the time since the
+ingest started and ``eta`` the estimated time in seconds until the
+current phase ends, or ``None`` if it cannot be estimated.
+"""
+
+# How many objects are processed between two calls of
+# ProgressTracker.advance in the ingest loops.
+REPORT_EVERY = 1000
+
+
+class ProgressTracker(object):
+    """Keep track of an ingest and call a callback, rate limited.
+
+    Args:
+        callback: A function called with a :class:`ProgressReport`.
+        size: The size of the trace in bytes, if known.
+        interval: The minimum time in seconds between two calls of the
+            callback within a phase.
+        clock: A function returning the time in seconds.
+    """
+
+    def __init__(self, callback, size=None, interval=0.5, clock=time.monotonic):
+        self._callback = callback
+        self._size = size
+        self._interval = interval
+        self._clock = clock
+        self._start = clock()
+        self._phase = None
+        self._phase_start = self._start
+        self._last_report = float('-inf')
+        self._position = 0
+        self._objects = 0
+        self._total_objects = None
+
+    def start_phase(self, phase, total_objects=None):
+        """Enter a new phase and report it.
+
+        Args:
+            phase: The name of the phase.
+            total_objects: The number of objects the phase will
+                process, if known.
+        """
+        self._phase = phase
+        self._phase_start = self._clock()
+        self._objects = 0
+        self._total_objects = total_objects
+        self._report(self._phase_start)
+
+    def advance(self, objects=0, position=None):
+        """Record progress, and report it if enough time has passed.
+
+        Args:
+            objects: The number of objects processed since the last
+                call.
+            position: The number of bytes of the trace consumed so far.
+        """
+        self._objects += objects
+        if position is not None:
+            self._position = position
+        now = self._clock()
+        if now - self._last_report >= self._interval:
+            self._report(now)
+
+    def finish(self):
+        """Report the end of the ingest."""
+        if self._size is not None:
+            self._position = self._size
+        self.start_phase('done')
+
+    def get_report(self, now=None):
+        """Get the current state of the ingest.
+
+        Returns:
+            A :class:`ProgressReport`.
+        """
+        if now is None:
+            now = self._clock()
+        phase_elapsed = now - self._phase_start
+        rate = self._objects / phase_elapsed if phase_elapsed > 0 else None
+
+        eta = None
+        if self._phase == 'read' and self._size and self._position > 0:
+            eta = phase_elapsed * (self._size - self._position) / self._position
+        elif self._total_objects and self._objects > 0:
+            eta = phase_elapsed * (self._total_objects - self._objects) / self._objects
+
+        return ProgressReport(self._phase, self._position, self._size, self._objects,
+                              self._total_objects, rate, now - self._start, eta)
+
+    def _report(self, now):
+        self._last_report = now
+        self._callback(self.get_report(now))
+
+
+def _format_bytes(value):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if value < 1024:
+            return "{:.1f} {}".format(value, unit)
+        value /= 1024.0
+    return "{:.1f} TB".format(value)
+
+
+def _format_time(seconds):
+    seconds = int(seconds)
+    return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+class TextProgressBar(object):
+    """A progress callback that draws a bar on a terminal.
+
+    Args:
+        stream: The stream to write to.
+        width: The width of the bar in characters.
+    """
+
+    def __init__(self, stream=None, width=30):
+        self._stream = stream if stream is not None else sys.stderr
+        self._width = width
+
+    def __call__(self, report):
+        fraction = None
+        if report.phase == 'read' and report.size:
+            fraction = report.position / report.size
+        elif report.total_objects:
+            fraction = report.objects / report.total_objects
+        elif report.phase == 'done':
+            fraction = 1.0
+
+        if fraction is None:
+            bar = ' ' * self._width
+            percent = '    '
+        else:
+            fraction = min(fraction, 1.0)
+            filled = int(round(fraction * self._width))
+            bar = '#' * filled + ' ' * (self._width - filled)
+            percent = '{:3d}%'.format(int(fraction * 100))
+
+        parts = ['\r[{}] {} {:<11}'.format(bar, percent, report.phase)]
+        if report.size:
+            parts.append('{}/{}'.format(_format_bytes(report.position), _format_bytes(report.size)))
+        if report.objects_per_second:
+            parts.append('{:.0f} obj/s'.format(report.objects_per_second))
+        if report.eta is not None:
+            parts.append('ETA {}'.format(_format_time(report.eta)))
+        else:
+            parts.append('elapsed {}'.format(_format_time(report.elapsed)))
+
+        self._stream.write(' '.join(parts) + '\x1b[K')
+        if report.phase == 'done':
+            self._stream.write('\n')
+        self._stream.flush()
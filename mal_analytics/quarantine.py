@@ -0,0 +1,308 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Tolerant ingestion: set invalid objects aside instead of failing.
+
+By default a malformed JSON object, or an object the parser cannot
+handle, aborts the ingest of the whole trace. When a :class:`Quarantine`
+is passed to the ingest functions
+(:func:`mal_analytics.trace_reader.read_trace`,
+:func:`mal_analytics.trace_reader.read_stream`,
+:func:`mal_analytics.trace_reader.parse_trace`,
+:meth:`mal_analytics.db_manager.DatabaseManager.parse_trace` and
+:meth:`mal_analytics.db_manager.DatabaseManager.create_parser`) such
+objects are written to a quarantine file instead, and the ingest goes
+on. The ``--quarantine`` option of ``mal-analytics ingest`` does the
+same. Every line of the file is a JSON object with the keys:
+
+* ``source``: the trace the object came from.
+* ``offset``: the byte offset of the object in the (uncompressed)
+  trace, or ``null`` if it is not known.
+* ``reason``: one of :data:`REASONS`.
+* ``message``: a description of the problem.
+* ``object``: the text of the object.
+
+The error budget (``max_errors`` and ``max_error_rate``) decides when
+there are too many invalid objects to go on, in which case
+:class:`mal_analytics.exceptions.ErrorBudgetExceeded` is raised and the
+current transaction is rolled back.
+"""
+
+import json
+import logging
+
+from mal_analytics.exceptions import ErrorBudgetExceeded
+from mal_analytics.progress import REPORT_EVERY
+from mal_analytics.stats import NULL_STATS
+
+LOGGER = logging.getLogger(__name__)
+
+INVALID_JSON = 'invalid_json'
+INCOMPLETE_OBJECT = 'incomplete_object'
+NOT_AN_OBJECT = 'not_an_object'
+MISSING_SESSION = 'missing_session'
+MISSING_TAG = 'missing_tag'
+UNNAMED_VARIABLE = 'unnamed_variable'
+INVALID_OBJECT = 'invalid_object'
+LATE_EVENT = 'late_event'
+
+REASONS = (INVALID_JSON, INCOMPLETE_OBJECT, NOT_AN_OBJECT, MISSING_SESSION, MISSING_TAG,
+           UNNAMED_VARIABLE, INVALID_OBJECT, LATE_EVENT)
+
+
+class Quarantine(object):
+    """Collect the objects rejected by a tolerant ingest.
+
+    Args:
+        path: The quarantine file. Records are appended to it. If
+            ``None`` the records are kept in memory (see
+            :meth:`get_records`).
+        max_errors: Abort when more objects than this have been
+            rejected. ``None`` means no limit.
+        max_error_rate: Abort when the fraction of rejected objects
+            exceeds this, once at least ``min_objects`` objects have
+            been read. ``None`` means no limit.
+        min_objects: The number of objects read before the error rate
+            is checked.
+        stats: An :class:`mal_analytics.stats.IngestStats` object that
+            counts the rejected objects per reason
+            (``quarantined.<reason>``).
+    """
+
+    def __init__(self, path=None, max_errors=None, max_error_rate=None, min_objects=1000,
+                 stats=NULL_STATS):
+        self._path = path
+        self._max_errors = max_errors
+        self._max_error_rate = max_error_rate
+        self._min_objects = min_objects
+        self._stats = stats
+        self._file = None
+        self._records = list()
+        self._counts = dict()
+        self._objects = 0
+        self._source = None
+        self._offsets = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getstate__(self):
+        # Quarantines of worker processes are sent back to be merged.
+        state = self.__dict__.copy()
+        state['_file'] = None
+        state['_stats'] = NULL_STATS
+        return state
+
+    def start_stream(self, source, offsets=None):
+        """Set the trace the next rejected objects come from.
+
+        Args:
+            source: The name of the trace.
+            offsets: A list with the byte offset of every object of the
+                trace, as returned by :func:`decode_objects`. It is used
+                to find the offsets of the objects rejected by the
+                parser.
+        """
+        self._source = source
+        self._offsets = offsets
+
+    def count_objects(self, count):
+        """Record objects read, valid or not, for the error rate.
+
+        Args:
+            count: The number of objects.
+        """
+        self._objects += count
+
+    def reject(self, reason, data, offset=None, index=None, message=None):
+        """Quarantine an object.
+
+        Args:
+            reason: One of :data:`REASONS`.
+            data: The text of the object, or the decoded object.
+            offset: The byte offset of the object in the trace.
+            index: The position of the object in the current stream,
+                used to look up its offset if ``offset`` is ``None``.
+            message: A description of the problem.
+
+        Raises:
+            :class:`mal_analytics.exceptions.ErrorBudgetExceeded`: if
+                there are more than ``max_errors`` rejected objects.
+        """
+        if offset is None and index is not None and self._offsets is not None and index < len(self._offsets):
+            offset = self._offsets[index]
+        if not isinstance(data, str):
+            data = json.dumps(data, sort_keys=True)
+        self._record({
+            'source': self._source,
+            'offset': offset,
+            'reason': reason,
+            'message': message or reason.replace('_', ' '),
+            'object': data,
+        })
+
+    def merge(self, other):
+        """Add the records and the object count of another quarantine.
+
+        The offsets of the current stream are taken from ``other``.
+
+        Args:
+            other: A :class:`Quarantine` with ``path=None``, usually
+                filled by a worker process.
+
+        Raises:
+            :class:`mal_analytics.exceptions.ErrorBudgetExceeded`: see
+                :meth:`reject` and :meth:`check_rate`.
+        """
+        self._objects += other._objects
+        self.start_stream(other._source, other._offsets)
+        for record in other.get_records():
+            self._record(record)
+        self.check_rate()
+
+    def check_rate(self):
+        """Check the error rate.
+
+        Raises:
+            :class:`mal_analytics.exceptions.ErrorBudgetExceeded`: if
+                the fraction of rejected objects exceeds
+                ``max_error_rate``.
+        """
+        if self._max_error_rate is None or self._objects < max(self._min_objects, 1):
+            return
+        rate = self.get_total() / self._objects
+        if rate > self._max_error_rate:
+            raise ErrorBudgetExceeded(
+                "{} of {} objects rejected ({:.2%} > {:.2%}): {}".format(
+                    self.get_total(), self._objects, rate, self._max_error_rate, self._summary()))
+
+    def get_counts(self):
+        """Get the number of rejected objects per reason.
+
+        Returns:
+            A dictionary.
+        """
+        return dict(self._counts)
+
+    def get_total(self):
+        """Get the number of rejected objects.
+
+        Returns:
+            An integer.
+        """
+        return sum(self._counts.values())
+
+    def get_records(self):
+        """Get the records kept in memory, if there is no file.
+
+        Returns:
+            A list of dictionaries (see :mod:`mal_analytics.quarantine`).
+        """
+        return list(self._records)
+
+    def close(self):
+        """Close the quarantine file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _record(self, record):
+        reason = record['reason']
+        self._counts[reason] = self._counts.get(reason, 0) + 1
+        self._stats.increment('quarantined.' + reason)
+        LOGGER.warning("Quarantined object at offset %s of %s: %s",
+                       record['offset'], record['source'], record['message'])
+
+        if self._path is None:
+            self._records.append(record)
+        else:
+            if self._file is None:
+                self._file = open(self._path, 'a')
+            self._file.write(json.dumps(record, sort_keys=True) + '\n')
+            self._file.flush()
+
+        if self._max_errors is not None and self.get_total() > self._max_errors:
+            raise ErrorBudgetExceeded(
+                "More than {} objects rejected: {}".format(self._max_errors, self._summary()))
+
+    def _summary(self):
+        return ', '.join(['{} {}'.format(count, reason) for reason, count in sorted(self._counts.items())])
+
+
+def decode_objects(binary, quarantine, source, progress=None, raw=None):
+    """Decode the JSON objects of a trace, quarantining the invalid ones.
+
+    This is the tolerant version of the readers in
+    :mod:`mal_analytics.trace_reader`: an object ends at a line ending
+    with ``}``, or before a line starting with ``{``, so that a
+    truncated object does not swallow the next one. The last object of
+    the trace is decoded even if it does not end with a new line.
+
+    Args:
+        binary: A binary file object with the uncompressed trace.
+        quarantine: A :class:`Quarantine`. It is set up for the objects
+            of the trace rejected later by the parser (see
+            :meth:`Quarantine.start_stream`).
+        source: The name of the trace.
+        progress: A :class:`mal_analytics.progress.ProgressTracker`.
+        raw: The file object whose position is reported to
+            ``progress``. Defaults to ``binary``.
+
+    Returns:
+        A tuple with the list of decoded objects and the list of their
+        byte offsets.
+    """
+    if raw is None:
+        raw = binary
+    quarantine.start_stream(source)
+    objects = list()
+    offsets = list()
+    seen = 0
+    position = 0
+    start = 0
+    buf = list()
+
+    def decode(text, offset, last):
+        try:
+            objects.append(json.loads(text.decode('utf-8')))
+            offsets.append(offset)
+        except ValueError as e:
+            quarantine.reject(INCOMPLETE_OBJECT if last else INVALID_JSON,
+                              text.decode('utf-8', 'replace'), offset, message=str(e))
+
+    for ln in binary:
+        if buf and ln.startswith(b'{'):
+            # The buffered object is truncated.
+            text = b''.join(buf).strip()
+            buf = list()
+            if text:
+                seen += 1
+                decode(text, start, False)
+        if not buf:
+            start = position
+        buf.append(ln)
+        position += len(ln)
+        if ln.rstrip(b'\r\n').endswith(b'}') and ln.endswith(b'\n'):
+            text = b''.join(buf).strip()
+            buf = list()
+            if not text:
+                continue
+            seen += 1
+            decode(text, start, False)
+            if progress is not None and seen % REPORT_EVERY == 0:
+                progress.advance(REPORT_EVERY, raw.tell())
+
+    text = b''.join(buf).strip()
+    if text:
+        seen += 1
+        decode(text, start, True)
+
+    quarantine.count_objects(seen)
+    quarantine.start_stream(source, offsets)
+    return objects, offsets
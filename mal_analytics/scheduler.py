@@ -0,0 +1,287 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+from concurrent.futures import Future
+from io import StringIO
+import itertools
+import json
+import logging
+import queue
+import threading
+
+from mal_analytics.exceptions import SchedulerError
+from mal_analytics.trace_reader import read_object
+
+LOGGER = logging.getLogger(__name__)
+
+# Request priorities. Lower values are served first.
+INTERACTIVE = 0
+BACKGROUND = 50
+INGEST = 100
+
+_SHUTDOWN = float('inf')
+
+
+class _Steps(object):
+    """A request made of a generator. Every ``next`` call is one unit of
+    work, after which the request goes back to the queue.
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.started = False
+
+
+class QueryScheduler(object):
+    """Serialize the access to a database from many threads.
+
+    MonetDBLite connections are not thread safe. The scheduler owns a
+    worker thread that performs every operation on the database, in
+    the order of the priority of the requests and, for equal
+    priorities, in the order they were submitted. Requests are
+    submitted from any thread and return a
+    :class:`concurrent.futures.Future`.
+
+    Long running requests, such as trace ingestion, are split into
+    steps (see :meth:`submit_steps`). After every step the request is
+    put back to the queue, so that interactive queries submitted in the
+    meantime are served first.
+
+    While the scheduler is running, the database manager should not be
+    used directly by other threads.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        chunk_objects: The number of JSON objects parsed and loaded in
+            every step of :meth:`parse_trace`.
+    """
+
+    def __init__(self, dbm, chunk_objects=5000):
+        self._dbm = dbm
+        self._chunk_objects = chunk_objects
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        # Only used by the worker thread.
+        self._ingesting = False
+        self._deferred = None
+        self._thread = threading.Thread(target=self._run, name='mal-analytics-db')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit(self, fcn, *args, priority=INTERACTIVE, **kwargs):
+        """Schedule a call on the worker thread.
+
+        Args:
+            fcn: The callable. It will be called as
+                ``fcn(*args, **kwargs)``.
+            priority: The priority of the request.
+
+        Returns:
+            A :class:`concurrent.futures.Future` with the return value of
+            the call.
+        """
+        future = Future()
+        self._put(priority, lambda: fcn(*args, **kwargs), future)
+        return future
+
+    def submit_steps(self, generator, priority=INGEST):
+        """Schedule a request that runs in steps.
+
+        Every step of the generator runs on the worker thread, and
+        other requests with a higher priority may run between steps.
+
+        Args:
+            generator: A generator. Its return value becomes the result
+                of the future.
+            priority: The priority of the request.
+
+        Returns:
+            A :class:`concurrent.futures.Future`.
+        """
+        future = Future()
+        self._put(priority, _Steps(generator), future)
+        return future
+
+    def execute_query(self, query, params=None, priority=INTERACTIVE):
+        """Schedule :meth:`mal_analytics.db_manager.DatabaseManager.execute_query`.
+
+        Returns:
+            A :class:`concurrent.futures.Future` with the results.
+        """
+        return self.submit(self._dbm.execute_query, query, params, priority=priority)
+
+    def parse_trace(self, contents, compact=False, priority=INGEST):
+        """Schedule the ingestion of a trace.
+
+        The trace is parsed and loaded in chunks of ``chunk_objects``
+        JSON objects. Every chunk is committed separately, so a failure
+        leaves the chunks before it in the database. Queries see the
+        trace partially loaded until the future completes. The
+        constraints are dropped once for the whole trace and restored
+        at the end (see
+        :meth:`mal_analytics.db_manager.DatabaseManager.defer_constraints`).
+        Traces are ingested one at a time: a request waits until the
+        ingestion of the previous ones is over.
+
+        Args:
+            contents: A string with the trace (see
+                :meth:`mal_analytics.db_manager.DatabaseManager.parse_trace`).
+            compact: Do not store the start events of completed
+                instructions.
+            priority: The priority of the request.
+
+        Returns:
+            A :class:`concurrent.futures.Future` with the number of
+            JSON objects loaded.
+        """
+        return self.submit_steps(self._ingest_steps(contents, compact), priority)
+
+    def begin_ingest(self, compact=False, priority=INGEST):
+        """Schedule the start of an ingestion driven by the caller.
+
+        This is the same as the start of :meth:`parse_trace`: the
+        request waits until the other ingestions are over, drops the
+        constraints and creates a parser. The caller then loads the
+        data with requests that call
+        :meth:`mal_analytics.db_manager.DatabaseManager.load_parsed_data`,
+        and must call :meth:`end_ingest` once the future completes,
+        even if the ingestion fails.
+
+        Args:
+            compact: Do not store the start events of completed
+                instructions.
+            priority: The priority of the request.
+
+        Returns:
+            A :class:`concurrent.futures.Future` with the parser.
+        """
+        return self.submit_steps(self._begin_ingest_steps(compact), priority)
+
+    def end_ingest(self, priority=INGEST):
+        """Schedule the end of an ingestion started by :meth:`begin_ingest`.
+
+        The constraints are restored, and the next ingestion can start.
+
+        Args:
+            priority: The priority of the request.
+
+        Returns:
+            A :class:`concurrent.futures.Future`.
+        """
+        return self.submit(self._end_ingest, priority=priority)
+
+    def shutdown(self, wait=True):
+        """Stop accepting requests and stop the worker thread once the
+        queued requests have been served.
+
+        Args:
+            wait: Block until the worker thread exits.
+        """
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put((_SHUTDOWN, next(self._sequence), None, None))
+        if wait:
+            self._thread.join()
+
+    def _put(self, priority, job, future):
+        with self._lock:
+            if self._closed:
+                raise SchedulerError("Scheduler has been shut down")
+            self._queue.put((priority, next(self._sequence), job, future))
+
+    def _run(self):
+        while True:
+            priority, _, job, future = self._queue.get()
+            if job is None:
+                break
+
+            if isinstance(job, _Steps):
+                if not job.started:
+                    job.started = True
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                try:
+                    next(job.generator)
+                except StopIteration as stop:
+                    future.set_result(stop.value)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    # Go to the back of the line of this priority
+                    self._queue.put((priority, next(self._sequence), job, future))
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(job())
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _begin_ingest_steps(self, compact):
+        # The ids of a parser come from the database, and the
+        # constraints stay dropped until the end, so ingestions cannot
+        # overlap.
+        while self._ingesting:
+            yield
+        self._ingesting = True
+        try:
+            pob = self._dbm.create_parser(compact)
+            deferred = self._dbm.defer_constraints()
+            deferred.__enter__()
+        except BaseException:
+            self._ingesting = False
+            raise
+        self._deferred = deferred
+        return pob
+
+    def _end_ingest(self):
+        deferred = self._deferred
+        self._deferred = None
+        try:
+            deferred.__exit__(None, None, None)
+        finally:
+            self._ingesting = False
+
+    def _ingest_steps(self, contents, compact):
+        pob = yield from self._begin_ingest_steps(compact)
+        try:
+            loaded = yield from self._ingest_chunks(pob, contents)
+        finally:
+            self._end_ingest()
+        return loaded
+
+    def _ingest_chunks(self, pob, contents):
+        loaded = 0
+        chunk = list()
+        with StringIO(contents) as fl:
+            json_string = read_object(fl)
+            while json_string:
+                chunk.append(json.loads(json_string))
+                if len(chunk) == self._chunk_objects:
+                    pob.parse_trace_stream(chunk)
+                    yield
+                    self._dbm.load_parsed_data(pob)
+                    loaded += len(chunk)
+                    LOGGER.debug("Loaded %d objects", loaded)
+                    chunk = list()
+                    yield
+                json_string = read_object(fl)
+
+            pob.parse_trace_stream(chunk)
+            pob.flush_pending_events()
+            self._dbm.load_parsed_data(pob)
+
+        return loaded + len(chunk)
@@ -0,0 +1,346 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""A read only HTTP service for a trace database.
+
+The service exposes the following resources, as lists ordered by their
+identifier:
+
+* ``/executions``: the MAL executions.
+* ``/queries``: the SQL queries.
+* ``/executions/<execution_id>/instructions``: the instructions run by
+  an execution (see the ``instruction_run`` table).
+* ``/heartbeats``: the heartbeats, optionally only those of one server
+  session (``?session=<uuid>``).
+
+Results are paged with keyset pagination: ``?limit=<n>`` sets the page
+size and ``?after=<id>`` returns the rows after the given identifier.
+The ``Link`` header of every page points to the next one, if any.
+
+Pages are sent as newline delimited JSON objects, one per row, or with
+``?format=columns`` as one JSON object with an array per column, and
+are compressed if the client accepts gzip. The ``ETag`` of every
+response is the version of the database, made of the token of the
+running database and its generation (see
+:meth:`mal_analytics.db_manager.DatabaseManager.get_instance_id` and
+:meth:`mal_analytics.db_manager.DatabaseManager.get_generation`),
+followed by ``-gz`` for compressed responses, so clients can revalidate
+cached pages with ``If-None-Match``.
+
+The service can be started from the command line::
+
+    python -m mal_analytics.server /path/to/db --port 8080
+"""
+
+import argparse
+import gzip
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+import json
+import logging
+import re
+import socketserver
+import threading
+from urllib.parse import parse_qs
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+
+from mal_analytics.scheduler import QueryScheduler
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
+# For every resource: a path pattern, the query, the key column, and
+# the filters. Every filter is a column and the name of the request
+# argument (or path group) it is compared with.
+RESOURCES = [
+    (
+        re.compile(r'^/executions/?$'),
+        "SELECT execution_id, server_session, tag, server_version, user_function FROM mal_execution",
+        'execution_id',
+        [],
+    ),
+    (
+        re.compile(r'^/queries/?$'),
+        "SELECT query_id, query_text, query_label, root_execution_id FROM query",
+        'query_id',
+        [],
+    ),
+    (
+        re.compile(r'^/executions/(?P<execution_id>[0-9]+)/instructions/?$'),
+        "SELECT instruction_run_id, pc, thread, start_time, end_time, astart_time, aend_time, duration, short_statement, mal_module, instruction FROM instruction_run",
+        'instruction_run_id',
+        [('mal_execution_id', 'execution_id')],
+    ),
+    (
+        re.compile(r'^/heartbeats/?$'),
+        "SELECT heartbeat_id, server_session, clk, ctime, rss, nvcsw FROM heartbeat",
+        'heartbeat_id',
+        [('server_session', 'session')],
+    ),
+]
+
+
+class NotFound(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _argument(args, name, default, conversion=int):
+    values = args.get(name)
+    if not values:
+        return default
+    try:
+        return conversion(values[-1])
+    except ValueError:
+        raise BadRequest("Invalid value for {}: {}".format(name, values[-1]))
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        args = parse_qs(url.query)
+        service = self.server.service
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+
+        def not_modified(version):
+            return self.headers.get('If-None-Match') == service.etag(version, compress)
+
+        try:
+            fmt = _argument(args, 'format', 'ndjson', str)
+            if fmt not in ('ndjson', 'columns'):
+                raise BadRequest("Unknown format {}".format(fmt))
+            version, columns, next_key = service.get_page(url.path, args, not_modified)
+        except NotFound as e:
+            return self._send_error(404, str(e))
+        except BadRequest as e:
+            return self._send_error(400, str(e))
+        except Exception as e:
+            LOGGER.exception("Request %s failed", self.path)
+            return self._send_error(500, str(e))
+
+        etag = service.etag(version, compress)
+        if columns is None:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if fmt == 'columns':
+            body = json.dumps({'columns': columns, 'next': next_key}).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            names = list(columns.keys())
+            rows = zip(*[columns[n] for n in names])
+            body = ''.join([json.dumps(dict(zip(names, r))) + '\n' for r in rows]).encode('utf-8')
+            content_type = 'application/x-ndjson'
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept-Encoding')
+        if next_key is not None:
+            next_args = dict([(k, v[-1]) for k, v in args.items()])
+            next_args['after'] = next_key
+            self.send_header('Link', '<{}?{}>; rel="next"'.format(url.path, urlencode(next_args)))
+        if compress:
+            body = gzip.compress(body, 5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, code, message):
+        body = json.dumps({'error': message}).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug("%s - %s", self.address_string(), format % args)
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class QueryService(object):
+    """Serve the resources of a trace database over HTTP.
+
+    All the queries run on the worker thread of a
+    :class:`mal_analytics.scheduler.QueryScheduler`, over the same
+    connection, with the query cache of the database manager enabled.
+    Data should be loaded through the scheduler (see
+    :meth:`get_scheduler`) while the service is running.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        host: The address to listen on.
+        port: The port to listen on. Use 0 for any free port.
+        cache_bytes: The size of the query cache.
+    """
+
+    def __init__(self, dbm, host='127.0.0.1', port=8080, cache_bytes=64 * 1024 * 1024):
+        self._dbm = dbm
+        self._scheduler = QueryScheduler(dbm)
+        self._scheduler.submit(dbm.set_query_cache, cache_bytes).result()
+        self._server = _HTTPServer((host, port), _RequestHandler)
+        self._server.service = self
+        self._thread = None
+
+    def get_address(self):
+        """Get the address the service listens on.
+
+        Returns:
+            A (host, port) tuple.
+        """
+        return self._server.server_address
+
+    def get_scheduler(self):
+        """Get the scheduler running the queries of the service.
+
+        Returns:
+            A :class:`mal_analytics.scheduler.QueryScheduler` object.
+        """
+        return self._scheduler
+
+    def start(self):
+        """Start serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mal-analytics-http')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def serve_forever(self):
+        """Serve in the current thread until :meth:`shutdown` is called."""
+        self._server.serve_forever()
+
+    def shutdown(self):
+        """Stop serving and stop the scheduler."""
+        self._server.shutdown()
+        self._server.server_close()
+        self._scheduler.shutdown()
+
+    def etag(self, version, compressed=False):
+        """Get the entity tag of a response.
+
+        Args:
+            version: The version of the database, as returned by
+                :meth:`get_page`.
+            compressed: If the response is compressed with gzip.
+
+        Returns:
+            A quoted string.
+        """
+        if compressed:
+            return '"{}-gz"'.format(version)
+        return '"{}"'.format(version)
+
+    def get_page(self, path, args, not_modified=None):
+        """Get a page of a resource.
+
+        The version of the database is read in the same request of the
+        scheduler as the page, so that it describes the page. It is
+        the token of the running database followed by its generation,
+        so it changes when the database is restarted or swapped.
+
+        Args:
+            path: The path of the resource.
+            args: A dictionary with the request arguments, as returned
+                by :func:`urllib.parse.parse_qs`.
+            not_modified: A function called with the version of the
+                database. If it returns ``True`` the page is not read.
+
+        Returns:
+            A tuple with the version of the database, a dictionary
+            with keys the column names and values lists (or ``None`` if
+            the page was not read), and the key of the next page or
+            ``None`` if this is the last one.
+
+        Raises:
+            NotFound: if the path does not name a resource.
+            BadRequest: if the arguments are not valid.
+        """
+        for pattern, select, key, filters in RESOURCES:
+            match = pattern.match(path)
+            if match is not None:
+                break
+        else:
+            raise NotFound("Unknown resource {}".format(path))
+
+        limit = _argument(args, 'limit', DEFAULT_LIMIT)
+        if limit <= 0 or limit > MAX_LIMIT:
+            raise BadRequest("limit should be between 1 and {}".format(MAX_LIMIT))
+        after = _argument(args, 'after', 0)
+
+        conditions = ["{} > %s".format(key)]
+        params = [after]
+        groups = match.groupdict()
+        for column, name in filters:
+            if name in groups:
+                value = int(groups[name])
+            else:
+                value = _argument(args, name, None, str)
+                if value is None:
+                    continue
+            conditions.append("{}=%s".format(column))
+            params.append(value)
+
+        query = "{} WHERE {} ORDER BY {} LIMIT {}".format(select, " AND ".join(conditions), key, limit)
+        version, results = self._scheduler.submit(self._read_page, query, params, not_modified).result()
+        if results is None:
+            return version, None, None
+
+        columns = dict([(name, column.tolist()) for name, column in results.items()])
+        next_key = None
+        if len(columns[key]) == limit:
+            next_key = columns[key][-1]
+
+        return version, columns, next_key
+
+    def _read_page(self, query, params, not_modified):
+        # Runs on the worker thread of the scheduler.
+        version = '{}-{}'.format(self._dbm.get_instance_id(), self._dbm.get_generation())
+        if not_modified is not None and not_modified(version):
+            return version, None
+        results = self._dbm.execute_query(query, params)
+        if results is None:
+            raise RuntimeError("Query failed")
+        return version, results
+
+
+def main(argv=None):  # pragma: no coverage
+    from mal_analytics.db_manager import DatabaseManager
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('dbpath', help='The database directory')
+    parser.add_argument('--host', default='127.0.0.1', help='The address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='The port to listen on')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    service = QueryService(DatabaseManager(args.dbpath), args.host, args.port)
+    LOGGER.info("Serving on %s:%d", *service.get_address())
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.shutdown()
+
+
+if __name__ == '__main__':  # pragma: no coverage
+    main()
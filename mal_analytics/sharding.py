@@ -0,0 +1,345 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Spread traces over many databases and query them together.
+
+Every shard is a separate database directory owned by a worker
+process, since MonetDBLite can run only one database per process.
+Whole server sessions are routed to shards by a hash of the session
+identifier, so all the events, variables and heartbeats of a session
+end up in the same shard. Identifiers (execution, event ids etc) are
+assigned by every shard independently and are only unique within a
+shard.
+
+The links between executions of different sessions (for instance
+between the supervisor and the workers of a distributed query) are
+only recorded if the sessions happen to be in the same shard.
+"""
+
+import collections
+import heapq
+import logging
+import multiprocessing
+import os
+import zlib
+
+from mal_analytics.db_manager import DatabaseManager
+from mal_analytics.exceptions import QueryError
+from mal_analytics.exceptions import ShardError
+
+LOGGER = logging.getLogger(__name__)
+
+# How partial aggregates of different shards are combined.
+_MERGE_FUNCTIONS = {
+    'sum': lambda a, b: a + b,
+    'count': lambda a, b: a + b,
+    'min': min,
+    'max': max,
+}
+
+
+def merge_aggregates(shard_results, keys=(), aggregates=None):
+    """Merge partial aggregates computed by many shards.
+
+    Args:
+        shard_results: A list with the results of every shard, as
+            dictionaries of NumPy arrays.
+        keys: The names of the grouping columns.
+        aggregates: A dictionary with keys the names of the aggregate
+            columns and values one of ``sum``, ``count``, ``min`` and
+            ``max``.
+
+    Returns:
+        A dictionary with keys the column names and values lists, with
+        one element per group.
+    """
+    aggregates = aggregates or dict()
+    for column, fcn in aggregates.items():
+        if fcn not in _MERGE_FUNCTIONS:
+            raise ValueError("Cannot merge {} aggregates ({})".format(fcn, column))
+    names = list(keys) + list(aggregates)
+
+    groups = collections.OrderedDict()
+    for results in shard_results:
+        columns = [results[c].tolist() for c in names]
+        for row in zip(*columns):
+            key = row[:len(keys)]
+            values = row[len(keys):]
+            partial = groups.get(key)
+            if partial is None:
+                groups[key] = list(values)
+                continue
+            for i, (value, fcn) in enumerate(zip(values, aggregates.values())):
+                if value is None:
+                    continue
+                if partial[i] is None:
+                    partial[i] = value
+                else:
+                    partial[i] = _MERGE_FUNCTIONS[fcn](partial[i], value)
+
+    merged = dict([(c, list()) for c in names])
+    for key, partial in groups.items():
+        for c, value in zip(names, list(key) + partial):
+            merged[c].append(value)
+
+    return merged
+
+
+def merge_top_k(shard_results, column, k, descending=True):
+    """Merge the top rows found by many shards.
+
+    Args:
+        shard_results: A list with the results of every shard, as
+            dictionaries of NumPy arrays.
+        column: The name of the column to order by.
+        k: The number of rows to return.
+        descending: Keep the largest values if ``True``, the smallest
+            otherwise.
+
+    Returns:
+        A dictionary with keys the column names and values lists. The
+        column ``shard`` holds the index of the shard of every row.
+    """
+    candidates = list()
+    names = list()
+    for shard, results in enumerate(shard_results):
+        names = list(results.keys())
+        columns = [results[n].tolist() for n in names]
+        for row in zip(*columns):
+            candidates.append((shard, dict(zip(names, row))))
+
+    select = heapq.nlargest if descending else heapq.nsmallest
+    best = select(k, candidates, key=lambda c: c[1][column])
+
+    merged = dict([(n, [row[n] for _, row in best]) for n in names])
+    merged['shard'] = [shard for shard, _ in best]
+    return merged
+
+
+def _shard_worker(dbpath, compact, connection):
+    dbm = DatabaseManager(dbpath)
+    pob = dbm.create_parser(compact)
+    while True:
+        command, args = connection.recv()
+        if command == 'ingest':
+            state = pob.save_state()
+        try:
+            if command == 'ingest':
+                pob.parse_trace_stream(args[0])
+                dbm.load_parsed_data(pob)
+                reply = len(args[0])
+            elif command == 'query':
+                reply = dbm.execute_query(*args)
+                if reply is None:
+                    raise QueryError("Query failed: {}".format(args[0]))
+            elif command == 'close':
+                try:
+                    pob.flush_pending_events()
+                    dbm.load_parsed_data(pob)
+                finally:
+                    dbm.close_database()
+                reply = None
+            else:
+                raise ShardError("Unknown command {}".format(command))
+        except Exception as e:
+            LOGGER.error("Shard %s: %s failed: %s", dbpath, command, e)
+            connection.send(('error', "{}: {}".format(type(e).__name__, e)))
+            if command == 'ingest':
+                # Executions span ingestions, so the parser goes back to
+                # its state before the data that was not loaded.
+                pob.restore_state(state)
+        else:
+            connection.send(('ok', reply))
+
+        # The parent joins the process after a close, whatever its
+        # outcome.
+        if command == 'close':
+            return
+
+
+class ShardedDatabase(object):
+    """A set of databases, each one owned by a worker process.
+
+    Args:
+        base_path: The directory holding the shards. Shard ``i`` is
+            stored in ``base_path/shard_<i>``.
+        shards: The number of shards. It should stay the same for the
+            lifetime of the data, since it determines where every
+            session is stored.
+        compact: Do not store the start events of completed
+            instructions.
+    """
+
+    # How long close waits for a worker process to stop, in seconds.
+    CLOSE_TIMEOUT = 60
+
+    def __init__(self, base_path, shards=4, compact=False):
+        if shards <= 0:
+            raise ValueError("The number of shards should be positive")
+        if not os.path.isdir(base_path):
+            os.makedirs(base_path)
+
+        self._shards = shards
+        context = multiprocessing.get_context('spawn')
+        self._connections = list()
+        self._processes = list()
+        for i in range(shards):
+            parent_end, child_end = context.Pipe()
+            process = context.Process(
+                target=_shard_worker,
+                args=(os.path.join(base_path, 'shard_{:03d}'.format(i)), compact, child_end),
+                name='mal-analytics-shard-{}'.format(i))
+            process.daemon = True
+            process.start()
+            self._connections.append(parent_end)
+            self._processes.append(process)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def shard_count(self):
+        """Get the number of shards.
+
+        Returns:
+            An integer.
+        """
+        return self._shards
+
+    def shard_for_session(self, session):
+        """Find the shard that stores a server session.
+
+        Args:
+            session: The session identifier (a UUID string), or
+                ``None`` for objects without a session.
+
+        Returns:
+            The index of the shard.
+        """
+        if session is None:
+            return 0
+        return zlib.crc32(session.encode('utf-8')) % self._shards
+
+    def ingest(self, json_stream):
+        """Route the objects of a trace to the shards and load them.
+
+        The shards load their part of the trace in parallel.
+
+        Args:
+            json_stream: An iterable of JSON objects (dictionaries).
+
+        Returns:
+            A list with the number of objects loaded by every shard.
+
+        Raises:
+            :class:`mal_analytics.exceptions.ShardError`: if any shard
+                fails.
+        """
+        parts = [list() for _ in self._connections]
+        for obj in json_stream:
+            parts[self.shard_for_session(obj.get('session'))].append(obj)
+
+        return self._fan_out([('ingest', (p,)) if p else None for p in parts], 0)
+
+    def query_all(self, query, params=None):
+        """Run a query on every shard.
+
+        Args:
+            query: The text of the query.
+            params: The parameters of the query.
+
+        Returns:
+            A list with the results of every shard, as returned by
+            :meth:`mal_analytics.db_manager.DatabaseManager.execute_query`.
+        """
+        return self._fan_out([('query', (query, params))] * len(self._connections))
+
+    def aggregate(self, query, params=None, keys=(), aggregates=None):
+        """Run an aggregation query on every shard and merge the results.
+
+        The query should compute partial aggregates, grouped by the
+        ``keys`` columns. Averages should be computed from merged sums
+        and counts.
+
+        Args:
+            query: The text of the query.
+            params: The parameters of the query.
+            keys: The names of the grouping columns.
+            aggregates: A dictionary with keys the names of the
+                aggregate columns and values one of ``sum``, ``count``,
+                ``min`` and ``max``.
+
+        Returns:
+            See :func:`merge_aggregates`.
+        """
+        return merge_aggregates(self.query_all(query, params), keys, aggregates)
+
+    def top_k(self, query, column, k=10, params=None, descending=True):
+        """Find the rows of a query with the largest (or smallest) values
+        in a column across all shards.
+
+        Every shard returns its own top ``k`` rows, which are then
+        merged.
+
+        Args:
+            query: The text of the query. It must not contain an
+                ``ORDER BY`` clause.
+            column: The name of the column to order by.
+            k: The number of rows to return.
+            params: The parameters of the query.
+            descending: Return the largest values if ``True``, the
+                smallest otherwise.
+
+        Returns:
+            See :func:`merge_top_k`.
+        """
+        shard_query = "SELECT * FROM ({}) AS t WHERE {} IS NOT NULL ORDER BY {} {} LIMIT {}".format(
+            query, column, column, 'DESC' if descending else 'ASC', int(k))
+
+        return merge_top_k(self.query_all(shard_query, params), column, k, descending)
+
+    def close(self):
+        """Load any pending data and stop the worker processes.
+
+        A worker that has not stopped within :attr:`CLOSE_TIMEOUT`
+        seconds is terminated.
+        """
+        if not self._connections:
+            return
+        try:
+            self._fan_out([('close', ())] * len(self._connections))
+        finally:
+            for i, (connection, process) in enumerate(zip(self._connections, self._processes)):
+                process.join(self.CLOSE_TIMEOUT)
+                if process.is_alive():
+                    LOGGER.warning("Shard %d did not stop, terminating it", i)
+                    process.terminate()
+                    process.join()
+                connection.close()
+            self._connections = list()
+            self._processes = list()
+
+    def _fan_out(self, requests, default=None):
+        for connection, request in zip(self._connections, requests):
+            if request is not None:
+                connection.send(request)
+
+        replies = list()
+        errors = list()
+        for i, (connection, request) in enumerate(zip(self._connections, requests)):
+            if request is None:
+                replies.append(default)
+                continue
+            status, value = connection.recv()
+            if status != 'ok':
+                errors.append("shard {}: {}".format(i, value))
+            replies.append(value)
+
+        if errors:
+            raise ShardError("; ".join(errors))
+        return replies
@@ -0,0 +1,316 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Load the trace files dropped in a spool directory.
+
+Collectors move finished traces into the spool directory. A
+:class:`SpoolWatcher` claims them by renaming them into the
+``processing`` subdirectory, so that a file is loaded only once even if
+several watchers share the spool, and loads many of them in a single
+transaction (see :meth:`mal_analytics.db_manager.DatabaseManager.bulk_load`).
+Loaded files are moved to the ``done`` subdirectory and files that
+could not be loaded to the ``failed`` subdirectory, next to a
+``<name>.error`` file with the reason. Files left in ``processing`` by
+a watcher that was killed are returned to the spool by
+:meth:`SpoolWatcher.recover` (``mal-analytics spool --recover``), which
+should only be used when no other watcher is running.
+
+Collectors should write a trace elsewhere on the same file system and
+rename it into the spool when it is complete. Files whose name starts
+with a dot are ignored, and other files are only claimed once they have
+not been modified for ``settle`` seconds.
+
+On Linux the watcher sleeps until a file is added, using inotify. Other
+systems poll the directory.
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import logging
+import os
+import select
+import time
+
+from mal_analytics.trace_reader import TRACE_PATTERNS
+from mal_analytics.trace_reader import read_trace
+
+LOGGER = logging.getLogger(__name__)
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+
+class _Inotify(object):
+    """Wait for files to be added to a directory using inotify."""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self._fd, directory.encode(), _IN_CLOSE_WRITE | _IN_MOVED_TO) < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if readable:
+            # Only the wake up matters, the directory is scanned anyway.
+            try:
+                while os.read(self._fd, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        os.close(self._fd)
+
+
+class SpoolWatcher(object):
+    """Load the traces of a spool directory in batches.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        directory: The spool directory.
+        done_dir: Where loaded files are moved. Defaults to
+            ``<directory>/done``.
+        failed_dir: Where files that could not be loaded are moved.
+            Defaults to ``<directory>/failed``.
+        batch_files: The maximum number of files loaded in one
+            transaction.
+        batch_bytes: The maximum total size of the files loaded in one
+            transaction. A larger file is loaded on its own.
+        settle: The time in seconds a file should stay unmodified
+            before it is claimed.
+        poll: The time in seconds between two scans of the directory,
+            if inotify is not available.
+        compact: Do not store the start events of completed
+            instructions.
+        memory_budget: The memory budget of the parser in bytes (see
+            :class:`mal_analytics.profiler_parser.ProfilerObjectParser`).
+        patterns: The glob patterns of the trace files.
+        use_inotify: Use inotify if it is available.
+        metrics: An :class:`mal_analytics.metrics.IngestMetrics` object
+            that records the batches, or ``None``.
+    """
+
+    def __init__(self, dbm, directory, done_dir=None, failed_dir=None, batch_files=100,
+                 batch_bytes=256 * 1024 * 1024, settle=1.0, poll=5.0, compact=False,
+                 memory_budget=None, patterns=TRACE_PATTERNS, use_inotify=True, metrics=None):
+        self._dbm = dbm
+        self._directory = directory
+        self._processing_dir = os.path.join(directory, 'processing')
+        self._done_dir = done_dir or os.path.join(directory, 'done')
+        self._failed_dir = failed_dir or os.path.join(directory, 'failed')
+        self._batch_files = batch_files
+        self._batch_bytes = batch_bytes
+        self._settle = settle
+        self._poll = poll
+        self._compact = compact
+        self._memory_budget = memory_budget
+        self._patterns = patterns
+        self._metrics = metrics
+
+        for d in [self._processing_dir, self._done_dir, self._failed_dir]:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify(directory)
+            except (OSError, AttributeError, TypeError) as e:
+                LOGGER.info("inotify is not available, polling %s: %s", directory, e)
+
+    def close(self):
+        """Stop watching the directory."""
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+
+    def recover(self):
+        """Return the files claimed by a watcher that did not finish.
+
+        This should only be called when no other watcher is running on
+        the same spool.
+
+        Returns:
+            The number of files returned to the spool.
+        """
+        names = os.listdir(self._processing_dir)
+        for name in names:
+            LOGGER.warning("Returning %s to the spool", name)
+            os.rename(os.path.join(self._processing_dir, name), os.path.join(self._directory, name))
+        return len(names)
+
+    def scan(self, now=None):
+        """Find the files ready to be claimed.
+
+        Args:
+            now: The current time, as returned by :func:`time.time`.
+
+        Returns:
+            A tuple with a list of ``(name, size)`` tuples of the
+            files ready to be loaded, oldest first, and the number of
+            files that are still being written.
+        """
+        if now is None:
+            now = time.time()
+        ready = list()
+        unsettled = 0
+        for entry in os.scandir(self._directory):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            if not any([fnmatch.fnmatch(entry.name, p) for p in self._patterns]):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime < self._settle:
+                unsettled += 1
+            else:
+                ready.append((st.st_mtime, entry.name, st.st_size))
+
+        ready.sort()
+        return [(name, size) for _, name, size in ready], unsettled
+
+    def claim(self, names):
+        """Move files to the processing directory.
+
+        Args:
+            names: The names of the files in the spool directory.
+
+        Returns:
+            The paths of the claimed files. Files claimed by another
+            watcher in the meantime are skipped.
+        """
+        claimed = list()
+        for name in names:
+            path = os.path.join(self._processing_dir, name)
+            try:
+                os.rename(os.path.join(self._directory, name), path)
+            except FileNotFoundError:
+                continue
+            claimed.append(path)
+        return claimed
+
+    def process_batch(self):
+        """Claim and load one batch of files.
+
+        Returns:
+            The number of files claimed.
+        """
+        ready, _ = self.scan()
+        if self._metrics is not None:
+            self._metrics.set_queue_depth(len(ready))
+
+        names = list()
+        size = 0
+        for name, file_size in ready:
+            if names and (len(names) >= self._batch_files or size + file_size > self._batch_bytes):
+                break
+            names.append(name)
+            size += file_size
+
+        claimed = self.claim(names)
+        if claimed:
+            self.load_files(claimed)
+        return len(claimed)
+
+    def load_files(self, paths):
+        """Load claimed files in one transaction and move them.
+
+        If the transaction fails the files are loaded one by one, so
+        that only the files that cause the failure are moved to the
+        failed directory.
+
+        Args:
+            paths: The paths of the files.
+        """
+        traces = list()
+        for path in paths:
+            try:
+                traces.append((path, read_trace(path)))
+            except (ValueError, OSError, EOFError) as e:
+                self._fail(path, e)
+
+        if not traces:
+            return
+        try:
+            self._load(traces)
+        except Exception as e:
+            if len(traces) == 1:
+                self._fail(traces[0][0], e)
+                return
+            LOGGER.warning("Loading a batch of %d files failed, loading them one by one: %s",
+                           len(traces), e)
+            for trace in traces:
+                try:
+                    self._load([trace])
+                except Exception as e:
+                    self._fail(trace[0], e)
+                else:
+                    self._move(trace[0], self._done_dir)
+            return
+
+        for path, _ in traces:
+            self._move(path, self._done_dir)
+
+    def run(self, should_stop=None, recover=False):
+        """Load the files of the spool until told to stop.
+
+        Args:
+            should_stop: A function called after every batch and every
+                wait. The watcher stops when it returns ``True``.
+            recover: Call :meth:`recover` first. Files being loaded by
+                other watchers of the spool would be loaded twice, so
+                this is only safe for a single watcher.
+        """
+        if recover:
+            self.recover()
+        while should_stop is None or not should_stop():
+            if self.process_batch():
+                continue
+
+            _, unsettled = self.scan()
+            timeout = min(self._poll, self._settle) if unsettled else self._poll
+            if self._inotify is not None:
+                self._inotify.wait(timeout)
+            else:
+                time.sleep(timeout)
+
+    def _load(self, traces):
+        start_time = time.perf_counter()
+        pob = self._dbm.create_parser(self._compact, self._memory_budget)
+        loaded = self._dbm.bulk_load(pob, [objects for _, objects in traces])
+        LOGGER.info("Loaded %d files (%d objects)", len(traces), loaded)
+        if self._metrics is not None:
+            events = sum([sum([1 for o in objects if o.get('source') == 'trace'])
+                          for _, objects in traces])
+            self._metrics.record_batch(loaded, events, time.perf_counter() - start_time,
+                                       pob.get_newest_time())
+
+    def _fail(self, path, error):
+        LOGGER.error("Cannot load %s: %s", path, error)
+        if self._metrics is not None:
+            self._metrics.record_failure()
+        target = self._move(path, self._failed_dir)
+        with open(target + '.error', 'w') as fl:
+            fl.write("{}: {}\n".format(type(error).__name__, error))
+
+    def _move(self, path, directory):
+        name = os.path.basename(path)
+        target = os.path.join(directory, name)
+        count = 0
+        while os.path.exists(target):
+            count += 1
+            target = os.path.join(directory, '{}.{}'.format(name, count))
+        os.rename(path, target)
+        return target
@@ -0,0 +1,179 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Counters and stage timers for trace ingestion.
+
+:func:`mal_analytics.trace_reader.read_trace`,
+:class:`mal_analytics.profiler_parser.ProfilerObjectParser` and
+:class:`mal_analytics.db_manager.DatabaseManager` record what they do
+in an :class:`IngestStats` object. Collection is disabled by default:
+the components then share :data:`NULL_STATS`, whose methods do
+nothing. It is enabled by the ``collect_stats`` argument of
+``DatabaseManager`` or by setting the environment variable
+``MAL_ANALYTICS_STATS`` to ``1``.
+
+Counters are updated once per call, not once per object, so the
+overhead is small even when collection is enabled.
+"""
+
+import collections
+import json
+import logging
+import os
+import time
+
+LOGGER = logging.getLogger(__name__)
+
+ENVIRONMENT_VARIABLE = 'MAL_ANALYTICS_STATS'
+
+
+class _Timer(object):
+    def __init__(self, stats, name):
+        self._stats = stats
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.add_time(self._name, time.perf_counter() - self._start)
+
+
+class _NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class IngestStats(object):
+    """Named counters and accumulated stage times.
+
+    The following names are used:
+
+    * counters: ``bytes_read``, ``objects_decoded``, ``objects_parsed``,
+      ``events_parsed``, ``events_skipped``, ``variables_parsed``,
+      ``heartbeats_parsed``, ``segments_spilled``, ``rows_inserted.<table>``,
+      ``insert_errors``, ``rows_rejected`` and ``quarantined.<reason>``.
+    * timers (in seconds): ``read``, ``decode``, ``parse``,
+      ``drop_constraints``, ``insert``, ``enforce_constraints``,
+      ``add_constraints`` and ``commit``.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self._counters = collections.Counter()
+        self._timers = collections.Counter()
+
+    def increment(self, name, value=1):
+        """Add to a counter.
+
+        Args:
+            name: The name of the counter.
+            value: The amount to add.
+        """
+        self._counters[name] += value
+
+    def add_time(self, name, seconds):
+        """Add to the time of a stage.
+
+        Args:
+            name: The name of the stage.
+            seconds: The time to add.
+        """
+        self._timers[name] += seconds
+
+    def timer(self, name):
+        """Time a block of code.
+
+        Args:
+            name: The name of the stage.
+
+        Returns:
+            A context manager that adds the time spent in the block to
+            the stage.
+        """
+        return _Timer(self, name)
+
+    def get_stats(self):
+        """Get the values collected so far.
+
+        Returns:
+            A dictionary with the keys ``counters`` and ``timers``,
+            with values dictionaries keyed by name.
+        """
+        return {
+            'counters': dict(self._counters),
+            'timers': dict(self._timers),
+        }
+
+    def reset(self):
+        """Set all the counters and timers to zero."""
+        self._counters.clear()
+        self._timers.clear()
+
+    def log_summary(self, event, since=None, **fields):
+        """Log the values collected so far as one JSON object.
+
+        Args:
+            event: What the values describe, for instance ``ingest``.
+            since: The values returned by :meth:`get_stats` at the
+                start of the operation. If given, only what was
+                collected since then is logged.
+            fields: Further keys of the logged object.
+        """
+        record = dict(fields)
+        record['event'] = event
+        values = self.get_stats()
+        if since is not None:
+            values = dict([(kind, dict(collections.Counter(values[kind]) - collections.Counter(since[kind])))
+                           for kind in values])
+        record.update(values)
+        LOGGER.info("%s", json.dumps(record, sort_keys=True))
+
+
+class _NullStats(IngestStats):
+    enabled = False
+
+    def increment(self, name, value=1):
+        pass
+
+    def add_time(self, name, seconds):
+        pass
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+    def log_summary(self, event, since=None, **fields):
+        pass
+
+
+NULL_STATS = _NullStats()
+"""The shared :class:`IngestStats` object of disabled collection."""
+
+
+def create_stats(enabled=None):
+    """Create the statistics of a new component.
+
+    Args:
+        enabled: Whether to collect statistics. If ``None`` the
+            environment variable ``MAL_ANALYTICS_STATS`` decides.
+
+    Returns:
+        A new :class:`IngestStats` object, or :data:`NULL_STATS`.
+    """
+    if enabled is None:
+        enabled = os.environ.get(ENVIRONMENT_VARIABLE, '0') not in ('', '0')
+    if enabled:
+        return IngestStats()
+    return NULL_STATS
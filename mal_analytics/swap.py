@@ -0,0 +1,102 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Rebuild a trace database without blocking its readers.
+
+The new (*green*) database is built from the traces in a directory
+next to the active (*blue*) one, by a child process, since MonetDBLite
+can only run one database per process. Readers keep using the active
+database in the meantime. Once the build succeeds, the directories are
+swapped and the connection is reopened (see
+:meth:`mal_analytics.db_manager.DatabaseManager.swap_database`).
+"""
+
+import logging
+import multiprocessing
+import os
+import shutil
+
+from mal_analytics.db_manager import DatabaseManager
+from mal_analytics.scheduler import INTERACTIVE
+from mal_analytics.trace_reader import read_trace
+
+LOGGER = logging.getLogger(__name__)
+
+
+def build_database(dbpath, filenames, compact=False, partitioned=False):
+    """Build a new database from trace files.
+
+    The traces are loaded with :meth:`mal_analytics.db_manager.DatabaseManager.bulk_load`.
+    This function opens a database, so it should run in a process
+    that has not opened any other.
+
+    Args:
+        dbpath: The directory of the new database. It should not exist.
+        filenames: The paths of the trace files.
+        compact: Do not store the start events of completed
+            instructions.
+        partitioned: Create a partitioned database.
+
+    Returns:
+        The number of JSON objects loaded.
+    """
+    dbm = DatabaseManager(dbpath, partitioned=partitioned)
+    pob = dbm.create_parser(compact)
+    loaded = dbm.bulk_load(pob, (read_trace(fl) for fl in filenames))
+    dbm.close_database()
+    LOGGER.info("Built database %s with %d objects", dbpath, loaded)
+
+    return loaded
+
+
+def rebuild(dbm, filenames, compact=False, partitioned=None, scheduler=None,
+            backup_path=None):
+    """Rebuild a database from trace files and swap it in.
+
+    Args:
+        dbm: The :class:`mal_analytics.db_manager.DatabaseManager` of the
+            active database.
+        filenames: The paths of the trace files.
+        compact: Do not store the start events of completed
+            instructions.
+        partitioned: Create a partitioned database. Defaults to the
+            layout of the active database.
+        scheduler: If given, the swap is submitted to this
+            :class:`mal_analytics.scheduler.QueryScheduler`, so that it
+            happens between two requests.
+        backup_path: Where to keep the previous database. If ``None``
+            it is removed.
+
+    Returns:
+        The number of JSON objects loaded.
+    """
+    if partitioned is None:
+        partitioned = dbm.is_partitioned()
+
+    side_path = dbm.get_dbpath().rstrip(os.sep) + '.green'
+    if os.path.exists(side_path):
+        LOGGER.warning("Removing leftover database %s", side_path)
+        shutil.rmtree(side_path)
+
+    # A fresh interpreter, since MonetDBLite does not survive a fork
+    # and can only run one database per process.
+    context = multiprocessing.get_context('spawn')
+    pool = context.Pool(1)
+    try:
+        loaded = pool.apply(build_database, (side_path, list(filenames), compact, partitioned))
+    except Exception:
+        shutil.rmtree(side_path, ignore_errors=True)
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+    if scheduler is None:
+        dbm.swap_database(side_path, backup_path)
+    else:
+        scheduler.submit(dbm.swap_database, side_path, backup_path, priority=INTERACTIVE).result()
+
+    return loaded
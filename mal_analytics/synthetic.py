@@ -0,0 +1,456 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+"""Generate synthetic profiler traces for load and scaling tests.
+
+The traces have the shape of the traces emitted by the MonetDB
+profiler: every query is a root MAL execution that defines the query
+(``querylog.define``), optionally calls a chain of user defined
+functions, each one a separate execution, and optionally fans out to
+worker executions on remote servers (``remote.register_supervisor``).
+Heartbeats of every server session are interleaved with the events.
+
+The output depends only on the arguments, so the same seed always
+produces the same trace. Objects are generated lazily, so traces of
+any size can be written without holding them in memory::
+
+    python -m mal_analytics.synthetic trace.json.gz --sessions 4 --executions 1000 --compression gz
+"""
+
+import argparse
+import bz2
+import gzip
+import json
+import logging
+import random
+import uuid
+
+LOGGER = logging.getLogger(__name__)
+
+SERVER_VERSION = "11.33.0 (synthetic)"
+
+# Types of the variables of the generic instructions. Values are
+# generated for the scalar types, BAT properties for the others.
+_VARIABLE_TYPES = ['int', 'lng', 'dbl', 'str', 'oid', 'bat[:int]', 'bat[:lng]', 'bat[:oid]', 'bat[:str]', 'bat[:dbl]']
+
+# Generic instructions as (module, instruction) pairs.
+_INSTRUCTIONS = [
+    ('sql', 'bind'),
+    ('sql', 'tid'),
+    ('algebra', 'projection'),
+    ('algebra', 'select'),
+    ('algebra', 'thetaselect'),
+    ('algebra', 'join'),
+    ('bat', 'mergecand'),
+    ('batcalc', '*'),
+    ('aggr', 'sum'),
+    ('group', 'groupdone'),
+    ('mat', 'pack'),
+    ('language', 'pass'),
+]
+
+_OPEN = {
+    None: open,
+    'gz': gzip.open,
+    'bz2': bz2.open,
+}
+
+
+class _Plan(object):
+    """The state of one MAL execution while its events are generated."""
+
+    def __init__(self, session, tag, function):
+        self.session = session
+        self.tag = tag
+        self.function = function
+        self.variables = list()
+        self.pc = 0
+
+
+class TraceGenerator(object):
+    """A deterministic generator of profiler traces.
+
+    Args:
+        seed: The seed of the random number generator.
+        sessions: The number of client server sessions.
+        executions: The number of queries (root executions) per
+            session.
+        instructions: The number of instructions of every MAL plan,
+            including the function header, the query definition, the
+            function calls and the remote registrations.
+        threads: The number of worker threads of the server.
+        variables: The maximum number of arguments of every generic
+            instruction.
+        call_depth: The length of the chain of user defined functions
+            every query calls. Every function is a separate execution.
+        workers: The number of remote worker sessions every query fans
+            out to.
+        heartbeat_interval: The time in microseconds between two
+            heartbeats of a server session. If ``None`` no heartbeats
+            are generated.
+        start_time: The absolute time (``ctime``) of the first event
+            in microseconds since the epoch.
+    """
+
+    def __init__(self, seed=0, sessions=1, executions=10, instructions=50, threads=4,
+                 variables=3, call_depth=0, workers=0, heartbeat_interval=None,
+                 start_time=1546300800000000):
+        if sessions <= 0 or executions < 0 or threads <= 0 or variables < 0:
+            raise ValueError("Invalid trace dimensions")
+        if instructions < 2 + min(call_depth, 1) + workers:
+            raise ValueError("{} instructions per plan are too few for the calls and the workers".format(instructions))
+        if call_depth < 0 or workers < 0:
+            raise ValueError("call_depth and workers should not be negative")
+
+        self._seed = seed
+        self._sessions = sessions
+        self._executions = executions
+        self._instructions = instructions
+        self._threads = threads
+        self._variables = variables
+        self._call_depth = call_depth
+        self._workers = workers
+        self._heartbeat_interval = heartbeat_interval
+        self._start_time = start_time
+
+    def expected_counts(self):
+        """Get the number of rows the trace produces in the main tables.
+
+        Returns:
+            A dictionary with keys ``mal_execution``, ``query``,
+            ``initiates_executions``, ``profiler_event`` and
+            ``instruction_run``.
+        """
+        queries = self._sessions * self._executions
+        executions = queries * (1 + self._call_depth + self._workers)
+        return {
+            'mal_execution': executions,
+            'query': queries,
+            'initiates_executions': executions,
+            'profiler_event': 2 * executions * self._instructions,
+            'instruction_run': executions * self._instructions,
+        }
+
+    def __iter__(self):
+        return self.objects()
+
+    def objects(self):
+        """Generate the JSON objects of the trace.
+
+        Yields:
+            Dictionaries, in the order they appear in the trace.
+        """
+        self._rng = random.Random(self._seed)
+        self._clock = 0
+        self._rss = 100
+        self._bid = 0
+        self._tags = dict()
+
+        self._client_sessions = [self._new_uuid() for _ in range(self._sessions)]
+        self._worker_sessions = [self._new_uuid() for _ in range(self._workers)]
+        self._next_heartbeat = self._heartbeat_interval
+
+        for query in range(self._executions):
+            for session in self._client_sessions:
+                for obj in self._root_execution(session, query):
+                    yield obj
+
+    def write(self, fl):
+        """Write the trace to a text file, one object per line.
+
+        Args:
+            fl: A file object opened for writing text.
+
+        Returns:
+            The number of objects written.
+        """
+        count = 0
+        for obj in self.objects():
+            fl.write(json.dumps(obj, sort_keys=True, separators=(',', ':')))
+            fl.write('\n')
+            count += 1
+        return count
+
+    def write_trace(self, filename, compression=None):
+        """Write the trace to a file.
+
+        Args:
+            filename: The path of the file.
+            compression: ``None``, ``gz`` or ``bz2``.
+
+        Returns:
+            The number of objects written.
+        """
+        if compression not in _OPEN:
+            raise ValueError("Unknown compression {}".format(compression))
+        with _OPEN[compression](filename, 'wt') as fl:
+            count = self.write(fl)
+        LOGGER.info("Wrote %d objects to %s", count, filename)
+        return count
+
+    def _new_uuid(self):
+        return str(uuid.UUID(int=self._rng.getrandbits(128), version=4))
+
+    def _new_plan(self, session, function):
+        tag = self._tags.get(session, 0) + 1
+        self._tags[session] = tag
+        return _Plan(session, tag, function)
+
+    def _heartbeats(self):
+        if self._heartbeat_interval is None:
+            return
+        while self._next_heartbeat <= self._clock:
+            for session in self._client_sessions + self._worker_sessions:
+                yield {
+                    'source': 'heartbeat',
+                    'session': session,
+                    'clk': self._next_heartbeat,
+                    'ctime': self._start_time + self._next_heartbeat,
+                    'rss': self._rss,
+                    'nvcsw': self._rng.randint(0, 50),
+                    'state': 'ping',
+                    'cpuload': [round(self._rng.random(), 2) for _ in range(self._threads)],
+                }
+            self._next_heartbeat += self._heartbeat_interval
+
+    def _variable(self, plan, index, type_name=None, value=None):
+        name = 'X_{}'.format(len(plan.variables) + 1)
+        if type_name is None:
+            type_name = self._rng.choice(_VARIABLE_TYPES)
+        var = {'index': index, 'name': name, 'type': type_name, 'eol': 0}
+        if type_name.startswith('bat'):
+            self._bid += 1
+            count = self._rng.randint(0, 1000000)
+            var.update({
+                'bid': self._bid,
+                'count': count,
+                'size': count * 8,
+                'kind': 'transient',
+            })
+        elif value is not None:
+            var['value'] = value
+        else:
+            var['value'] = str(self._rng.randint(0, 1000))
+        plan.variables.append((var, plan.pc))
+        return var
+
+    def _events(self, plan, module, instruction, short, stmt, ret, args, prereq):
+        """Generate the start and done events of an instruction, with
+        the events of any nested execution in between."""
+        pc = plan.pc
+        plan.pc += 1
+        thread = 0 if pc == 0 else self._rng.randrange(self._threads)
+        common = {
+            'version': SERVER_VERSION,
+            'source': 'trace',
+            'thread': thread,
+            'function': 'user.{}'.format(plan.function),
+            'pc': pc,
+            'tag': plan.tag,
+            'module': module,
+            'instruction': instruction,
+            'session': plan.session,
+            'size': 0,
+            'stmt': stmt,
+            'short': short,
+            'prereq': prereq,
+            'ret': ret,
+            'arg': args,
+        }
+
+        for obj in self._heartbeats():
+            yield obj
+        start = dict(common)
+        start.update({
+            'clk': self._clock,
+            'ctime': self._start_time + self._clock,
+            'state': 'start',
+            'usec': 0,
+            'rss': self._rss,
+            'nvcsw': self._rng.randint(0, 10),
+        })
+        yield start
+
+        # The caller generates the nested executions here
+        yield None
+
+        usec = self._rng.randint(1, 2000)
+        self._clock += usec
+        self._rss = max(self._rss + self._rng.randint(-2, 2), 1)
+        for obj in self._heartbeats():
+            yield obj
+        done = dict(common)
+        done.update({
+            'clk': self._clock,
+            'ctime': self._start_time + self._clock,
+            'state': 'done',
+            'usec': usec,
+            'rss': self._rss,
+        })
+        yield done
+
+    def _instruction(self, plan, module, instruction, short, stmt, ret, args, prereq, nested=None):
+        for obj in self._events(plan, module, instruction, short, stmt, ret, args, prereq):
+            if obj is not None:
+                yield obj
+            elif nested is not None:
+                for nested_obj in nested:
+                    yield nested_obj
+
+    def _header(self, plan, body):
+        """Generate the function header, whose done event is the last
+        event of the execution, around the body."""
+        ret = [{'index': 0, 'name': plan.function, 'type': 'void', 'value': '0@0', 'eol': 0}]
+        return self._instruction(
+            plan, 'user', plan.function,
+            'function user.{}( )'.format(plan.function),
+            'function user.{}():void;'.format(plan.function),
+            ret, [], [], body)
+
+    def _generic(self, plan):
+        module, instruction = self._rng.choice(_INSTRUCTIONS)
+        args = list()
+        prereq = set()
+        for i in range(self._rng.randint(0, self._variables)):
+            if not plan.variables:
+                break
+            var, pc = self._rng.choice(plan.variables)
+            arg = dict(var)
+            arg['index'] = i + 1
+            args.append(arg)
+            prereq.add(pc)
+
+        ret = [self._variable(plan, 0)]
+        names = ', '.join([a['name'] for a in args])
+        return self._instruction(
+            plan, module, instruction,
+            '{}[{}]:= {}( {} )'.format(ret[0]['name'], ret[0].get('count', 0), instruction, names),
+            '{}:{} := {}.{}({});'.format(ret[0]['name'], ret[0]['type'], module, instruction, names),
+            ret, args, sorted(prereq))
+
+    def _define(self, plan, query):
+        text = '"select count(*) from t{} where c{} > {};"'.format(
+            query % 97, self._rng.randint(1, 20), self._rng.randint(0, 100000))
+        ret = [self._variable(plan, 0, 'void', '0@0')]
+        args = [
+            self._variable(plan, 1, 'str', text),
+            self._variable(plan, 2, 'str', '"default_pipe"'),
+            self._variable(plan, 3, 'int', str(self._rng.randint(1, 100))),
+        ]
+        return self._instruction(
+            plan, 'querylog', 'define',
+            'define( {}, "default_pipe", {} )'.format(text, args[2]['value']),
+            '{}=0@0:void := querylog.define({}:str, "default_pipe":str, {}:int);'.format(
+                ret[0]['name'], text, args[2]['value']),
+            ret, args, [])
+
+    def _register_supervisor(self, plan, supervisor_session, worker_uuid, nested=None):
+        ret = [self._variable(plan, 0, 'int', '5')]
+        args = [
+            self._variable(plan, 1, 'str', '"{}"'.format(supervisor_session)),
+            self._variable(plan, 2, 'str', '"{}"'.format(worker_uuid)),
+        ]
+        return self._instruction(
+            plan, 'remote', 'register_supervisor',
+            '{}=5 := register_supervisor( {}, {} )'.format(ret[0]['name'], args[0]['value'], args[1]['value']),
+            '{}=5:int := remote.register_supervisor({}:str, {}:str);'.format(
+                ret[0]['name'], args[0]['value'], args[1]['value']),
+            ret, args, [], nested)
+
+    def _body(self, plan, specials):
+        """Generate the rest of a plan: the special instructions at
+        random positions among the generic ones."""
+        remaining = self._instructions - plan.pc
+        positions = set(self._rng.sample(range(remaining), len(specials)))
+        specials = list(specials)
+        for i in range(remaining):
+            if i in positions:
+                for obj in specials.pop(0)():
+                    yield obj
+            else:
+                for obj in self._generic(plan):
+                    yield obj
+
+    def _root_execution(self, session, query):
+        plan = self._new_plan(session, 's{}_1'.format(query % 100))
+        specials = list()
+        if self._call_depth > 0:
+            specials.append(lambda: self._call(plan, 1))
+        for worker in self._worker_sessions:
+            specials.append(self._remote_call(plan, worker))
+
+        def body():
+            for obj in self._define(plan, query):
+                yield obj
+            for obj in self._body(plan, specials):
+                yield obj
+
+        for obj in self._header(plan, body()):
+            yield obj
+
+    def _remote_call(self, plan, worker_session):
+        def generate():
+            worker_uuid = self._new_uuid()
+            worker = self._new_plan(worker_session, 'main')
+
+            def worker_body():
+                for obj in self._register_supervisor(worker, plan.session, worker_uuid):
+                    yield obj
+                for obj in self._body(worker, []):
+                    yield obj
+
+            def worker_execution():
+                for obj in self._header(worker, worker_body()):
+                    yield obj
+
+            # The worker runs while the supervisor waits for it
+            return self._register_supervisor(plan, plan.session, worker_uuid, worker_execution())
+        return generate
+
+    def _call(self, plan, depth):
+        function = 'f{}'.format(depth)
+        callee = self._new_plan(plan.session, function)
+
+        def callee_execution():
+            specials = list()
+            if depth < self._call_depth:
+                specials.append(lambda: self._call(callee, depth + 1))
+            for obj in self._header(callee, self._body(callee, specials)):
+                yield obj
+
+        ret = [self._variable(plan, 0, 'bat[:int]')]
+        return self._instruction(
+            plan, 'user', function,
+            '{}[{}]:= {}( )'.format(ret[0]['name'], ret[0]['count'], function),
+            '{}:bat[:int] := user.{}();'.format(ret[0]['name'], function),
+            ret, [], [], callee_execution())
+
+
+def main(argv=None):  # pragma: no coverage
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output', help='The trace file to write')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--sessions', type=int, default=1, help='Number of client sessions')
+    parser.add_argument('--executions', type=int, default=10, help='Queries per session')
+    parser.add_argument('--instructions', type=int, default=50, help='Instructions per MAL plan')
+    parser.add_argument('--threads', type=int, default=4, help='Number of server threads')
+    parser.add_argument('--variables', type=int, default=3, help='Maximum arguments per instruction')
+    parser.add_argument('--call-depth', type=int, default=0, help='Depth of user defined function calls')
+    parser.add_argument('--workers', type=int, default=0, help='Remote workers per query')
+    parser.add_argument('--heartbeat-interval', type=int, default=None,
+                        help='Microseconds between heartbeats')
+    parser.add_argument('--compression', choices=['gz', 'bz2'], default=None)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    generator = TraceGenerator(args.seed, args.sessions, args.executions, args.instructions,
+                               args.threads, args.variables, args.call_depth, args.workers,
+                               args.heartbeat_interval)
+    generator.write_trace(args.output, args.compression)
+
+
+if __name__ == '__main__':  # pragma: no coverage
+    main()
@@ -7,14 +7,25 @@
 import binascii
 import bz2
 import gzip
+import io
 import json
 import logging
+import os
+import time
 
 from mal_analytics.db_manager import DatabaseManager
-from mal_analytics import exceptions
+from mal_analytics.profiling import profile_ingest
+from mal_analytics.progress import ProgressTracker
+from mal_analytics.progress import REPORT_EVERY
+from mal_analytics.quarantine import decode_objects
+from mal_analytics.stats import NULL_STATS
 
 LOGGER = logging.getLogger(__name__)
 
+# The names of trace files, for the commands that look for traces in
+# directories.
+TRACE_PATTERNS = ('*.json', '*.json.gz', '*.json.bz2')
+
 
 def is_gzip(filename):
     """Checks the if the first two bytes of the file match the gzip magic number"""
@@ -43,6 +54,31 @@ def abstract_open(filename):
     return open(filename, 'r')
 
 
+def _open_binary(filename):
+    """Open a possibly compressed file in binary mode.
+
+    Returns:
+        The uncompressed stream and the underlying file, whose position
+        is the number of (compressed) bytes consumed.
+    """
+    raw = open(filename, 'rb')
+    if is_gzip(filename):
+        binary = gzip.GzipFile(fileobj=raw)
+    elif is_bzip2(filename):
+        binary = bz2.BZ2File(raw)
+    else:
+        binary = raw
+    return binary, raw
+
+
+def _open_with_position(filename):
+    """Like :func:`abstract_open`, but also return the underlying binary
+    file, whose position is the number of (compressed) bytes consumed.
+    """
+    binary, raw = _open_binary(filename)
+    return io.TextIOWrapper(binary, encoding='utf-8'), raw
+
+
 def read_object(fl):
     buf = []
     for ln in fl:
@@ -52,33 +88,276 @@ def read_object(fl):
             return json_string
             # print(json_string)
 
-def parse_trace(filename, database_path):  # pragma: no coverage
-    dbm = DatabaseManager(database_path)
-    pob = dbm.create_parser()
 
-    with abstract_open(filename) as fl:
+class ObjectSplitter(object):
+    """Split a stream of bytes into the JSON objects of a trace.
+
+    This is the incremental version of :func:`read_object`: an object
+    ends at the first line ending with ``}``. Data can be fed in pieces
+    of any size.
+
+    Args:
+        resync: The stream may start in the middle of an object. The
+            lines before the first one starting with ``{`` are skipped.
+    """
+
+    def __init__(self, resync=False):
+        self._partial_line = b''
+        self._lines = list()
+        self._resync = resync
+
+    def feed(self, data):
+        """Add data to the splitter.
+
+        Args:
+            data: A bytes or a string object.
+
+        Returns:
+            A list with the JSON strings completed by ``data``.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        objects = list()
+        lines = (self._partial_line + data).split(b'\n')
+        self._partial_line = lines.pop()
+        for ln in lines:
+            ln = ln.decode('utf-8', 'replace' if self._resync else 'strict')
+            if self._resync:
+                if not ln.startswith('{'):
+                    continue
+                self._resync = False
+            self._lines.append(ln)
+            if ln.rstrip('\r').endswith('}'):
+                objects.append('\n'.join(self._lines).strip())
+                self._lines = list()
+
+        return objects
+
+    def close(self):
+        """Get the last object, if the stream does not end with a newline.
+
+        Returns:
+            A list with zero or one JSON strings.
+        """
+        objects = self.feed(b'\n') if self._partial_line else list()
+        if self._lines and ''.join(self._lines).strip():
+            LOGGER.warning("Ignoring incomplete object at the end of the trace")
+        self._lines = list()
+        return objects
+
+
+def read_trace(filename, stats=NULL_STATS, progress=None, quarantine=None):
+    """Read all the JSON objects of a trace file.
+
+    Args:
+        filename: The path of the file. It may be compressed with gzip
+            or bzip2.
+        stats: An :class:`mal_analytics.stats.IngestStats` object that
+            records the bytes read, the objects decoded and the time
+            spent reading and decoding.
+        progress: A :class:`mal_analytics.progress.ProgressTracker`.
+        quarantine: A :class:`mal_analytics.quarantine.Quarantine`. If
+            given, invalid JSON objects are quarantined instead of
+            raising an exception, and the quarantine is set up for the
+            objects rejected by the parser.
+
+    Returns:
+        A list of dictionaries.
+    """
+    start = time.perf_counter()
+    decode_time = 0
+    if progress is not None:
+        progress.start_phase('read')
+    if quarantine is not None:
+        binary, raw = _open_binary(filename)
+        with raw, binary:
+            json_stream, _ = decode_objects(binary, quarantine, filename, progress, raw)
+        stats.add_time('read', time.perf_counter() - start)
+        stats.increment('bytes_read', os.path.getsize(filename))
+        stats.increment('objects_decoded', len(json_stream))
+        return json_stream
+
+    fl, raw = _open_with_position(filename)
+    with raw, fl:
         LOGGER.debug("Parsing trace from file %s", filename)
 
         json_stream = list()
         json_string = read_object(fl)
         while json_string:
             try:
-                json_stream.append(json.loads(json_string))
+                if stats.enabled:
+                    decode_start = time.perf_counter()
+                    json_stream.append(json.loads(json_string))
+                    decode_time += time.perf_counter() - decode_start
+                else:
+                    json_stream.append(json.loads(json_string))
             except Exception as e:
                 LOGGER.error("JSON parser failed for file %s:\n %s", filename, e)
                 raise
+            if progress is not None and len(json_stream) % REPORT_EVERY == 0:
+                progress.advance(REPORT_EVERY, raw.tell())
             json_string = read_object(fl)
 
+    stats.add_time('read', time.perf_counter() - start - decode_time)
+    stats.add_time('decode', decode_time)
+    stats.increment('bytes_read', os.path.getsize(filename))
+    stats.increment('objects_decoded', len(json_stream))
+    return json_stream
+
+
+def read_stream(fl, compression='auto', quarantine=None):
+    """Read all the JSON objects of a trace from a binary stream.
+
+    Args:
+        fl: A binary file object, for instance ``sys.stdin.buffer``.
+        compression: ``'gz'``, ``'bz2'``, ``None`` for uncompressed
+            data, or ``'auto'`` to detect the compression from the
+            first bytes.
+        quarantine: A :class:`mal_analytics.quarantine.Quarantine` for
+            the invalid objects (see :func:`read_trace`).
+
+    Returns:
+        A list of dictionaries.
+    """
+    data = fl.read()
+    if compression == 'auto':
+        if data[:2] == b'\x1f\x8b':
+            compression = 'gz'
+        elif data[:2] == b'BZ':
+            compression = 'bz2'
+        else:
+            compression = None
+    if compression == 'gz':
+        data = gzip.decompress(data)
+    elif compression == 'bz2':
+        data = bz2.decompress(data)
+
+    if quarantine is not None:
+        return decode_objects(io.BytesIO(data), quarantine, '<stdin>')[0]
+
+    splitter = ObjectSplitter()
+    return [json.loads(s) for s in splitter.feed(data) + splitter.close()]
+
+
+def follow_trace(dbm, fl, batch_objects=20000, interval=1.0, poll=0.5, stop_at_eof=False,
+                 should_stop=None, compact=False, metrics=None, resync=False):
+    """Load a trace while it is being written, like ``tail -f``.
+
+    The objects are loaded in batches, when ``batch_objects`` objects
+    have been read or ``interval`` seconds after the previous load,
+    using a single parser so that instructions can span batches.
+
+    Args:
+        dbm: A :class:`mal_analytics.db_manager.DatabaseManager`.
+        fl: A binary file object, the trace file or a pipe.
+        batch_objects: The number of JSON objects that triggers a load.
+        interval: The maximum time in seconds between two loads.
+        poll: The time in seconds to wait for new data at the end of
+            the file.
+        stop_at_eof: Stop at the end of the file instead of waiting
+            for more data. Use this for pipes.
+        should_stop: A function called in every iteration. Following
+            stops when it returns ``True``.
+        compact: Do not store the start events of completed
+            instructions.
+        metrics: An :class:`mal_analytics.metrics.IngestMetrics` object
+            that records the batches, or ``None``.
+        resync: The file position may be in the middle of an object,
+            for example after seeking to the end of the file. The data
+            up to the first line starting with ``{`` is skipped, and so
+            is the first object if it is not valid JSON.
+
+    Returns:
+        The number of JSON objects loaded.
+    """
+    read = getattr(fl, 'read1', fl.read)
+    pob = dbm.create_parser(compact)
+    splitter = ObjectSplitter(resync)
+    pending = list()
+    loaded = 0
+    last_load = time.monotonic()
+
+    def decode(json_strings):
+        nonlocal resync
+        if resync and json_strings:
+            resync = False
+            try:
+                json.loads(json_strings[0])
+            except ValueError as e:
+                LOGGER.warning("Skipping the incomplete object at the start of the trace: %s", e)
+                json_strings = json_strings[1:]
+        return [json.loads(s) for s in json_strings]
+
+    def load(final):
+        start_time = time.perf_counter()
+        events = sum([1 for o in pending if o.get('source') == 'trace'])
+        pob.parse_trace_stream(pending)
+        if final:
+            pob.flush_pending_events()
+        rejected = dbm.load_parsed_data(pob)
+        if metrics is not None:
+            metrics.record_batch(len(pending), events, time.perf_counter() - start_time,
+                                 pob.get_newest_time(), rejected)
+        LOGGER.debug("Loaded %d objects", len(pending))
+        return len(pending)
+
+    while True:
+        data = read(65536)
+        if data:
+            pending.extend(decode(splitter.feed(data)))
+        elif stop_at_eof:
+            break
+
+        now = time.monotonic()
+        if pending and (len(pending) >= batch_objects or now - last_load >= interval):
+            loaded += load(False)
+            pending = list()
+            last_load = now
+
+        if should_stop is not None and should_stop():
+            break
+        if not data:
+            time.sleep(poll)
+
+    pending.extend(decode(splitter.close()))
+    loaded += load(True)
+    return loaded
+
+
+def parse_trace(filename, database_path, compact=False, progress=None, profile=None,
+                quarantine=None):  # pragma: no coverage
+    """Load a trace file into a database.
+
+    Args:
+        filename: The path of the trace. It may be compressed with
+            gzip or bzip2.
+        database_path: The database directory.
+        compact: Do not store the start events of completed
+            instructions.
+        progress: A function called with a
+            :class:`mal_analytics.progress.ProgressReport` while the
+            trace is loaded.
+        profile: Profile the ingest (see
+            :func:`mal_analytics.profiling.profile_directory`).
+        quarantine: A :class:`mal_analytics.quarantine.Quarantine`. If
+            given, invalid objects are quarantined instead of aborting
+            the ingest.
+    """
+    tracker = None
+    if progress is not None:
+        tracker = ProgressTracker(progress, os.path.getsize(filename))
+
+    with DatabaseManager(database_path) as dbm, profile_ingest(database_path, filename, profile):
+        pob = dbm.create_parser(compact, quarantine=quarantine)
+        stats = dbm.get_stats_collector()
+        start_stats = stats.get_stats()
 
-    pob.parse_trace_stream(json_stream)
-    dbm.transaction()
-    try:
-        dbm.drop_constraints()
-        for table, data in pob.get_data().items():
-            dbm.insert_data(table, data)
-        dbm.add_constraints()
-    except exceptions.AnalyticsException as e:
-        LOGGER.error(e)
-        dbm.rollback()
-    dbm.commit()
-    pob.clear_internal_state()
+        json_stream = read_trace(filename, stats, tracker, quarantine)
+        pob.parse_trace_stream(json_stream, tracker)
+        pob.flush_pending_events()
+        dbm.load_parsed_data(pob, tracker)
+        if tracker is not None:
+            tracker.finish()
+        stats.log_summary('ingest', start_stats, database=database_path, trace=filename,
+                          objects=len(json_stream))
@@ -21,6 +21,11 @@ setup(
     setup_requires=['pytest-runner'],
     tests_require=['pytest'],
     include_package_data=True,
+    entry_points={
+        'console_scripts': [
+            'mal-analytics=mal_analytics.cli:main',
+        ],
+    },
     author="Panagiotis Koutsourakis",
     author_email="panagiotis.koutsourakis@monetdbsolutions.com",
     url="https://github.com/MonetDBSolutions/mal_analytics",
@@ -54,13 +54,18 @@ def manager_object(tmp_path):
     db_path = tmp_path.resolve().as_posix()
     manager = db_manager.DatabaseManager(db_path)
 
-    # We got the singleton but we really want a fresh object. Make it so.
-    if manager.get_dbpath() != db_path:
-        manager.close_connection()
-        manager.__class__._instances = {}
-        manager = db_manager.DatabaseManager(db_path)
+    yield manager
 
-    return manager
+    manager.close_database()
+
+@pytest.fixture(scope='function')
+def partitioned_manager(tmp_path):
+    db_path = (tmp_path / 'partitioned').resolve().as_posix()
+    manager = db_manager.DatabaseManager(db_path, partitioned=True)
+
+    yield manager
+
+    manager.close_database()
 
 @pytest.fixture(scope='function')
 def filenames():
@@ -5,10 +5,14 @@
 # Copyright MonetDB Solutions B.V. 2018-2019
 
 import os
+import subprocess
+import sys
+
 import monetdblite
 import pytest
 
 from mal_analytics import DatabaseManager
+from mal_analytics import db_manager
 
 
 class TestCreation(object):
@@ -27,6 +31,7 @@ class TestCreation(object):
             'initiates_executions',
             'heartbeat',
             'cpuload',
+            'instruction_run',
             # 'trace'
         ]
         for tbl in tables:
@@ -68,3 +73,18 @@ class TestCreation(object):
         manager_object._initialize_tables()
 
         self.test_table_creation(manager_object)
+
+    def test_schema_info(self, manager_object):
+        result = manager_object.execute_query("SELECT version, partitioned FROM schema_info")
+        assert list(result['version']) == [db_manager.SCHEMA_VERSION]
+        assert not result['partitioned'][0]
+
+        # Databases without version information are checked and upgraded
+        manager_object.execute_query("DROP TABLE schema_info")
+        manager_object._initialize_tables()
+        result = manager_object.execute_query("SELECT version FROM schema_info")
+        assert list(result['version']) == [db_manager.SCHEMA_VERSION]
+
+    def test_lazy_import(self):
+        code = "import sys, mal_analytics; sys.exit('monetdblite' in sys.modules)"
+        assert subprocess.call([sys.executable, '-c', code]) == 0
@@ -9,6 +9,8 @@ import json
 import pytest
 from mal_analytics import exceptions
 from mal_analytics import profiler_parser
+from mal_analytics import quarantine
+from mal_analytics.stats import IngestStats
 
 class TestParser(object):
     def test_parse_single_variable(self, parser_object):
@@ -245,6 +247,22 @@ class TestParser(object):
                 "heartbeat_id",
                 "val",
             ],
+            "instruction_run": [
+                "instruction_run_id",
+                "mal_execution_id",
+                "pc",
+                "thread",
+                "start_event_id",
+                "end_event_id",
+                "start_time",
+                "end_time",
+                "astart_time",
+                "aend_time",
+                "duration",
+                "short_statement",
+                "mal_module",
+                "instruction",
+            ],
         }
 
         assert len(data_truth) == len(result)
@@ -265,7 +283,8 @@ class TestParser(object):
             "query": 1,
             "initiates_executions": 1,
             "heartbeat": 0,
-            "cpuload": 0
+            "cpuload": 0,
+            "instruction_run": 728
         }
         parser_object.parse_trace_stream(query_trace1)
 
@@ -286,7 +305,8 @@ class TestParser(object):
             "query": 2,
             "initiates_executions": 2,
             "heartbeat": 0,
-            "cpuload": 0
+            "cpuload": 0,
+            "instruction_run": 1537
         }
 
         parser_object.parse_trace_stream(query_trace1)
@@ -309,7 +329,8 @@ class TestParser(object):
             "query": 1,
             "initiates_executions": 3,
             "heartbeat": 0,
-            "cpuload": 0
+            "cpuload": 0,
+            "instruction_run": 58
         }
 
         parser_object.parse_trace_stream(supervisor_trace)
@@ -331,7 +352,8 @@ class TestParser(object):
             "query": 1,
             "initiates_executions": 7,
             "heartbeat": 0,
-            "cpuload": 0
+            "cpuload": 0,
+            "instruction_run": 140
         }
         parser_object.parse_trace_stream(supervisor_trace)
         parser_object.parse_trace_stream(worker1_trace)
@@ -354,7 +376,8 @@ class TestParser(object):
             "query": 1,
             "initiates_executions": 7,
             "heartbeat": 0,
-            "cpuload": 0
+            "cpuload": 0,
+            "instruction_run": 140
         }
         parser_object.parse_trace_stream(worker1_trace)
         parser_object.parse_trace_stream(supervisor_trace)
@@ -367,6 +390,151 @@ class TestParser(object):
             for field in result[table]:
                 assert len(result[table][field]) == truth[table], "Check failed for table '{}'".format(table)
 
+    def test_instruction_runs(self, parser_object, query_trace1):
+        parser_object.parse_trace_stream(query_trace1)
+        result = parser_object.get_data()
+        events = result["profiler_event"]
+        runs = result["instruction_run"]
+
+        event_index = dict([(eid, i) for i, eid in enumerate(events["event_id"])])
+        for i, run_id in enumerate(runs["instruction_run_id"]):
+            start = event_index[runs["start_event_id"][i]]
+            end = event_index[runs["end_event_id"][i]]
+            assert events["execution_state"][start] == 0
+            assert events["execution_state"][end] == 1
+            assert events["pc"][start] == events["pc"][end] == runs["pc"][i]
+            assert events["mal_execution_id"][start] == runs["mal_execution_id"][i]
+            assert runs["start_time"][i] == events["relative_time"][start]
+            assert runs["end_time"][i] == events["relative_time"][end]
+            assert runs["duration"][i] == runs["end_time"][i] - runs["start_time"][i]
+            assert runs["thread"][i] == events["thread"][end]
+
+    def test_instruction_run_unmatched_start(self, parser_object, query_trace1):
+        # Drop the done event of the last instruction
+        parser_object.parse_trace_stream(query_trace1[:-1])
+        result = parser_object.get_data()
+
+        assert len(result["instruction_run"]["instruction_run_id"]) == 727
+        assert len(parser_object._pending_starts) == 1
+
+    def test_parse_single_trace_compact(self, query_trace1):
+        truth = {
+            "mal_execution": 1,
+            "profiler_event": 728,
+            "prerequisite_events": 1237,
+            "mal_variable": 865,
+            "event_variable_list": 2818,
+            "query": 1,
+            "initiates_executions": 1,
+            "heartbeat": 0,
+            "cpuload": 0,
+            "instruction_run": 728
+        }
+        parser = profiler_parser.ProfilerObjectParser(compact=True)
+        parser.parse_trace_stream(query_trace1)
+        parser.flush_pending_events()
+
+        result = parser.get_data()
+        assert len(result) == len(truth)
+
+        for table in result:
+            for field in result[table]:
+                assert len(result[table][field]) == truth[table], "Check failed for field '{}.{}'".format(table, field)
+
+        assert set(result["profiler_event"]["execution_state"]) == set([1])
+        assert set(result["instruction_run"]["start_event_id"]) == set([None])
+        assert result["instruction_run"]["end_event_id"] == result["profiler_event"]["event_id"]
+
+    def test_parse_trace_in_chunks(self, query_trace1):
+        parser = profiler_parser.ProfilerObjectParser()
+        counts = dict()
+        for start in range(0, len(query_trace1), 500):
+            parser.parse_trace_stream(query_trace1[start:start + 500])
+            for table, data in parser.get_data().items():
+                counts[table] = counts.get(table, 0) + len(next(iter(data.values())))
+            parser.clear_internal_state()
+
+        # Variables are not repeated and events are paired across chunks
+        assert counts["profiler_event"] == 1456
+        assert counts["mal_variable"] == 865
+        assert counts["instruction_run"] == 728
+
+    def test_finished_executions_forgotten(self, parser_object, supervisor_trace, query_trace1):
+        parser_object.parse_trace_stream(supervisor_trace)
+        assert parser_object._execution_dict == dict()
+        assert parser_object._execution_sessions == dict()
+        assert parser_object._stored_variables == dict()
+        assert parser_object._var_name_to_id == dict()
+        assert parser_object._pending_starts == dict()
+        assert len(parser_object._finished_executions) == 3
+
+        # Late events of a finished execution are skipped
+        parser_object.clear_internal_state()
+        parser_object.parse_trace_stream(query_trace1[:10])
+        parser_object.parse_trace_stream(query_trace1[10:])
+        parser_object.parse_trace_stream(query_trace1[-10:])
+        result = parser_object.get_data()
+        assert len(result["mal_execution"]["execution_id"]) == 1
+        assert len(result["profiler_event"]["event_id"]) == 1456
+        assert len(result["mal_variable"]["variable_id"]) == 865
+
+    def test_late_event(self, query_trace1):
+        stats = IngestStats()
+        qua = quarantine.Quarantine()
+        parser = profiler_parser.ProfilerObjectParser(stats=stats, quarantine=qua)
+        parser.parse_trace_stream(query_trace1)
+        # An event of the execution arrives after its root function is done
+        parser.parse_trace_stream([query_trace1[5]])
+
+        result = parser.get_data()
+        assert len(result["mal_execution"]["execution_id"]) == 1
+        assert len(result["profiler_event"]["event_id"]) == 1456
+        assert stats.get_stats()['counters']['events_skipped'] == 1
+        assert qua.get_counts() == {quarantine.LATE_EVENT: 1}
+        assert qua.get_records()[0]['object'] == json.dumps(query_trace1[5], sort_keys=True)
+
+        # Without a quarantine the event is only counted
+        stats = IngestStats()
+        parser = profiler_parser.ProfilerObjectParser(stats=stats)
+        parser.parse_trace_stream(query_trace1 + query_trace1[5:7])
+        assert len(parser.get_data()["profiler_event"]["event_id"]) == 1456
+        assert stats.get_stats()['counters']['events_skipped'] == 2
+
+    def test_spill_to_disk(self, query_trace1, tmp_path):
+        reference = profiler_parser.ProfilerObjectParser()
+        reference.parse_trace_stream(query_trace1)
+        expected = reference.get_data()
+
+        parser = profiler_parser.ProfilerObjectParser(memory_budget=1024, spill_dir=str(tmp_path))
+        parser.parse_trace_stream(query_trace1)
+        assert parser.get_spill_statistics()['segments'] > 0
+
+        counts = dict()
+        for table, data in parser.iter_data():
+            counts[table] = counts.get(table, 0) + len(next(iter(data.values())))
+        assert counts["profiler_event"] == 1456
+        assert counts["mal_variable"] == 865
+        assert counts["instruction_run"] == 728
+
+        # The merged data is the same as without spilling
+        assert parser.get_data() == expected
+
+        parser.clear_internal_state()
+        assert parser.get_spill_statistics() == {'segments': 0, 'bytes': 0}
+
+    def test_compact_unmatched_start(self, query_trace1):
+        parser = profiler_parser.ProfilerObjectParser(compact=True)
+        # Drop the done event of the last instruction
+        parser.parse_trace_stream(query_trace1[:-1])
+        result = parser.get_data()
+        assert len(result["profiler_event"]["event_id"]) == 727
+
+        parser.flush_pending_events()
+        result = parser.get_data()
+        assert len(result["profiler_event"]["event_id"]) == 728
+        assert result["profiler_event"]["execution_state"][-1] == 0
+        assert len(result["instruction_run"]["instruction_run_id"]) == 727
+
     def test_clear_data(self, parser_object, query_trace1):
         parser_object.parse_trace_stream(query_trace1)
         parser_object.clear_internal_state()
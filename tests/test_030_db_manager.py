@@ -4,10 +4,14 @@
 #
 # Copyright MonetDB Solutions B.V. 2018-2019
 
+import json
+
+import numpy
 import pytest
 
 from mal_analytics import db_manager
 from mal_analytics.exceptions import DatabaseManagerError
+from mal_analytics.exceptions import QueryError
 
 
 class TestDatabaseManager(object):
@@ -16,6 +20,26 @@ class TestDatabaseManager(object):
         new_manager = db_manager.DatabaseManager(dbpath)
         assert new_manager is manager_object, "Objects are not the same"
 
+    def test_registry(self, manager_object, tmp_path):
+        other_path = (tmp_path / 'other').as_posix()
+        # Only one database can be open in a process
+        with pytest.raises(DatabaseManagerError):
+            db_manager.DatabaseManager(other_path)
+
+        # The second reference keeps the database open
+        with db_manager.DatabaseManager(manager_object.get_dbpath()) as dbm:
+            assert dbm is manager_object
+        assert manager_object.is_connected()
+        assert db_manager.DatabaseManager.open_databases() == [manager_object.get_dbpath()]
+
+        manager_object.release()
+        assert not manager_object.is_connected()
+        assert db_manager.DatabaseManager.open_databases() == []
+
+        with db_manager.DatabaseManager(other_path) as other:
+            assert other is not manager_object
+            assert other.execute_query("SELECT count(*) AS cnt FROM profiler_event")['cnt'][0] == 0
+
     def test_execute_query(self, manager_object):
         result = manager_object.execute_query("SELECT count(*) AS pe_count FROM profiler_event")
         assert len(result['pe_count']) == 1
@@ -51,11 +75,114 @@ class TestDatabaseManager(object):
             'max_prerequisite_id': 2474,
             'max_query_id': 1,
             'max_initiates_id': 1,
+            'max_instruction_run_id': 728,
         }
         limits = manager_object.get_limits()
         for k, v in truth.items():
             assert limits[k] == v
 
+    def test_instructions_view(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM instructions")
+        assert result['cnt'][0] == 728
+
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM instructions WHERE duration <> end_time - start_time")
+        assert result['cnt'][0] == 0
+
+    def test_compact_parse_trace(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents, compact=True)
+
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM profiler_event")
+        assert result['cnt'][0] == 728
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM instructions")
+        assert result['cnt'][0] == 728
+
+    def test_indexes(self, manager_object, query_trace1):
+        assert not manager_object.has_indexes()
+        manager_object.add_indexes()
+        assert manager_object.has_indexes()
+
+        # Indexes are rebuilt after loading
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+        assert manager_object.has_indexes()
+
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM profiler_event WHERE mal_execution_id=1 AND pc=1")
+        assert result['cnt'][0] == 2
+
+        manager_object.drop_indexes()
+        assert not manager_object.has_indexes()
+
+    def test_stream_query(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+
+        chunks = list(manager_object.stream_query("SELECT event_id, pc FROM profiler_event", chunk_size=100))
+        assert len(chunks) == 15
+        assert sum([len(c['event_id']) for c in chunks]) == 1456
+
+        chunks = list(manager_object.stream_query("SELECT event_id, pc FROM profiler_event WHERE pc > %s",
+                                                  [0], chunk_size=500, key='event_id'))
+        event_ids = numpy.concatenate([c['event_id'] for c in chunks])
+        assert len(event_ids) == 1454
+        assert (numpy.diff(event_ids) > 0).all()
+
+    def test_stream_query_dictionary(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+
+        modules = list()
+        for chunk in manager_object.stream_query("SELECT event_id, mal_module FROM profiler_event", chunk_size=200,
+                                                 key='event_id', dictionary_columns=['mal_module']):
+            column = chunk['mal_module']
+            modules.extend(column.dictionary[column.codes])
+
+        truth = [obj['module'] for obj in query_trace1]
+        assert modules == truth
+
+    def test_stream_bad_query(self, manager_object):
+        with pytest.raises(QueryError):
+            list(manager_object.stream_query("This is not a correct SQL query"))
+
+    def test_dictionary_encoder(self):
+        encoder = db_manager._DictionaryEncoder()
+        first = encoder.encode(numpy.array(['b', 'a', 'b'], dtype=object))
+        assert list(first.dictionary[first.codes]) == ['b', 'a', 'b']
+
+        column = numpy.ma.masked_array(numpy.array(['c', 'a', 'x'], dtype=object), mask=[False, False, True])
+        second = encoder.encode(column)
+        assert second.codes[2] == -1
+        assert list(second.dictionary[second.codes[:2]]) == ['c', 'a']
+        # Codes are stable across chunks
+        assert second.codes[1] == first.codes[1]
+
+    def test_query_cache(self, manager_object, query_trace1):
+        manager_object.set_query_cache(1 << 20)
+        cache = manager_object.get_query_cache()
+        query = "SELECT count(*) AS cnt FROM profiler_event WHERE pc > %s"
+
+        first = manager_object.execute_query(query, [0])
+        assert first['cnt'][0] == 0
+        assert manager_object.execute_query(query, [0]) is first
+        assert cache.hits == 1
+        # Different parameters are a different entry
+        manager_object.execute_query(query, [1])
+        assert cache.misses == 2
+
+        # Loading data invalidates the cache
+        generation = manager_object.get_generation()
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+        assert manager_object.get_generation() > generation
+        assert manager_object.execute_query(query, [0])['cnt'][0] == 1454
+
+        assert manager_object.execute_query(query, [0], use_cache=False) is not first
+        manager_object.set_query_cache(None)
+        assert manager_object.get_query_cache() is None
+
     def test_insert_without_connection(self, manager_object):
         manager_object._disconnect()
         with pytest.raises(DatabaseManagerError):
@@ -34,3 +34,18 @@ class TestTraceReader(object):
 
         fl.close()
         assert cnt == 1456
+
+    def test_object_splitter(self):
+        splitter = trace_reader.ObjectSplitter()
+        assert splitter.feed(b'{"a": 1}\n{"b":') == ['{"a": 1}']
+        assert splitter.feed('\n 2}\n') == ['{"b":\n 2}']
+        assert splitter.feed(b'{"c": 3}') == []
+        assert splitter.close() == ['{"c": 3}']
+
+        splitter = trace_reader.ObjectSplitter(resync=True)
+        assert splitter.feed(b' 1,\n "b": 2\n}\n{"c"') == []
+        assert splitter.feed(b': 3}\n') == ['{"c": 3}']
+
+    def test_read_trace(self, filenames):
+        for fln in filenames:
+            assert len(trace_reader.read_trace(fln)) == 1456
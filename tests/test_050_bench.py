@@ -0,0 +1,113 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import json
+
+import pytest
+
+from mal_analytics.bench import ingest
+from mal_analytics.bench import queries
+from mal_analytics.exceptions import QueryError
+from mal_analytics.synthetic import TraceGenerator
+
+
+class FailingManager(object):
+    """Fail every query, as DatabaseManager.execute_query does."""
+
+    def execute_query(self, query, params=None):
+        return None
+
+
+class TestQueryBenchmark(object):
+    def test_index_benchmark(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+
+        results = queries.run_index_benchmark(manager_object, repeat=1)
+        # There are no heartbeats in this trace
+        assert 'heartbeats_by_session' not in results
+        assert 'events_by_execution_pc' in results
+        for res in results.values():
+            assert res['without_indexes'] > 0
+            assert res['with_indexes'] > 0
+
+        # The state of the indexes has not changed
+        assert not manager_object.has_indexes()
+
+    def test_failed_query(self):
+        with pytest.raises(QueryError):
+            queries.time_queries(FailingManager(), [('broken', "SELECT nothing", ())], {}, repeat=1)
+
+
+class TestIngestBenchmark(object):
+    def test_run_case(self, tmp_path):
+        (_, filename), = ingest.generate_traces(str(tmp_path), ['small'], ['udf'])
+        results = ingest.run_case(str(tmp_path / 'db'), filename)
+
+        for stage in ingest.STAGES:
+            assert results[stage] >= 0
+        assert results['total'] == sum([results[s] for s in ingest.STAGES])
+        assert results['objects'] > 0
+        assert results['rows'] > results['objects']
+        assert results['python_peak_bytes'] > 0
+
+    def test_generate_traces(self, tmp_path):
+        traces = ingest.generate_traces(str(tmp_path), ['small'], ['flat', 'distributed'], 'gz')
+        assert [name for name, _ in traces] == ['flat_small', 'distributed_small']
+        mtime = [(tmp_path / fl).stat().st_mtime for _, fl in traces]
+
+        # Existing traces are reused
+        again = ingest.generate_traces(str(tmp_path), ['small'], ['flat', 'distributed'], 'gz')
+        assert again == traces
+        assert [(tmp_path / fl).stat().st_mtime for _, fl in again] == mtime
+
+    def test_compare(self):
+        baseline = {'cases': {
+            'flat_small': {'parse': 1.0, 'insert': 2.0, 'peak_rss_kb': 1000},
+            'udf_small': {'parse': 1.0},
+        }}
+        results = {'cases': {
+            'flat_small': {'parse': 1.1, 'insert': 2.5, 'peak_rss_kb': 1300},
+            'heartbeats_small': {'parse': 10.0},
+        }}
+
+        regressions = ingest.compare(results, baseline)
+        assert regressions == [
+            ('flat_small', 'insert', 2.0, 2.5),
+            ('flat_small', 'peak_rss_kb', 1000, 1300),
+        ]
+
+        regressions = ingest.compare(results, baseline, {'insert': 0.3, 'peak_rss_kb': 0.5}, 0.05)
+        assert regressions == [('flat_small', 'parse', 1.0, 1.1)]
+
+
+class TestAnalyticBenchmark(object):
+    def test_call_graph(self, manager_object):
+        generator = TraceGenerator(seed=1, executions=2, instructions=10, call_depth=2, workers=1)
+        pob = manager_object.create_parser()
+        pob.parse_trace_stream(generator)
+        manager_object.load_parsed_data(pob)
+
+        roots = manager_object.execute_query("SELECT root_execution_id FROM query ORDER BY query_id")
+        edges = queries.call_graph(manager_object, int(roots['root_execution_id'][0]))
+        # Two nested functions and one remote worker
+        assert len(edges) == 3
+
+        samples = queries.sample_parameters(manager_object)
+        results = queries.time_queries(manager_object, queries.ANALYTIC_QUERIES, samples, repeat=1)
+        # There are no heartbeats in this trace
+        assert sorted(results) == sorted([name for name, _, _ in queries.ANALYTIC_QUERIES if name != 'heartbeat_window'])
+
+    def test_cold_and_warm(self, tmp_path):
+        dbpath = str(tmp_path / 'bench_db')
+        loaded = queries.build_benchmark_database(dbpath, scale=2, chunk_objects=500)
+        assert loaded > 500
+
+        samples = queries._sample_database(dbpath)
+        for name in ['top_slow_instructions', 'heartbeat_window']:
+            results = queries.time_cold_and_warm(dbpath, name, samples, repeat=2)
+            assert results['cold'] > 0
+            assert results['warm'] > 0
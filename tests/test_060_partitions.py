@@ -0,0 +1,126 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import datetime
+import json
+import os
+
+import pytest
+
+from mal_analytics import db_manager
+from mal_analytics import partitions
+from mal_analytics.exceptions import DatabaseManagerError
+
+
+def _contents(trace):
+    return "\n".join([json.dumps(obj) for obj in trace]) + "\n"
+
+
+class TestPartitions(object):
+    def test_partition_suffix(self):
+        assert partitions.partition_suffix(datetime.date(2019, 3, 1)) == '_p20190301'
+
+    def test_partition_tables(self):
+        # The merge tables and the tables of every partition are
+        # created from the same definitions.
+        data_dir = os.path.join(os.path.dirname(partitions.__file__), 'data')
+        with open(os.path.join(data_dir, 'tables.sql')) as fl:
+            tables = fl.read()
+        with open(os.path.join(data_dir, 'create_partition.sql')) as fl:
+            attach = fl.read()
+        for table in partitions.PARTITIONED_TABLES:
+            assert 'create {{table_kind}} {}{{suffix}} ('.format(table) in tables
+            assert 'ALTER TABLE {0} ADD TABLE {0}{{suffix}};'.format(table) in attach
+
+    def test_not_partitioned(self, manager_object):
+        assert not manager_object.is_partitioned()
+        with pytest.raises(DatabaseManagerError):
+            manager_object.list_partitions()
+
+    def test_initial_partition(self, partitioned_manager):
+        assert partitioned_manager.is_partitioned()
+        parts = partitioned_manager.list_partitions()
+        assert len(parts) == 1
+        assert parts[0]['min_time'] is None
+
+        result = partitioned_manager.execute_query("SELECT count(*) AS cnt FROM profiler_event")
+        assert result['cnt'][0] == 0
+
+    def test_load_partitioned(self, partitioned_manager, query_trace1, query_trace2):
+        partitioned_manager.parse_trace(_contents(query_trace1))
+        partitioned_manager.parse_trace(_contents(query_trace2))
+
+        result = partitioned_manager.execute_query("SELECT count(*) AS cnt FROM profiler_event")
+        assert result['cnt'][0] == 3074
+        result = partitioned_manager.execute_query("SELECT count(*) AS cnt FROM instructions")
+        assert result['cnt'][0] == 1537
+
+        parts = partitioned_manager.list_partitions()
+        assert len(parts) == 1
+        start_times = [obj['ctime'] for obj in query_trace1 + query_trace2]
+        assert parts[0]['min_time'] == min(start_times)
+        assert parts[0]['max_time'] == max(start_times)
+
+    def test_partition_union(self, partitioned_manager, query_trace1):
+        partitioned_manager.parse_trace(_contents(query_trace1))
+        bounds = partitioned_manager.list_partitions()[0]
+
+        expr = partitioned_manager.partition_union('profiler_event', bounds['min_time'], bounds['max_time'])
+        result = partitioned_manager.execute_query("SELECT count(*) AS cnt FROM {} AS pe".format(expr))
+        assert result['cnt'][0] == 1456
+
+        expr = partitioned_manager.partition_union('profiler_event', end=bounds['min_time'] - 1)
+        result = partitioned_manager.execute_query("SELECT count(*) AS cnt FROM {} AS pe".format(expr))
+        assert result['cnt'][0] == 0
+
+    def test_expire(self, partitioned_manager, query_trace1):
+        partitioned_manager.parse_trace(_contents(query_trace1))
+        old_partition = partitioned_manager.list_partitions()[0]['suffix']
+
+        # Nothing is older than a day
+        assert partitioned_manager.expire_partitions(1) == []
+
+        later = datetime.datetime.utcnow().date() + datetime.timedelta(days=30)
+        assert partitioned_manager.expire_partitions(7, later) == [old_partition]
+
+        parts = partitioned_manager.list_partitions()
+        assert len(parts) == 1
+        assert parts[0]['suffix'] == partitions.partition_suffix(later)
+
+        result = partitioned_manager.execute_query("SELECT count(*) AS cnt FROM profiler_event")
+        assert result['cnt'][0] == 0
+
+    def test_day_boundary(self, tmp_path, query_trace1):
+        # A parser that runs past midnight (UTC) loads the rest of an
+        # execution into the partition of the next day.
+        now = [datetime.datetime(2019, 3, 1, 23, 59, 30, tzinfo=datetime.timezone.utc).timestamp()]
+        dbm = db_manager.DatabaseManager((tmp_path / 'boundary').resolve().as_posix(),
+                                         partitioned=True, clock=lambda: now[0])
+        try:
+            pob = dbm.create_parser()
+            half = len(query_trace1) // 2
+            pob.parse_trace_stream(query_trace1[:half])
+            assert dbm.load_parsed_data(pob) == 0
+
+            now[0] += 60
+            pob.parse_trace_stream(query_trace1[half:])
+            assert dbm.load_parsed_data(pob) == 0
+
+            parts = dbm.list_partitions()
+            assert [p['suffix'] for p in parts] == ['_p20190301', '_p20190302']
+
+            result = dbm.execute_query("SELECT count(*) AS cnt FROM mal_execution_p20190302")
+            assert result['cnt'][0] == 0
+            result = dbm.execute_query("SELECT count(*) AS cnt FROM profiler_event_p20190302")
+            assert result['cnt'][0] == 728
+            result = dbm.execute_query(
+                "SELECT count(*) AS cnt FROM profiler_event AS e JOIN mal_execution AS m ON e.mal_execution_id=m.execution_id")
+            assert result['cnt'][0] == 1456
+            result = dbm.execute_query(
+                "SELECT count(*) AS cnt FROM instructions AS i JOIN profiler_event AS e ON i.start_event_id=e.event_id")
+            assert result['cnt'][0] == 728
+        finally:
+            dbm.close_database()
@@ -0,0 +1,68 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import numpy
+import pytest
+
+from mal_analytics.cache import QueryCache
+from mal_analytics.cache import result_size
+
+
+def results(rows):
+    return {'a': numpy.arange(rows, dtype=numpy.int64)}
+
+
+class TestQueryCache(object):
+    def test_hit_and_miss(self):
+        cache = QueryCache(1024)
+        key = QueryCache.make_key("SELECT 1", None)
+        assert cache.get(key, 0) is None
+        value = results(4)
+        cache.put(key, 0, value)
+        assert cache.get(key, 0) is value
+        assert cache.hits == 1
+        assert cache.misses == 1
+
+    def test_read_only(self):
+        cache = QueryCache(1024)
+        value = results(4)
+        cache.put(QueryCache.make_key("SELECT 1", None), 0, value)
+        with pytest.raises(ValueError):
+            value['a'][0] = 1
+
+    def test_generation(self):
+        cache = QueryCache(1024)
+        key = QueryCache.make_key("SELECT 1", [1])
+        cache.put(key, 0, results(4))
+        assert cache.get(key, 1) is None
+        assert len(cache) == 0
+        assert cache.size() == 0
+
+    def test_eviction(self):
+        cache = QueryCache(100)
+        keys = [QueryCache.make_key("SELECT 1", [i]) for i in range(3)]
+        # 40 bytes each
+        for k in keys[:2]:
+            cache.put(k, 0, results(5))
+        cache.get(keys[0], 0)
+        cache.put(keys[2], 0, results(5))
+
+        assert len(cache) == 2
+        assert cache.size() == 80
+        assert cache.get(keys[1], 0) is None
+        assert cache.get(keys[0], 0) is not None
+
+    def test_too_large(self):
+        cache = QueryCache(100)
+        key = QueryCache.make_key("SELECT 1", None)
+        cache.put(key, 0, results(20))
+        assert len(cache) == 0
+        assert cache.get(key, 0) is None
+
+    def test_result_size(self):
+        assert result_size(results(10)) == 80
+        strings = {'s': numpy.array(['abc', 'de'], dtype=object)}
+        assert result_size(strings) > strings['s'].nbytes
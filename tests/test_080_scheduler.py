@@ -0,0 +1,109 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import json
+import threading
+
+import pytest
+
+from mal_analytics import scheduler
+from mal_analytics.exceptions import SchedulerError
+from mal_analytics.profiler_parser import ProfilerObjectParser
+
+
+class RecordingManager(object):
+    """Record the loads and the constraint handling instead of loading."""
+
+    def __init__(self):
+        self.calls = list()
+
+    def __enter__(self):
+        self.calls.append('drop')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.calls.append('restore')
+
+    def create_parser(self, compact=False):
+        return ProfilerObjectParser()
+
+    def defer_constraints(self):
+        return self
+
+    def load_parsed_data(self, pob):
+        self.calls.append(len(pob.get_data()['profiler_event']['event_id']))
+        pob.clear_internal_state()
+        return 0
+
+
+class TestQueryScheduler(object):
+    def test_priorities(self):
+        order = list()
+        release = threading.Event()
+        with scheduler.QueryScheduler(None) as sched:
+            # Keep the worker busy while the rest of the requests are queued
+            blocker = sched.submit(release.wait)
+            futures = [
+                sched.submit(order.append, 'ingest', priority=scheduler.INGEST),
+                sched.submit(order.append, 'background', priority=scheduler.BACKGROUND),
+                sched.submit(order.append, 'interactive'),
+            ]
+            release.set()
+            for f in [blocker] + futures:
+                f.result(timeout=5)
+
+        assert order == ['interactive', 'background', 'ingest']
+
+    def test_steps(self):
+        order = list()
+        with scheduler.QueryScheduler(None) as sched:
+            def steps():
+                order.append('step 1')
+                # Submitted while the request is running
+                sched.submit(order.append, 'interactive')
+                yield
+                order.append('step 2')
+                return 42
+
+            assert sched.submit_steps(steps()).result(timeout=5) == 42
+
+        assert order == ['step 1', 'interactive', 'step 2']
+
+    def test_exception(self):
+        with scheduler.QueryScheduler(None) as sched:
+            future = sched.submit(int, 'not a number')
+            with pytest.raises(ValueError):
+                future.result(timeout=5)
+
+    def test_shutdown(self):
+        sched = scheduler.QueryScheduler(None)
+        future = sched.submit(sum, [1, 2])
+        sched.shutdown()
+        assert future.result() == 3
+        with pytest.raises(SchedulerError):
+            sched.submit(sum, [1, 2])
+
+    def test_chunked_ingest(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        with scheduler.QueryScheduler(manager_object, chunk_objects=500) as sched:
+            assert sched.parse_trace(contents).result() == 1456
+            result = sched.execute_query("SELECT count(*) AS cnt FROM profiler_event").result()
+            assert result['cnt'][0] == 1456
+            # Start and done events are paired across chunks
+            result = sched.execute_query("SELECT count(*) AS cnt FROM instructions").result()
+            assert result['cnt'][0] == 728
+
+    def test_deferred_constraints(self, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        dbm = RecordingManager()
+        with scheduler.QueryScheduler(dbm, chunk_objects=500) as sched:
+            futures = [sched.parse_trace(contents), sched.parse_trace(contents)]
+            assert [f.result(timeout=30) for f in futures] == [1456, 1456]
+
+        # The constraints are dropped and restored once per trace, and
+        # the traces are not interleaved.
+        loads = [c for c in dbm.calls if c not in ('drop', 'restore')]
+        assert sum(loads) == 2 * 1456
+        assert dbm.calls == ['drop'] + loads[:3] + ['restore', 'drop'] + loads[3:] + ['restore']
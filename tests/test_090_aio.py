@@ -0,0 +1,121 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import asyncio
+import json
+import time
+
+import pytest
+
+from mal_analytics import aio
+from mal_analytics.profiler_parser import ProfilerObjectParser
+
+
+class ByteStream(object):
+    """An asynchronous iterable over fixed size pieces of a byte string."""
+
+    def __init__(self, data, size):
+        self._pieces = [data[i:i + size] for i in range(0, len(data), size)]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._pieces:
+            raise StopAsyncIteration
+        await asyncio.sleep(0)
+        return self._pieces.pop(0)
+
+
+class SlowManager(object):
+    def execute_query(self, query, params=None):
+        time.sleep(0.5)
+        return query
+
+
+class RecordingManager(object):
+    """Record the loads and the constraint handling instead of loading."""
+
+    def __init__(self):
+        self.calls = list()
+
+    def __enter__(self):
+        self.calls.append('drop')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.calls.append('restore')
+
+    def create_parser(self, compact=False):
+        return ProfilerObjectParser()
+
+    def defer_constraints(self):
+        return self
+
+    def load_parsed_data(self, pob):
+        self.calls.append(len(pob.get_data()['profiler_event']['event_id']))
+        pob.clear_internal_state()
+        return 0
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncDatabaseManager(object):
+    def test_query_timeout(self):
+        adbm = aio.AsyncDatabaseManager(SlowManager())
+
+        async def scenario():
+            with pytest.raises(asyncio.TimeoutError):
+                await adbm.query("SELECT 1", timeout=0.01)
+            result = await adbm.query("SELECT 2", timeout=5)
+            await adbm.close()
+            return result
+
+        assert run(scenario()) == "SELECT 2"
+
+    def test_ingest(self, manager_object, query_trace1):
+        contents = ("\n".join([json.dumps(obj) for obj in query_trace1]) + "\n").encode('utf-8')
+        adbm = aio.AsyncDatabaseManager(manager_object, chunk_objects=500)
+
+        async def scenario():
+            ingest = asyncio.ensure_future(adbm.ingest(ByteStream(contents, 4096)))
+            # Queries are served while the trace is loading
+            await adbm.query("SELECT count(*) AS cnt FROM profiler_event")
+            loaded = await ingest
+            result = await adbm.query("SELECT count(*) AS cnt FROM instructions")
+            await adbm.close()
+            return loaded, result['cnt'][0]
+
+        assert run(scenario()) == (1456, 728)
+
+    def test_concurrent_ingest(self, query_trace1):
+        contents = ("\n".join([json.dumps(obj) for obj in query_trace1]) + "\n").encode('utf-8')
+        dbm = RecordingManager()
+        adbm = aio.AsyncDatabaseManager(dbm, chunk_objects=500)
+
+        async def scenario():
+            loaded = await asyncio.gather(
+                adbm.ingest(ByteStream(contents, 4096)),
+                adbm.ingest(ByteStream(contents, 4096)),
+            )
+            await adbm.close()
+            return loaded
+
+        assert run(scenario()) == [1456, 1456]
+
+        # The constraints are dropped and restored once per trace, and
+        # the traces are not interleaved.
+        loads = [c for c in dbm.calls if c not in ('drop', 'restore')]
+        assert sum(loads) == 2 * 1456
+        first = dbm.calls.index('restore')
+        assert dbm.calls[0] == 'drop' and dbm.calls[first + 1] == 'drop'
+        assert dbm.calls[-1] == 'restore'
+        assert dbm.calls.count('drop') == 2 and dbm.calls.count('restore') == 2
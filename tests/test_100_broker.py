@@ -0,0 +1,205 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import json
+import threading
+
+import pytest
+
+from mal_analytics import broker
+from mal_analytics import metrics
+from mal_analytics.exceptions import BrokerError
+from mal_analytics.profiler_parser import ProfilerObjectParser
+
+
+class RecordingManager(object):
+    """Record the number of events in every load instead of storing them."""
+
+    def __init__(self):
+        self.loads = list()
+
+    def create_parser(self):
+        return ProfilerObjectParser()
+
+    def load_parsed_data(self, pob):
+        self.loads.append(len(pob.get_data()['profiler_event']['event_id']))
+        pob.clear_internal_state()
+        return 0
+
+
+class UniqueManager(RecordingManager):
+    """Reject the executions that are already loaded, like the primary key."""
+
+    def __init__(self):
+        super(UniqueManager, self).__init__()
+        self.executions = set()
+
+    def load_parsed_data(self, pob):
+        executions = pob.get_data()['mal_execution']['execution_id']
+        if self.executions.intersection(executions):
+            pob.clear_internal_state()
+            raise ValueError("Duplicate execution id")
+        self.executions.update(executions)
+        return super(UniqueManager, self).load_parsed_data(pob)
+
+
+def submissions(trace, count):
+    size = len(trace) // count + 1
+    return ["\n".join([json.dumps(obj) for obj in trace[i:i + size]]) + "\n"
+            for i in range(0, len(trace), size)]
+
+
+def session_copies(trace, count):
+    """The trace in ``count`` different sessions, since the parser skips
+    the events that arrive after the end of their execution."""
+    return ["\n".join([json.dumps(dict(obj, session='{}-{}'.format(obj.get('session'), i)))
+                       for obj in trace]) + "\n"
+            for i in range(count)]
+
+
+class TestIngestBroker(object):
+    def test_batching(self, tmp_path, query_trace1):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        dbm = RecordingManager()
+        brk = broker.IngestBroker(dbm, socket_path, batch_delay=0.2)
+        brk.start()
+
+        responses = list()
+
+        def produce(data):
+            with broker.BrokerClient(socket_path) as client:
+                responses.append(client.submit(data))
+
+        producers = [threading.Thread(target=produce, args=(data,))
+                     for data in session_copies(query_trace1, 4)]
+        for p in producers:
+            p.start()
+        for p in producers:
+            p.join()
+        brk.shutdown()
+
+        assert [r['status'] for r in responses] == ['ok'] * 4
+        assert sum([r['objects'] for r in responses]) == 4 * 1456
+        assert sum(dbm.loads) == 4 * 1456
+        # Submissions were batched together
+        assert len(set([r['batch'] for r in responses])) < 4
+
+    def test_failed_submission(self, tmp_path, query_trace1):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        dbm = RecordingManager()
+        ingest = metrics.IngestMetrics()
+        brk = broker.IngestBroker(dbm, socket_path, batch_delay=0.5, metrics=ingest)
+        brk.start()
+
+        responses = dict()
+
+        def produce(name, data):
+            with broker.BrokerClient(socket_path) as client:
+                try:
+                    responses[name] = client.submit(data)['status']
+                except BrokerError:
+                    responses[name] = 'error'
+
+        # An event without a session makes the parser raise
+        data = session_copies(query_trace1, 2) + ['{"source": "trace", "tag": 1}\n']
+        producers = [threading.Thread(target=produce, args=(i, d)) for i, d in enumerate(data)]
+        for p in producers:
+            p.start()
+        for p in producers:
+            p.join()
+        brk.shutdown()
+
+        # Only the invalid submission is rejected
+        assert responses == {0: 'ok', 1: 'ok', 2: 'error'}
+        assert sum(dbm.loads) == 2 * 1456
+        assert 'mal_analytics_failed_batches_total 1\n' in ingest.render()
+
+    def test_failed_batch_state(self, tmp_path, query_trace1):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        dbm = UniqueManager()
+        brk = broker.IngestBroker(dbm, socket_path, batch_delay=0.5)
+        brk.start()
+
+        first, rest = submissions(query_trace1, 2)
+        with broker.BrokerClient(socket_path) as client:
+            assert client.submit(first)['status'] == 'ok'
+
+        responses = dict()
+
+        def produce(name, data):
+            with broker.BrokerClient(socket_path) as client:
+                try:
+                    responses[name] = client.submit(data)['status']
+                except BrokerError:
+                    responses[name] = 'error'
+
+        # The rest of the execution is in the same batch as an invalid
+        # submission, and is loaded on its own afterwards.
+        data = [rest, '{"source": "trace", "tag": 1}\n']
+        producers = [threading.Thread(target=produce, args=(i, d)) for i, d in enumerate(data)]
+        for p in producers:
+            p.start()
+        for p in producers:
+            p.join()
+        brk.shutdown()
+
+        assert responses == {0: 'ok', 1: 'error'}
+        assert sum(dbm.loads) == 1456
+        assert dbm.executions == set([1])
+
+    def test_submit_after_shutdown(self, tmp_path):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        brk = broker.IngestBroker(RecordingManager(), socket_path)
+        brk.start()
+        brk.shutdown()
+        assert brk.submit(b'{"source": "heartbeat"}\n')['status'] == 'error'
+
+    def test_invalid_submission(self, tmp_path):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        brk = broker.IngestBroker(RecordingManager(), socket_path)
+        brk.start()
+        with broker.BrokerClient(socket_path) as client:
+            with pytest.raises(BrokerError):
+                client.submit(b'{"not json}\n')
+            # The connection is still usable
+            assert client.submit(b'')['objects'] == 0
+        brk.shutdown()
+
+    def test_backpressure(self, tmp_path):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        brk = broker.IngestBroker(RecordingManager(), socket_path, max_pending=1)
+        # Nobody consumes the queue
+        brk._queue.put(None)
+        assert brk.submit(b'{"source": "heartbeat"}\n') == {'status': 'busy'}
+
+    def test_load(self, manager_object, tmp_path, query_trace1):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        brk = broker.IngestBroker(manager_object, socket_path, batch_delay=0.1)
+        brk.start()
+        with broker.BrokerClient(socket_path) as client:
+            for data in submissions(query_trace1, 3):
+                client.submit(data)
+        brk.shutdown()
+
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM instructions")
+        assert result['cnt'][0] == 728
+
+    def test_broker_metrics(self, tmp_path, query_trace1):
+        socket_path = (tmp_path / 'broker.sock').as_posix()
+        ingest = metrics.IngestMetrics()
+        brk = broker.IngestBroker(RecordingManager(), socket_path, batch_delay=0, metrics=ingest)
+        brk.start()
+        with broker.BrokerClient(socket_path) as client:
+            for data in submissions(query_trace1, 2):
+                client.submit(data)
+        brk.shutdown()
+
+        text = ingest.render()
+        assert 'mal_analytics_objects_total {}\n'.format(len(query_trace1)) in text
+        events = len([o for o in query_trace1 if o.get('source') == 'trace'])
+        assert 'mal_analytics_events_total {}\n'.format(events) in text
+        assert 'mal_analytics_batch_objects_count 2\n' in text
+        assert 'mal_analytics_ingest_lag_seconds ' in text
@@ -0,0 +1,141 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import gzip
+import json
+import uuid
+from urllib.error import HTTPError
+from urllib.request import Request
+from urllib.request import urlopen
+
+import numpy
+import pytest
+
+from mal_analytics import server
+
+
+class ExecutionsManager(object):
+    """Serve the executions 1 to 5 from memory."""
+
+    def __init__(self):
+        self.queries = list()
+        self.instance_id = uuid.uuid4().hex
+
+    def set_query_cache(self, max_bytes):
+        pass
+
+    def get_generation(self):
+        return 7
+
+    def get_instance_id(self):
+        return self.instance_id
+
+    def execute_query(self, query, params):
+        self.queries.append((query, params))
+        limit = int(query.rsplit(' ', 1)[1])
+        ids = [i for i in range(1, 6) if i > params[0]][:limit]
+        return {
+            'execution_id': numpy.array(ids, dtype=numpy.int64),
+            'tag': numpy.array([10 * i for i in ids], dtype=numpy.int32),
+        }
+
+
+@pytest.fixture(scope='function')
+def service():
+    srv = server.QueryService(ExecutionsManager(), port=0)
+    srv.start()
+    yield srv
+    srv.shutdown()
+
+
+def etag(srv, suffix=''):
+    return '"{}-7{}"'.format(srv._dbm.get_instance_id(), suffix)
+
+
+def get(srv, path, headers=None):
+    host, port = srv.get_address()
+    return urlopen(Request('http://{}:{}{}'.format(host, port, path), headers=headers or {}))
+
+
+class TestQueryService(object):
+    def test_ndjson_pages(self, service):
+        response = get(service, '/executions?limit=2')
+        rows = [json.loads(ln) for ln in response.read().decode('utf-8').splitlines()]
+        assert rows == [{'execution_id': 1, 'tag': 10}, {'execution_id': 2, 'tag': 20}]
+        assert response.headers['ETag'] == etag(service)
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        assert 'after=2' in response.headers['Link']
+
+        response = get(service, '/executions?limit=2&after=4')
+        assert len(response.read().decode('utf-8').splitlines()) == 1
+        assert response.headers['Link'] is None
+
+    def test_columns_gzip(self, service):
+        response = get(service, '/executions?format=columns', {'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert response.headers['ETag'] == etag(service, '-gz')
+        assert response.headers['Vary'] == 'Accept-Encoding'
+        page = json.loads(gzip.decompress(response.read()).decode('utf-8'))
+        assert page['columns']['execution_id'] == [1, 2, 3, 4, 5]
+        assert page['next'] is None
+
+    def test_not_modified(self, service):
+        with pytest.raises(HTTPError) as err:
+            get(service, '/executions', {'If-None-Match': etag(service)})
+        assert err.value.code == 304
+        assert err.value.headers['ETag'] == etag(service)
+        with pytest.raises(HTTPError) as err:
+            get(service, '/executions', {'If-None-Match': etag(service, '-gz'), 'Accept-Encoding': 'gzip'})
+        assert err.value.code == 304
+        assert service._dbm.queries == []
+
+        # The entity tag of the other encoding does not match
+        response = get(service, '/executions', {'If-None-Match': etag(service), 'Accept-Encoding': 'gzip'})
+        assert response.headers['ETag'] == etag(service, '-gz')
+
+        # Invalid requests are rejected before the entity tag is checked
+        with pytest.raises(HTTPError) as err:
+            get(service, '/nothing', {'If-None-Match': etag(service)})
+        assert err.value.code == 404
+        with pytest.raises(HTTPError) as err:
+            get(service, '/executions?limit=0', {'If-None-Match': etag(service)})
+        assert err.value.code == 400
+
+    def test_restart(self, service):
+        old_etag = etag(service)
+        srv = server.QueryService(ExecutionsManager(), port=0)
+        srv.start()
+        try:
+            # Same generation, but another database
+            response = get(srv, '/executions', {'If-None-Match': old_etag})
+            assert response.status == 200
+            assert response.headers['ETag'] == etag(srv)
+            assert response.headers['ETag'] != old_etag
+        finally:
+            srv.shutdown()
+
+    def test_errors(self, service):
+        with pytest.raises(HTTPError) as err:
+            get(service, '/nothing')
+        assert err.value.code == 404
+        with pytest.raises(HTTPError) as err:
+            get(service, '/executions?limit=abc')
+        assert err.value.code == 400
+
+    def test_instructions(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+        srv = server.QueryService(manager_object, port=0)
+
+        version, columns, next_key = srv.get_page('/executions/1/instructions', {'limit': ['500']})
+        assert version == '{}-{}'.format(manager_object.get_instance_id(), manager_object.get_generation())
+        assert len(columns['instruction_run_id']) == 500
+        _, columns, next_key = srv.get_page('/executions/1/instructions', {'after': [str(next_key)]})
+        assert len(columns['instruction_run_id']) == 228
+        assert next_key is None
+
+        srv.shutdown()
+        manager_object.set_query_cache(None)
@@ -0,0 +1,54 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import json
+import os
+
+import pytest
+
+from mal_analytics import swap
+from mal_analytics.exceptions import DatabaseManagerError
+
+
+def trace_files():
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    return [os.path.join(cur_dir, 'data', 'traces', 'jan2019_sf10_10threads', fl)
+            for fl in ['Q01_variation001.json', 'Q02_variation001.json']]
+
+
+class TestSwap(object):
+    def test_rebuild(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+        generation = manager_object.get_generation()
+        instance_id = manager_object.get_instance_id()
+
+        backup = manager_object.get_dbpath() + '.blue'
+        loaded = swap.rebuild(manager_object, trace_files(), backup_path=backup)
+
+        assert loaded > 1456
+        assert manager_object.get_generation() > generation
+        assert manager_object.get_instance_id() != instance_id
+        assert os.path.isdir(backup)
+        assert not os.path.exists(manager_object.get_dbpath() + '.green')
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM instructions")
+        assert result['cnt'][0] == 1537
+
+    def test_failed_swap(self, manager_object, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents)
+        generation = manager_object.get_generation()
+        # A backup left over by an earlier swap
+        os.mkdir(manager_object.get_dbpath() + '.old')
+
+        with pytest.raises(DatabaseManagerError):
+            manager_object.swap_database(manager_object.get_dbpath() + '.missing')
+
+        # The current database is back in place and running
+        assert manager_object.get_generation() == generation
+        assert not os.path.exists(manager_object.get_dbpath() + '.old.1')
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM instructions")
+        assert result['cnt'][0] == 728
@@ -0,0 +1,120 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import multiprocessing
+import threading
+
+import numpy
+import pytest
+
+from mal_analytics import sharding
+from mal_analytics.profiler_parser import ProfilerObjectParser
+
+
+class FailingManager(object):
+    """Fail the loads listed in ``failures`` and reject duplicate
+    executions, like the primary key."""
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.executions = set()
+        self.loads = 0
+        self.closed = False
+
+    def create_parser(self, compact=False):
+        return ProfilerObjectParser(compact=compact)
+
+    def load_parsed_data(self, pob):
+        self.loads += 1
+        executions = pob.get_data()['mal_execution']['execution_id']
+        if self.loads in self.failures or self.executions.intersection(executions):
+            raise ValueError("Load {} failed".format(self.loads))
+        self.executions.update(executions)
+        pob.clear_internal_state()
+
+    def close_database(self):
+        self.closed = True
+
+
+def run_worker(monkeypatch, dbm, requests):
+    """Send requests to a shard worker running in a thread and return
+    its replies."""
+    monkeypatch.setattr(sharding, 'DatabaseManager', lambda dbpath: dbm)
+    parent_end, child_end = multiprocessing.Pipe()
+    worker = threading.Thread(target=sharding._shard_worker, args=('shard', False, child_end))
+    worker.daemon = True
+    worker.start()
+    replies = list()
+    for request in requests:
+        parent_end.send(request)
+        replies.append(parent_end.recv()[0])
+    worker.join(5)
+    assert not worker.is_alive()
+    return replies
+
+
+class TestSharding(object):
+    def test_merge_aggregates(self):
+        shard_results = [
+            {'module': numpy.array(['algebra', 'bat'], dtype=object),
+             'cnt': numpy.array([3, 1]),
+             'longest': numpy.array([10, 4])},
+            {'module': numpy.array(['algebra'], dtype=object),
+             'cnt': numpy.array([2]),
+             'longest': numpy.array([12])},
+        ]
+        merged = sharding.merge_aggregates(shard_results, ['module'], {'cnt': 'count', 'longest': 'max'})
+        assert merged == {'module': ['algebra', 'bat'], 'cnt': [5, 1], 'longest': [12, 4]}
+
+        # Without grouping columns
+        merged = sharding.merge_aggregates(shard_results, aggregates={'cnt': 'sum', 'longest': 'min'})
+        assert merged == {'cnt': [6], 'longest': [4]}
+
+        with pytest.raises(ValueError):
+            sharding.merge_aggregates(shard_results, aggregates={'cnt': 'avg'})
+
+    def test_merge_top_k(self):
+        shard_results = [
+            {'pc': numpy.array([1, 2]), 'duration': numpy.array([50, 10])},
+            {'pc': numpy.array([7]), 'duration': numpy.array([30])},
+        ]
+        merged = sharding.merge_top_k(shard_results, 'duration', 2)
+        assert merged == {'pc': [1, 7], 'duration': [50, 30], 'shard': [0, 1]}
+        merged = sharding.merge_top_k(shard_results, 'duration', 1, descending=False)
+        assert merged == {'pc': [2], 'duration': [10], 'shard': [0]}
+
+    def test_federated_queries(self, tmp_path, supervisor_trace, worker1_trace, worker2_trace):
+        traces = supervisor_trace + worker1_trace + worker2_trace
+        with sharding.ShardedDatabase((tmp_path / 'shards').as_posix(), shards=2) as sdb:
+            sessions = set([obj['session'] for obj in traces])
+            assert set([sdb.shard_for_session(s) for s in sessions]) <= set([0, 1])
+
+            loaded = sdb.ingest(traces)
+            assert sum(loaded) == len(traces)
+
+            merged = sdb.aggregate("SELECT count(*) AS cnt, max(duration) AS longest FROM instruction_run",
+                                   aggregates={'cnt': 'count', 'longest': 'max'})
+            parser = ProfilerObjectParser()
+            parser.parse_trace_stream(traces)
+            assert merged['cnt'] == [len(parser.get_data()['instruction_run']['instruction_run_id'])]
+
+            top = sdb.top_k("SELECT pc, duration FROM instruction_run", 'duration', k=5)
+            assert len(top['duration']) == 5
+            assert top['duration'][0] == merged['longest'][0]
+
+    def test_failed_close(self, monkeypatch):
+        dbm = FailingManager(failures=[1])
+        assert run_worker(monkeypatch, dbm, [('close', ())]) == ['error']
+        assert dbm.closed
+
+    def test_failed_ingest_state(self, monkeypatch, query_trace1):
+        half = len(query_trace1) // 2
+        first, rest = query_trace1[:half], query_trace1[half:]
+        dbm = FailingManager(failures=[2])
+        requests = [('ingest', (first,)), ('ingest', (rest,)), ('ingest', (rest,)), ('close', ())]
+        assert run_worker(monkeypatch, dbm, requests) == ['ok', 'error', 'ok', 'ok']
+        # The retried data continues the execution of the first ingestion
+        assert dbm.executions == set([1])
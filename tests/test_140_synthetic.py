@@ -0,0 +1,55 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import pytest
+
+from mal_analytics import profiler_parser
+from mal_analytics import trace_reader
+from mal_analytics.synthetic import TraceGenerator
+
+
+class TestSyntheticTraces(object):
+    def test_deterministic(self):
+        assert list(TraceGenerator(seed=7)) == list(TraceGenerator(seed=7))
+        assert list(TraceGenerator(seed=7)) != list(TraceGenerator(seed=8))
+
+    def test_parsed_counts(self):
+        generator = TraceGenerator(seed=1, sessions=2, executions=5, instructions=20,
+                                   call_depth=2, workers=2, heartbeat_interval=10000)
+        parser = profiler_parser.ProfilerObjectParser()
+        parser.parse_trace_stream(generator)
+        data = parser.get_data()
+
+        for table, count in generator.expected_counts().items():
+            assert len(next(iter(data[table].values()))) == count
+
+        # One remote relation per worker execution
+        assert data["initiates_executions"]["remote"].count(True) == 2 * 5 * 2
+        assert len(data["heartbeat"]["heartbeat_id"]) > 0
+        assert all([len(q) > 0 for q in data["query"]["query_text"]])
+
+    def test_compression(self, tmp_path):
+        generator = TraceGenerator(seed=2, executions=3, instructions=10)
+        expected = list(generator)
+        for compression in [None, 'gz', 'bz2']:
+            filename = str(tmp_path / 'trace_{}.json'.format(compression))
+            assert generator.write_trace(filename, compression) == len(expected)
+            assert trace_reader.read_trace(filename) == expected
+
+    def test_too_few_instructions(self):
+        with pytest.raises(ValueError):
+            TraceGenerator(instructions=3, call_depth=1, workers=1)
+
+    def test_load(self, manager_object):
+        generator = TraceGenerator(seed=3, sessions=2, executions=4, instructions=15,
+                                   call_depth=1, workers=1)
+        pob = manager_object.create_parser()
+        pob.parse_trace_stream(generator)
+        manager_object.load_parsed_data(pob)
+
+        for table, count in generator.expected_counts().items():
+            res = manager_object.execute_query("SELECT count(*) AS cnt FROM {}".format(table))
+            assert res['cnt'][0] == count
@@ -0,0 +1,112 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import json
+import logging
+
+from mal_analytics import profiler_parser
+from mal_analytics import stats
+from mal_analytics import trace_reader
+from mal_analytics.db_manager import DatabaseManager
+
+
+class TestStats(object):
+    def test_counters_and_timers(self):
+        collector = stats.IngestStats()
+        collector.increment('objects_parsed', 10)
+        collector.increment('objects_parsed')
+        with collector.timer('parse'):
+            pass
+        collector.add_time('parse', 1.0)
+
+        result = collector.get_stats()
+        assert result['counters'] == {'objects_parsed': 11}
+        assert result['timers']['parse'] > 1.0
+
+        collector.reset()
+        assert collector.get_stats() == {'counters': {}, 'timers': {}}
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.delenv(stats.ENVIRONMENT_VARIABLE, raising=False)
+        collector = stats.create_stats()
+        assert collector is stats.NULL_STATS
+
+        collector.increment('objects_parsed', 10)
+        with collector.timer('parse'):
+            pass
+        assert collector.get_stats() == {'counters': {}, 'timers': {}}
+
+        monkeypatch.setenv(stats.ENVIRONMENT_VARIABLE, '1')
+        assert stats.create_stats().enabled
+        assert not stats.create_stats(False).enabled
+
+    def test_log_summary(self, caplog):
+        collector = stats.IngestStats()
+        collector.increment('bytes_read', 100)
+        with caplog.at_level(logging.INFO, logger='mal_analytics.stats'):
+            collector.log_summary('ingest', trace='trace.json')
+
+        record = json.loads(caplog.records[-1].getMessage())
+        assert record['event'] == 'ingest'
+        assert record['trace'] == 'trace.json'
+        assert record['counters'] == {'bytes_read': 100}
+
+        # Only the values of the last operation
+        start = collector.get_stats()
+        collector.increment('bytes_read', 20)
+        collector.increment('objects_decoded', 2)
+        with caplog.at_level(logging.INFO, logger='mal_analytics.stats'):
+            collector.log_summary('ingest', start)
+
+        record = json.loads(caplog.records[-1].getMessage())
+        assert record['counters'] == {'bytes_read': 20, 'objects_decoded': 2}
+        assert record['timers'] == {}
+
+    def test_parser_stats(self, query_trace1):
+        parser = profiler_parser.ProfilerObjectParser(stats=stats.IngestStats())
+        parser.parse_trace_stream(query_trace1)
+
+        result = parser.get_stats()
+        assert result['counters']['objects_parsed'] == len(query_trace1)
+        assert result['counters']['events_parsed'] == 1456
+        assert result['counters']['variables_parsed'] == 865
+        assert result['counters']['heartbeats_parsed'] == 0
+        assert result['timers']['parse'] > 0
+
+        # Disabled by default
+        parser = profiler_parser.ProfilerObjectParser()
+        parser.parse_trace_stream(query_trace1)
+        assert parser.get_stats() == {'counters': {}, 'timers': {}}
+
+    def test_read_trace_stats(self, filenames):
+        collector = stats.IngestStats()
+        objects = trace_reader.read_trace(filenames[1], collector)
+
+        result = collector.get_stats()
+        assert result['counters']['objects_decoded'] == len(objects)
+        assert 0 < result['counters']['bytes_read'] < len(json.dumps(objects))
+        assert result['timers']['decode'] > 0
+
+    def test_manager_stats(self, tmp_path, query_trace1):
+        dbm = DatabaseManager(str(tmp_path / 'stats_db'), collect_stats=True)
+        try:
+            contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+            dbm.parse_trace(contents)
+
+            result = dbm.get_stats()
+            assert result['counters']['objects_decoded'] == len(query_trace1)
+            assert result['counters']['events_parsed'] == 1456
+            assert result['counters']['rows_inserted.profiler_event'] == 1456
+            assert result['counters']['rows_inserted.mal_variable'] == 865
+            assert result['counters']['rows_rejected'] == 0
+            for stage in ['decode', 'parse', 'drop_constraints', 'insert',
+                          'enforce_constraints', 'add_constraints', 'commit']:
+                assert stage in result['timers']
+
+            dbm.reset_stats()
+            assert dbm.get_stats() == {'counters': {}, 'timers': {}}
+        finally:
+            dbm.close_database()
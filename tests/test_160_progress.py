@@ -0,0 +1,118 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+from io import StringIO
+import json
+import os
+
+from mal_analytics import profiler_parser
+from mal_analytics import quarantine
+from mal_analytics import trace_reader
+from mal_analytics.progress import ProgressReport
+from mal_analytics.progress import ProgressTracker
+from mal_analytics.progress import TextProgressBar
+from mal_analytics.synthetic import TraceGenerator
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgress(object):
+    def test_rate_limit(self):
+        clock = FakeClock()
+        reports = list()
+        tracker = ProgressTracker(reports.append, size=1000, interval=1.0, clock=clock)
+
+        tracker.start_phase('read')
+        assert len(reports) == 1
+        clock.now += 0.5
+        tracker.advance(10, 100)
+        assert len(reports) == 1
+        clock.now += 0.5
+        tracker.advance(10, 250)
+        assert len(reports) == 2
+
+        report = reports[-1]
+        assert report.phase == 'read'
+        assert report.position == 250
+        assert report.objects == 20
+        assert report.objects_per_second == 20
+        # 250 bytes per second, 750 bytes to go
+        assert report.eta == 3.0
+
+        # A new phase is always reported
+        tracker.start_phase('parse', total_objects=100)
+        assert reports[-1].phase == 'parse'
+        clock.now += 2
+        tracker.advance(25)
+        assert reports[-1].eta == 6.0
+        assert reports[-1].elapsed == 3.0
+
+        tracker.finish()
+        assert reports[-1].phase == 'done'
+        assert reports[-1].position == 1000
+
+    def test_text_progress_bar(self):
+        stream = StringIO()
+        bar = TextProgressBar(stream, width=10)
+        bar(ProgressReport('read', 512 * 1024, 1024 * 1024, 100, None, 50.0, 2.0, 2.0))
+        output = stream.getvalue()
+        assert '[#####     ]' in output
+        assert ' 50% read' in output
+        assert '512.0 KB/1.0 MB' in output
+        assert '50 obj/s' in output
+        assert 'ETA 0:00:02' in output
+
+        bar(ProgressReport('done', 1024, 1024, 0, None, None, 3725.0, None))
+        assert stream.getvalue().endswith('elapsed 1:02:05\x1b[K\n')
+
+    def test_read_trace_progress(self, tmp_path):
+        filename = str(tmp_path / 'trace.json.gz')
+        count = TraceGenerator(executions=20, instructions=50).write_trace(filename, 'gz')
+
+        reports = list()
+        tracker = ProgressTracker(reports.append, os.path.getsize(filename), interval=0)
+        objects = trace_reader.read_trace(filename, progress=tracker)
+        assert len(objects) == count
+
+        positions = [r.position for r in reports if r.phase == 'read']
+        assert positions == sorted(positions)
+        assert 0 < positions[-1] <= os.path.getsize(filename)
+        assert reports[-1].objects == count // 1000 * 1000
+
+    def test_parser_progress(self, query_trace1):
+        reports = list()
+        parser = profiler_parser.ProfilerObjectParser()
+        parser.parse_trace_stream(query_trace1, ProgressTracker(reports.append, interval=0))
+
+        assert reports[0].phase == 'parse'
+        assert reports[0].total_objects == len(query_trace1)
+        assert reports[-1].objects == 1000
+
+    def test_ingest_progress(self, manager_object, query_trace1):
+        # Positions are in bytes, also when they differ from characters
+        objects = [dict(query_trace1[0], note='\u00e9t\u00e9')] + query_trace1[1:]
+        contents = "\n".join([json.dumps(obj, ensure_ascii=False) for obj in objects]) + "\n"
+        reports = list()
+        manager_object.parse_trace(contents, progress=reports.append)
+
+        phases = list()
+        for report in reports:
+            if not phases or phases[-1] != report.phase:
+                phases.append(report.phase)
+        assert phases == ['read', 'parse', 'load', 'constraints', 'done']
+        assert reports[-1].position == len(contents.encode('utf-8'))
+        assert reports[-1].size == len(contents.encode('utf-8'))
+
+        # The same unit with a quarantine
+        reports = list()
+        manager_object.parse_trace(contents, progress=reports.append, quarantine=quarantine.Quarantine())
+        assert reports[-1].position == reports[-1].size == len(contents.encode('utf-8'))
@@ -0,0 +1,64 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import json
+import os
+import pstats
+
+from mal_analytics import profiler_parser
+from mal_analytics import profiling
+
+
+class TestProfiling(object):
+    def test_profile_directory(self, monkeypatch):
+        monkeypatch.delenv(profiling.ENVIRONMENT_VARIABLE, raising=False)
+        assert profiling.profile_directory('/data/db') is None
+        assert profiling.profile_directory('/data/db', True) == '/data/db-profiles'
+        assert profiling.profile_directory('/data/db/', True) == '/data/db-profiles'
+        assert profiling.profile_directory('/data/db', '/tmp/profiles') == '/tmp/profiles'
+
+        monkeypatch.setenv(profiling.ENVIRONMENT_VARIABLE, '1')
+        assert profiling.profile_directory('/data/db') == '/data/db-profiles'
+        assert profiling.profile_directory('/data/db', False) is None
+        monkeypatch.setenv(profiling.ENVIRONMENT_VARIABLE, '/tmp/profiles')
+        assert profiling.profile_directory('/data/db') == '/tmp/profiles'
+        monkeypatch.setenv(profiling.ENVIRONMENT_VARIABLE, '0')
+        assert profiling.profile_directory('/data/db') is None
+
+    def test_disabled(self, monkeypatch):
+        monkeypatch.delenv(profiling.ENVIRONMENT_VARIABLE, raising=False)
+        with profiling.profile_ingest('/data/db', 'trace.json') as profiler:
+            assert profiler is None
+
+    def test_profile(self, tmp_path, query_trace1):
+        directory = str(tmp_path / 'profiles')
+        with profiling.profile_ingest(str(tmp_path / 'db'), '/traces/Q01 trace.json', directory) as profiler:
+            parser = profiler_parser.ProfilerObjectParser()
+            parser.parse_trace_stream(query_trace1)
+
+        stats_path, report_path = profiler.get_paths()
+        assert os.path.dirname(stats_path) == directory
+        assert os.path.basename(stats_path).startswith('Q01_trace.json-')
+
+        stats = pstats.Stats(stats_path)
+        assert any(['parse_trace_stream' in function for _, _, function in stats.stats])
+
+        with open(report_path) as fl:
+            report = fl.read()
+        assert 'Profile of /traces/Q01 trace.json' in report
+        assert 'revision: ' in report
+        assert 'Top allocations' in report
+        assert 'profiler_parser.py' in report
+
+    def test_profile_ingest(self, manager_object, query_trace1, tmp_path):
+        directory = tmp_path / 'profiles'
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]) + "\n"
+        manager_object.parse_trace(contents, profile=str(directory), source='/traces/q1.json')
+
+        profiles = [p for p in directory.iterdir() if p.suffix == '.prof']
+        assert len(profiles) == 1
+        assert 'q1.json' in profiles[0].name
+        assert len([p for p in directory.iterdir() if p.suffix == '.txt']) == 1
@@ -0,0 +1,102 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+from urllib.request import urlopen
+
+from mal_analytics import metrics
+from mal_analytics.profiler_parser import ProfilerObjectParser
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1546300800.0
+
+    def __call__(self):
+        return self.now
+
+
+def samples(text):
+    result = dict()
+    for line in text.splitlines():
+        if line.startswith('#'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        result[name] = float(value)
+    return result
+
+
+class TestMetrics(object):
+    def test_histogram(self):
+        histogram = metrics.Histogram([1, 10])
+        for value in [0.5, 1, 5, 20]:
+            histogram.observe(value)
+        assert histogram.render('h') == [
+            'h_bucket{le="1"} 2',
+            'h_bucket{le="10"} 3',
+            'h_bucket{le="+Inf"} 4',
+            'h_sum 26.5',
+            'h_count 4',
+        ]
+
+    def test_render(self, tmp_path):
+        (tmp_path / 'data').write_bytes(b'x' * 100)
+        clock = FakeClock()
+        ingest = metrics.IngestMetrics(str(tmp_path), clock=clock)
+        text = ingest.render()
+        assert '# TYPE mal_analytics_batch_load_seconds histogram' in text
+        assert 'mal_analytics_ingest_lag_seconds' not in text
+
+        ingest.set_queue_depth(3)
+        ingest.record_batch(1000, 800, 0.2, newest_ctime=(clock.now - 30) * 1000000, rejected=2)
+        ingest.record_failure()
+        clock.now += 4
+        values = samples(ingest.render())
+
+        assert values['mal_analytics_objects_total'] == 1000
+        assert values['mal_analytics_events_total'] == 800
+        assert values['mal_analytics_events_per_second'] == 200
+        assert values['mal_analytics_ingest_lag_seconds'] == 34
+        assert values['mal_analytics_rejected_rows_total'] == 2
+        assert values['mal_analytics_failed_batches_total'] == 1
+        assert values['mal_analytics_queue_depth'] == 3
+        assert values['mal_analytics_batch_objects_bucket{le="1000"}'] == 1
+        assert values['mal_analytics_batch_objects_bucket{le="100"}'] == 0
+        assert values['mal_analytics_batch_load_seconds_count'] == 1
+        assert values['mal_analytics_database_size_bytes'] == 100
+
+        # The rate covers a fixed window, whatever the renders
+        assert samples(ingest.render())['mal_analytics_events_per_second'] == 200
+        clock.now += 36
+        assert samples(ingest.render())['mal_analytics_events_per_second'] == 20
+        clock.now += 21
+        assert samples(ingest.render())['mal_analytics_events_per_second'] == 0
+        ingest.record_batch(10, 120, 0.1)
+        clock.now += 1
+        assert samples(ingest.render())['mal_analytics_events_per_second'] == 2
+
+    def test_exporter(self, tmp_path):
+        ingest = metrics.IngestMetrics()
+        ingest.record_batch(10, 5, 0.01)
+        path = str(tmp_path / 'ingest.prom')
+        exporter = metrics.MetricsExporter(ingest, path=path, port=0, interval=60)
+        exporter.start()
+        host, port = exporter.get_address()
+        body = urlopen('http://{}:{}/metrics'.format(host, port)).read().decode('utf-8')
+        exporter.stop()
+
+        assert samples(body)['mal_analytics_objects_total'] == 10
+        with open(path) as fl:
+            assert samples(fl.read())['mal_analytics_events_total'] == 5
+        assert not (tmp_path / 'ingest.prom.tmp').exists()
+
+    def test_newest_time(self, query_trace1):
+        parser = ProfilerObjectParser()
+        assert parser.get_newest_time() is None
+        parser.parse_trace_stream(query_trace1[:10])
+        first = parser.get_newest_time()
+        parser.parse_trace_stream(query_trace1[10:])
+        assert parser.get_newest_time() == max([o['ctime'] for o in query_trace1 if 'ctime' in o])
+        assert parser.get_newest_time() >= first
@@ -0,0 +1,154 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import argparse
+import gzip
+import io
+import json
+import os
+
+import pytest
+
+from mal_analytics import cli
+from mal_analytics import trace_reader
+from mal_analytics.profiler_parser import ProfilerObjectParser
+from mal_analytics.synthetic import TraceGenerator
+
+
+class RecordingManager(object):
+    """Record the number of objects in every load instead of storing them."""
+
+    def __init__(self):
+        self.loads = list()
+
+    def create_parser(self, compact=False):
+        return ProfilerObjectParser(compact=compact)
+
+    def load_parsed_data(self, pob):
+        self.loads.append(len(pob.get_data()['profiler_event']['event_id']))
+        pob.clear_internal_state()
+        return 0
+
+
+class TestCommandLine(object):
+    def test_parse_size(self):
+        assert cli.parse_size('100') == 100
+        assert cli.parse_size('4k') == 4096
+        assert cli.parse_size('1.5M') == 1536 * 1024
+        assert cli.parse_size('2GB') == 2 * 1024 ** 3
+        with pytest.raises(argparse.ArgumentTypeError):
+            cli.parse_size('lots')
+
+    def test_expand_inputs(self, tmp_path):
+        (tmp_path / 'a' / 'b').mkdir(parents=True)
+        for name in ['a/q1.json', 'a/b/q2.json.gz', 'a/notes.txt', 'q3.json']:
+            (tmp_path / name).write_text('')
+        root = str(tmp_path)
+
+        assert cli.expand_inputs([os.path.join(root, 'a')]) == [
+            os.path.join(root, 'a', 'b', 'q2.json.gz'),
+            os.path.join(root, 'a', 'q1.json'),
+        ]
+        assert cli.expand_inputs([os.path.join(root, '**', '*.json'), '-']) == [
+            os.path.join(root, 'a', 'q1.json'),
+            os.path.join(root, 'q3.json'),
+            '-',
+        ]
+        # Duplicates are dropped
+        assert cli.expand_inputs([os.path.join(root, 'q3.json'), os.path.join(root, '*.json')]) == [
+            os.path.join(root, 'q3.json'),
+        ]
+        with pytest.raises(ValueError):
+            cli.expand_inputs([os.path.join(root, 'missing.json')])
+
+    def test_read_stream(self, query_trace1):
+        contents = "\n".join([json.dumps(obj) for obj in query_trace1]).encode('utf-8')
+        assert trace_reader.read_stream(io.BytesIO(contents)) == query_trace1
+        assert trace_reader.read_stream(io.BytesIO(gzip.compress(contents))) == query_trace1
+        assert trace_reader.read_stream(io.BytesIO(gzip.compress(contents)), 'gz') == query_trace1
+
+    def test_follow(self, tmp_path, query_trace1):
+        path = str(tmp_path / 'trace.json')
+        lines = [json.dumps(obj) + "\n" for obj in query_trace1]
+        with open(path, 'w') as fl:
+            fl.write(''.join(lines[:500]))
+
+        appended = []
+
+        def append_rest():
+            # Called in every iteration: write the rest of the trace
+            # once, then stop after it has been read.
+            if not appended:
+                with open(path, 'a') as fl:
+                    fl.write(''.join(lines[500:]))
+                appended.append(True)
+                return False
+            return True
+
+        dbm = RecordingManager()
+        with open(path, 'rb') as fl:
+            loaded = trace_reader.follow_trace(dbm, fl, batch_objects=100, poll=0,
+                                               should_stop=append_rest)
+        assert loaded < len(query_trace1)
+
+        dbm = RecordingManager()
+        with open(path, 'rb') as fl:
+            loaded = trace_reader.follow_trace(dbm, fl, batch_objects=100, stop_at_eof=True)
+        assert loaded == len(query_trace1)
+        assert sum(dbm.loads) == 728 * 2
+
+    def test_follow_resync(self, tmp_path, query_trace1):
+        path = str(tmp_path / 'trace.json')
+        # One key per line, like the formatted traces of the profiler
+        contents = "".join(["{\n" + ",\n".join([json.dumps(k) + ":" + json.dumps(v) for k, v in obj.items()]) + "\n}\n"
+                            for obj in query_trace1]).encode('utf-8')
+        with open(path, 'wb') as fl:
+            fl.write(contents)
+
+        # Start in the middle of the second object
+        offset = contents.index(b'\n{') + 5
+        dbm = RecordingManager()
+        with open(path, 'rb') as fl:
+            fl.seek(offset)
+            loaded = trace_reader.follow_trace(dbm, fl, batch_objects=100, stop_at_eof=True,
+                                               resync=True)
+        assert loaded == len(query_trace1) - 2
+
+        # Start in the middle of a line that starts a nested object
+        with open(path, 'wb') as fl:
+            fl.write(b'"a": 1}\n{"b": {"c": 2}}\n' + contents)
+        dbm = RecordingManager()
+        with open(path, 'rb') as fl:
+            fl.seek(len('"a": 1}\n{"b": '))
+            loaded = trace_reader.follow_trace(dbm, fl, batch_objects=100, stop_at_eof=True,
+                                               resync=True)
+        assert loaded == len(query_trace1)
+
+    def test_ingest(self, manager_object, filenames, tmp_path):
+        extra = str(tmp_path / 'synthetic.json.gz')
+        count = TraceGenerator(executions=5, instructions=20).write_trace(extra, 'gz')
+        inputs = cli.expand_inputs(filenames[:1] + [extra])
+
+        reports = list()
+        loaded = cli.ingest(manager_object, inputs, batch_size=2, progress=reports.append)
+        assert loaded == len(trace_reader.read_trace(filenames[0])) + count
+        assert reports[-1].phase == 'done'
+
+        stats = cli.database_stats(manager_object)
+        assert stats['rows']['mal_execution'] > 0
+        assert stats['first_event'] <= stats['last_event']
+        assert stats['size'] > 0
+        assert stats['partitions'] is None
+
+    def test_parallel_ingest(self, manager_object, tmp_path):
+        inputs = list()
+        for seed in range(3):
+            path = str(tmp_path / 'trace{}.json'.format(seed))
+            TraceGenerator(seed=seed, executions=3, instructions=10).write_trace(path)
+            inputs.append(path)
+
+        loaded = cli.ingest(manager_object, inputs, workers=2, batch_size=2)
+        assert loaded == sum([len(trace_reader.read_trace(fl)) for fl in inputs])
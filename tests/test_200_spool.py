@@ -0,0 +1,154 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import os
+import threading
+import time
+
+from mal_analytics import metrics
+from mal_analytics.profiler_parser import ProfilerObjectParser
+from mal_analytics.spool import SpoolWatcher
+from mal_analytics.synthetic import TraceGenerator
+
+
+class RecordingManager(object):
+    """Record the number of traces in every load instead of storing them."""
+
+    def __init__(self, fail_on=None):
+        self.loads = list()
+        self._fail_on = fail_on
+
+    def create_parser(self, compact=False, memory_budget=None):
+        return ProfilerObjectParser(compact=compact, memory_budget=memory_budget)
+
+    def bulk_load(self, pob, json_streams):
+        loaded = 0
+        for stream in json_streams:
+            if self._fail_on is not None and any([self._fail_on in o for o in stream]):
+                raise ValueError("Bad trace")
+            pob.parse_trace_stream(stream)
+            loaded += len(stream)
+        self.loads.append(len(json_streams))
+        return loaded
+
+
+def write_traces(directory, count, seed=0):
+    names = list()
+    for i in range(count):
+        name = 'q{:03d}.json'.format(i)
+        TraceGenerator(seed=seed + i, executions=2, instructions=5).write_trace(os.path.join(directory, name))
+        names.append(name)
+    return names
+
+
+class TestSpool(object):
+    def test_batches(self, tmp_path):
+        spool = str(tmp_path)
+        names = write_traces(spool, 5)
+        (tmp_path / '.partial.json').write_text('{')
+        (tmp_path / 'notes.txt').write_text('')
+
+        dbm = RecordingManager()
+        ingest = metrics.IngestMetrics()
+        watcher = SpoolWatcher(dbm, spool, batch_files=2, settle=0, metrics=ingest)
+        while watcher.process_batch():
+            pass
+        watcher.close()
+
+        assert dbm.loads == [2, 2, 1]
+        assert sorted(os.listdir(os.path.join(spool, 'done'))) == names
+        assert os.listdir(os.path.join(spool, 'processing')) == []
+        assert sorted(os.listdir(spool)) == ['.partial.json', 'done', 'failed', 'notes.txt', 'processing']
+        assert 'mal_analytics_batch_objects_count 3\n' in ingest.render()
+
+    def test_batch_bytes(self, tmp_path):
+        write_traces(str(tmp_path), 3)
+        size = os.path.getsize(str(tmp_path / 'q000.json'))
+        dbm = RecordingManager()
+        watcher = SpoolWatcher(dbm, str(tmp_path), batch_bytes=size * 2 - 1, settle=0,
+                               use_inotify=False)
+        while watcher.process_batch():
+            pass
+        assert dbm.loads == [1, 1, 1]
+
+    def test_settle(self, tmp_path):
+        write_traces(str(tmp_path), 2)
+        os.utime(str(tmp_path / 'q000.json'), (time.time() - 60, time.time() - 60))
+        watcher = SpoolWatcher(RecordingManager(), str(tmp_path), settle=30, use_inotify=False)
+        ready, unsettled = watcher.scan()
+        assert [name for name, _ in ready] == ['q000.json']
+        assert unsettled == 1
+
+    def test_failures(self, tmp_path):
+        spool = str(tmp_path)
+        write_traces(spool, 3)
+        (tmp_path / 'broken.json').write_text('{"source": \n}\n')
+        with open(str(tmp_path / 'q001.json'), 'a') as fl:
+            fl.write('{"source": "trace", "poison": 1}\n')
+
+        dbm = RecordingManager(fail_on='poison')
+        watcher = SpoolWatcher(dbm, spool, settle=0, use_inotify=False)
+        watcher.process_batch()
+
+        assert sorted(os.listdir(os.path.join(spool, 'done'))) == ['q000.json', 'q002.json']
+        assert sorted(os.listdir(os.path.join(spool, 'failed'))) == [
+            'broken.json', 'broken.json.error', 'q001.json', 'q001.json.error']
+        with open(os.path.join(spool, 'failed', 'q001.json.error')) as fl:
+            assert 'Bad trace' in fl.read()
+        # The batch was retried file by file
+        assert dbm.loads == [1, 1]
+
+    def test_recover_and_collisions(self, tmp_path):
+        spool = str(tmp_path)
+        watcher = SpoolWatcher(RecordingManager(), spool, settle=0, use_inotify=False)
+        write_traces(spool, 1)
+        watcher.claim(['q000.json'])
+        # Files claimed by another watcher are left alone
+        watcher.run(lambda: True)
+        assert os.listdir(os.path.join(spool, 'processing')) == ['q000.json']
+        watcher.run(lambda: True, recover=True)
+        assert os.listdir(os.path.join(spool, 'processing')) == []
+        assert watcher.recover() == 0
+        watcher.process_batch()
+
+        write_traces(spool, 1, seed=5)
+        watcher.process_batch()
+        assert sorted(os.listdir(os.path.join(spool, 'done'))) == ['q000.json', 'q000.json.1']
+
+    def test_run(self, tmp_path):
+        spool = str(tmp_path)
+        dbm = RecordingManager()
+        watcher = SpoolWatcher(dbm, spool, settle=0, poll=0.05)
+        stop = threading.Event()
+        thread = threading.Thread(target=watcher.run, args=(stop.is_set,))
+        thread.start()
+
+        staging = tmp_path / 'staging'
+        staging.mkdir()
+        write_traces(str(staging), 3)
+        for name in sorted(os.listdir(str(staging))):
+            os.rename(str(staging / name), os.path.join(spool, name))
+
+        deadline = time.time() + 10
+        while len(os.listdir(os.path.join(spool, 'done'))) < 3 and time.time() < deadline:
+            time.sleep(0.05)
+        stop.set()
+        thread.join()
+        watcher.close()
+
+        assert len(os.listdir(os.path.join(spool, 'done'))) == 3
+        assert sum(dbm.loads) == 3
+
+    def test_load(self, manager_object, tmp_path):
+        spool = tmp_path / 'spool'
+        spool.mkdir()
+        write_traces(str(spool), 4)
+        watcher = SpoolWatcher(manager_object, str(spool), settle=0, use_inotify=False)
+        assert watcher.process_batch() == 4
+
+        expected = 4 * TraceGenerator(executions=2, instructions=5).expected_counts()['mal_execution']
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM mal_execution")
+        assert result['cnt'][0] == expected
@@ -0,0 +1,195 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright MonetDB Solutions B.V. 2018-2019
+
+import copy
+import gzip
+import io
+import json
+import pickle
+
+import pytest
+
+from mal_analytics import cli
+from mal_analytics import profiler_parser
+from mal_analytics import quarantine
+from mal_analytics import trace_reader
+from mal_analytics.exceptions import ErrorBudgetExceeded
+from mal_analytics.exceptions import MalParserError
+
+
+def invalid_objects(trace):
+    """Invalid copies of the first event with arguments."""
+    event = [o for o in trace if o.get('source') == 'trace' and o.get('arg')][0]
+    no_session = copy.deepcopy(event)
+    del no_session['session']
+    no_tag = copy.deepcopy(event)
+    del no_tag['tag']
+    unnamed = copy.deepcopy(event)
+    del unnamed['arg'][0]['name']
+    return no_session, no_tag, unnamed
+
+
+def damaged_trace(trace):
+    """A trace with invalid objects after the 10th, 20th, ... objects.
+
+    Returns:
+        The bytes of the trace and a dictionary with the byte offset of
+        every invalid object, keyed by the reason.
+    """
+    no_session, no_tag, unnamed = invalid_objects(trace)
+    inserted = [
+        (quarantine.INVALID_JSON, '{"source": "trace", oops}'),
+        (quarantine.MISSING_SESSION, json.dumps(no_session)),
+        (quarantine.MISSING_TAG, json.dumps(no_tag)),
+        (quarantine.UNNAMED_VARIABLE, json.dumps(unnamed)),
+    ]
+    data = b''
+    offsets = dict()
+    for i, obj in enumerate(trace):
+        data += json.dumps(obj).encode('utf-8') + b'\n'
+        if i % 10 == 9 and inserted:
+            reason, text = inserted.pop(0)
+            offsets[reason] = len(data)
+            data += text.encode('utf-8') + b'\n'
+    data += b'{"source": "heartbeat", "ctime"'
+    offsets[quarantine.INCOMPLETE_OBJECT] = len(data) - len(b'{"source": "heartbeat", "ctime"')
+    return data, offsets
+
+
+def check_records(records, offsets):
+    assert dict([(r['reason'], r['offset']) for r in records]) == offsets
+
+
+class TestQuarantine(object):
+    def test_decode_objects(self, query_trace1):
+        data, offsets = damaged_trace(query_trace1)
+        qua = quarantine.Quarantine()
+        objects, object_offsets = quarantine.decode_objects(io.BytesIO(data), qua, 'trace')
+
+        # The objects rejected by the parser are still decoded
+        assert len(objects) == len(query_trace1) + 3
+        assert len(object_offsets) == len(objects)
+        assert object_offsets[0] == 0
+        assert qua.get_counts() == {quarantine.INVALID_JSON: 1, quarantine.INCOMPLETE_OBJECT: 1}
+        check_records(qua.get_records(), dict([(r, offsets[r]) for r in qua.get_counts()]))
+
+    def test_truncated_object(self, query_trace1):
+        valid = json.dumps(query_trace1[0]).encode('utf-8') + b'\n'
+        truncated = b'{"source": "trace", "pc": 3,\n'
+        data = valid + truncated + valid + truncated + b'\n' + valid
+        qua = quarantine.Quarantine()
+        objects, object_offsets = quarantine.decode_objects(io.BytesIO(data), qua, 'trace')
+
+        # The truncated objects do not swallow the objects after them
+        assert objects == [query_trace1[0]] * 3
+        assert object_offsets == [0, len(valid) + len(truncated), 2 * len(valid) + 2 * len(truncated) + 1]
+        assert qua.get_counts() == {quarantine.INVALID_JSON: 2}
+        assert [r['offset'] for r in qua.get_records()] == [len(valid), 2 * len(valid) + len(truncated)]
+
+    def test_tolerant_parser(self, query_trace1, tmp_path):
+        data, offsets = damaged_trace(query_trace1)
+        path = str(tmp_path / 'trace.json.gz')
+        with gzip.open(path, 'wb') as fl:
+            fl.write(data)
+
+        quarantine_path = str(tmp_path / 'quarantine.jsonl')
+        with quarantine.Quarantine(quarantine_path) as qua:
+            objects = trace_reader.read_trace(path, quarantine=qua)
+            parser = profiler_parser.ProfilerObjectParser(quarantine=qua)
+            parser.parse_trace_stream(objects)
+            parser.parse_trace_stream([[1, 2]])
+            parser.flush_pending_events()
+
+        assert qua.get_total() == 6
+        assert qua.get_counts()[quarantine.NOT_AN_OBJECT] == 1
+        with open(quarantine_path) as fl:
+            records = [json.loads(ln) for ln in fl]
+        assert [r['source'] for r in records[:5]] == [path] * 5
+        check_records(records[:5], offsets)
+        assert records[-1]['object'] == '[1, 2]'
+
+        # The valid objects are parsed as if the invalid ones were not there
+        expected = profiler_parser.ProfilerObjectParser()
+        expected.parse_trace_stream(query_trace1)
+        expected.flush_pending_events()
+        for table, columns in expected.get_data().items():
+            assert parser.get_data()[table] == columns
+
+    def test_unparsable_objects(self, query_trace1):
+        event = [o for o in query_trace1 if o.get('source') == 'trace' and o.get('arg')][0]
+        not_a_variable = copy.deepcopy(event)
+        not_a_variable['arg'] = [1, 'X_1']
+        no_function = copy.deepcopy(event)
+        no_function['tag'] = -1
+        no_function['pc'] = 3
+        del no_function['function']
+        no_cpuload = {'source': 'heartbeat', 'session': event['session'], 'ctime': event['ctime']}
+
+        qua = quarantine.Quarantine()
+        parser = profiler_parser.ProfilerObjectParser(quarantine=qua)
+        parser.parse_trace_stream([not_a_variable, no_function, no_cpuload] + query_trace1)
+        assert qua.get_counts() == {quarantine.INVALID_OBJECT: 3}
+        assert [r['message'] for r in qua.get_records()][1:] == [
+            "AttributeError: 'NoneType' object has no attribute 'split'",
+            "KeyError: 'cpuload'",
+        ]
+
+        expected = profiler_parser.ProfilerObjectParser()
+        expected.parse_trace_stream(query_trace1)
+        for table, columns in expected.get_data().items():
+            assert parser.get_data()[table] == columns
+
+    def test_strict_parser(self, query_trace1):
+        for obj in invalid_objects(query_trace1):
+            with pytest.raises(MalParserError):
+                profiler_parser.ProfilerObjectParser().parse_trace_stream([obj])
+
+    def test_error_budget(self, query_trace1):
+        data, _ = damaged_trace(query_trace1)
+        qua = quarantine.Quarantine(max_errors=2)
+        objects = trace_reader.read_stream(io.BytesIO(data), quarantine=qua)
+        with pytest.raises(ErrorBudgetExceeded) as excinfo:
+            profiler_parser.ProfilerObjectParser(quarantine=qua).parse_trace_stream(objects)
+        assert '1 invalid_json' in str(excinfo.value)
+        assert qua.get_total() == 3
+
+        qua = quarantine.Quarantine(max_error_rate=0.001, min_objects=100)
+        objects = trace_reader.read_stream(io.BytesIO(data), quarantine=qua)
+        with pytest.raises(ErrorBudgetExceeded):
+            profiler_parser.ProfilerObjectParser(quarantine=qua).parse_trace_stream(objects)
+
+        qua = quarantine.Quarantine(max_error_rate=0.01, min_objects=100)
+        objects = trace_reader.read_stream(io.BytesIO(data), quarantine=qua)
+        profiler_parser.ProfilerObjectParser(quarantine=qua).parse_trace_stream(objects)
+
+    def test_merge(self, query_trace1):
+        data, offsets = damaged_trace(query_trace1)
+        local = quarantine.Quarantine()
+        objects = trace_reader.read_stream(io.BytesIO(data), quarantine=local)
+        local = pickle.loads(pickle.dumps(local))
+
+        qua = quarantine.Quarantine(max_error_rate=0.5)
+        qua.merge(local)
+        profiler_parser.ProfilerObjectParser(quarantine=qua).parse_trace_stream(objects)
+        check_records(qua.get_records(), offsets)
+        assert qua.get_records()[0]['source'] == '<stdin>'
+
+    def test_tolerant_ingest(self, manager_object, query_trace1, tmp_path):
+        data, _ = damaged_trace(query_trace1)
+        path = str(tmp_path / 'trace.json')
+        with open(path, 'wb') as fl:
+            fl.write(data)
+
+        qua = quarantine.Quarantine(stats=manager_object.get_stats_collector())
+        loaded = cli.ingest(manager_object, [path], quarantine=qua)
+        assert loaded == len(query_trace1) + 3
+        assert qua.get_total() == 5
+        result = manager_object.execute_query("SELECT count(*) AS cnt FROM instructions")
+        assert result['cnt'][0] == 728
+
+        qua = quarantine.Quarantine()
+        manager_object.parse_trace(data.decode('utf-8'), quarantine=qua)
+        assert qua.get_total() == 5